@@ -8,14 +8,13 @@ from autogen_core.models import SystemMessage, UserMessage, AssistantMessage, LL
 from autogen_core import FunctionCall
 from autogen_core.tools import Tool
 from pydantic import BaseModel
-from tenacity import retry, wait_random_exponential, stop_after_attempt
 
 import datetime
 import json
 from abc import ABC, abstractmethod
 import asyncio
 
-from ..model_client import OpenAIAPIClient
+from ..model_client import OpenAIAPIClient, ResponseCache
 from .utils import add_prompt_suffix
 
 
@@ -31,6 +30,7 @@ class AgentWithTools(BaseChatAgent):
             max_tool_calls: int,
             system_prompt: str,
             json_output: Optional[bool | type(BaseModel)] = None,
+            response_cache: Optional[ResponseCache] = None,
     ) -> None:
         super().__init__(name=name, description=description)
         self.model_client = model_client
@@ -40,6 +40,7 @@ class AgentWithTools(BaseChatAgent):
         self.max_tool_calls = max_tool_calls
         self.system_prompt = system_prompt
         self.json_output = json_output
+        self.response_cache = response_cache
         self._init_all()
 
     def _init_all(self):
@@ -59,7 +60,11 @@ class AgentWithTools(BaseChatAgent):
     async def after_call_llm(self, response_content: str, text_calls: int) -> Tuple[bool, Dict]:
         raise NotImplementedError()
 
-    def handle_model_resource(self, user_prompt: str, response_content: Union[str, List], usage: Dict, seconds: float) -> None:
+    def handle_model_resource(self, user_prompt: str, response_content: Union[str, List], usage: Dict, seconds: float, cached: bool = False) -> None:
+        """
+        Args:
+            cached: the response is replayed from the response cache, its usage was spent by an earlier run
+        """
         pass
 
     def get_last_source_content(self, source: str) -> Optional[Dict]:
@@ -119,7 +124,7 @@ class AgentWithTools(BaseChatAgent):
                 usage = response.usage
                 self.llm_messages.append(AssistantMessage(content=response_content, source='assistant'))
 
-                self.handle_model_resource(user_prompt=user_prompt, response_content=response_content, usage=usage, seconds=seconds)
+                self.handle_model_resource(user_prompt=user_prompt, response_content=response_content, usage=usage, seconds=seconds, cached=response.cached)
 
             # Tool calls
             if call_llm and type(response_content) == list and len(response_content) > 0:
@@ -143,10 +148,26 @@ class AgentWithTools(BaseChatAgent):
         self.agent_messages.append(response_message)
         return Response(chat_message=response_message)
 
-    @retry(wait=wait_random_exponential(min=3, max=10), stop=stop_after_attempt(5))
-    async def _call_llm(self, cancellation_token):
+    async def _call_llm(self, cancellation_token, messages: Optional[List[LLMMessage]] = None):
+        """
+        Args:
+            messages: the conversation to send, `self.llm_messages` by default
+        """
+        if messages is None:
+            messages = self.llm_messages
+        if self.response_cache is None:
+            return await self._create(cancellation_token, messages)
+
+        key = self.response_cache.make_key(self.model_client.model, messages, self.tools, self.sampling_args, self.json_output)
+        response = self.response_cache.get(key)
+        if response is None:
+            response = await self._create(cancellation_token, messages)
+            self.response_cache.put(key, response)
+        return response
+
+    async def _create(self, cancellation_token, messages: List[LLMMessage]):
         return await self.model_client.create(
-            messages=self.llm_messages,
+            messages=messages,
             tools=self.tools,
             extra_create_args=self.sampling_args,
             json_output=self.json_output,
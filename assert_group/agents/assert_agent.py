@@ -1,14 +1,17 @@
-from typing import List, Dict, Tuple, Union, override
+from typing import List, Dict, Tuple, Union, override, Optional
 from autogen_core.tools import Tool
 import json
 
-from .utils import extract_llm_messages, add_line_number
+from autogen_core.models import SystemMessage
+
+from .utils import extract_llm_messages
+from .prompt_layout import build_shared_system_prompt
 
 from utils import print_log, append_jsonl
 from utils.code_utils import extract_last_block
 
 from .agent_with_tools import AgentWithTools
-from ..model_client import OpenAIAPIClient
+from ..model_client import OpenAIAPIClient, ResponseCache
 from ..tools.project_tools import ProjectTools
 
 
@@ -28,22 +31,24 @@ class AssertAgent(AgentWithTools):
             with_locals: bool,
             with_explore_agent: bool,
             existing_assert_codes: List[str],
+            response_cache: Optional[ResponseCache] = None,
     ) -> None:
         name = 'AssertAgent'
         description = 'Generate assert statement.'
         self.with_dynamic = with_dynamic and len(tools) > 0
         self.with_locals = with_locals and len(tools) > 0
 
+        # the system prompt is replaced by the shared context of the sample on the first call, see `prompt_layout`
         system_prompt = 'You are a professional software engineer.'
         if lang.lower() == 'java':
-            system_prompt += '\nYou can write Java assert statements based on the method under test, unit test prefix and test setup.'
+            role_prompt = 'You can write Java assert statements based on the method under test, unit test prefix and test setup.'
         elif lang.lower() == 'python':
-            system_prompt += '\nYou can write Python assert statements based on the method under test, unit test prefix and test setup.'
+            role_prompt = 'You can write Python assert statements based on the method under test, unit test prefix and test setup.'
         else:
             raise NotImplementedError
 
         if self.with_dynamic:
-            system_prompt += '\nYou can use the `get_debug_value` tool to query the values of variables or expressions in the test function. Do not repeat the query and call this tool up to 5 times at most.'
+            role_prompt += '\nYou can use the `get_debug_value` tool to query the values of variables or expressions in the test function. Do not repeat the query and call this tool up to 5 times at most.'
 
         super().__init__(
             name=name,
@@ -54,7 +59,8 @@ class AssertAgent(AgentWithTools):
             tools=tools,
             max_tool_calls=max_tool_calls,
             system_prompt=system_prompt,
-            json_output=None
+            json_output=None,
+            response_cache=response_cache,
         )
 
         self.data = data
@@ -63,6 +69,7 @@ class AssertAgent(AgentWithTools):
         self.placeholder = placeholder
         self.with_explore_agent = with_explore_agent
         self.existing_assert_codes = existing_assert_codes
+        self.role_prompt = role_prompt
 
     @override
     def _init_all(self):
@@ -81,34 +88,14 @@ class AssertAgent(AgentWithTools):
 '''
 
         if self.act_status == 'user':
-            focal_method = self.data['focal_method']
-            test_prefix = self.data['test_prefix']
-
-            focal_method = add_line_number(
-                focal_method,
-                [i for i in range(self.data['focal_method_start_lineno'], self.data['focal_method_end_lineno'] + 1)],
-            )
-            if self.lang.lower() == 'java':
-                test_setup = '\n...\n'.join([
-                    add_line_number(
-                        ts['test_setup'],
-                        [i for i in range(ts['start_lineno'], ts['end_lineno'] + 1)]
-                    ) for ts in self.data['test_setup_list']
-                ])
-            else:
-                test_setup = add_line_number(
-                    self.data['test_setup'],
-                    [i for i in range(self.data['test_setup_start_lineno'], self.data['test_setup_end_lineno'] + 1)]
-                )
-            test_prefix = add_line_number(
-                test_prefix,
-                [i for i in range(self.data['test_prefix_start_lineno'], self.data['test_prefix_end_lineno'] + 1)]
-            )
+            # stable context of the sample first (shared with ReviewerAgent), changing parts last
+            explore_content = self.get_last_source_content('ExploreAgent') if self.with_explore_agent else None
+            self.system_prompt = build_shared_system_prompt(self.data, self.lang, explore_content)
+            self.llm_messages[0] = SystemMessage(content=self.system_prompt)
 
+            user_prompt = self.role_prompt
             if self.lang.lower() == 'java':
-                user_prompt = f'''\
-You will be provided with the file path and function body of a method under test, a test setup, and the corresponding unit test.
-The other parts of the unit test have already been written, but there is still one assert statement that has not been completed, which is located in the `{self.data['placeholder']}` position.
+                user_prompt += '''
 This assert statement should meet the following requirements:
 1. Test the method under test.
 2. Be a single line of `org.junit.Assert` statement.
@@ -116,9 +103,7 @@ This assert statement should meet the following requirements:
 4. Cannot introduce any additional dependencies that are not currently introduced.
 '''
             elif self.lang.lower() == 'python':
-                user_prompt = f'''\
-You will be provided with the file path and function body of a method under test, a test setup, and the corresponding unit test.
-The other parts of the unit test have already been written, but there is still one assert statement that has not been completed, which is located in the `{self.data['placeholder']}` position.
+                user_prompt += '''
 This assert statement should meet the following requirements:
 1. Test the method under test.
 2. Be a single line of Python assert statement.
@@ -127,19 +112,7 @@ This assert statement should meet the following requirements:
             else:
                 raise NotImplementedError
 
-            if self.with_explore_agent:
-                user_prompt += '\nYou will also be provided with the callees of method under test and unit test, along with the advice on the style of assert statement writing.\n'
-
             user_prompt += '\nYour task is to write this assert statement.\n'
-            if len(self.existing_assert_codes) > 0:
-                ext = '\n'.join(list(set(self.existing_assert_codes))).strip()
-                user_prompt += f'''\
-Here are some candidate answers, you must write one that is **completely different** from them.
-```{self.lang.lower()}
-{ext}
-```
-
-'''
 
             if self.lang.lower() == 'java':
                 user_prompt += '''\
@@ -160,34 +133,20 @@ Your final answer needs to be in strictly JSON dictionary format, with a field `
 ```
 '''
 
-            if self.with_explore_agent:
-                explore_content = self.get_last_source_content('ExploreAgent')
-                if explore_content['explore_focal_method'] != '':
-                    user_prompt += f'''\n\n\n# Code Context Related to Method Under Test\n\n{explore_content['explore_focal_method']}\n'''
-
-            user_prompt += f'''\n# Method Under Test\n...\n{focal_method}\n...\n'''
-            user_prompt += f'''\n\n# Test Setup\n...\n{test_setup}\n...\n'''
-
-            if self.with_explore_agent:
-                explore_content = self.get_last_source_content('ExploreAgent')
-                if explore_content['explore_test_prefix'] != '':
-                    user_prompt += f'''\n\n# Code Context Related to Unit Test\n\n{explore_content['explore_test_prefix']}\n'''
-
-            user_prompt += f'''\n# Unit Test\n...\n{test_prefix}\n...\n'''
-
-            if self.with_explore_agent:
-                explore_content = self.get_last_source_content('ExploreAgent')
-                if self.lang.lower() == 'java':
-                    user_prompt += f'''\n\n# Conclusion of Assert Statement Style in the Current Test Class\n\n{explore_content['explore_assert_style']}\n'''
-                elif self.lang.lower() == 'python':
-                    user_prompt += f'''\n\n# Conclusion of Assert Statement Style in the Current Test File\n\n{explore_content['explore_assert_style']}\n'''
-                else:
-                    raise NotImplementedError
-
             if self.with_locals:
                 local_vars = await self.project_tools.get_locals()
                 user_prompt += f'''\n\n# Local Variable Information\n{local_vars}\n'''
 
+            # different for every generation, keep it at the end
+            if len(self.existing_assert_codes) > 0:
+                ext = '\n'.join(sorted(set(self.existing_assert_codes))).strip()
+                user_prompt += f'''
+Here are some candidate answers, you must write one that is **completely different** from them.
+```{self.lang.lower()}
+{ext}
+```
+'''
+
         else:
             reviewer_content = self.get_last_source_content('ReviewerAgent')
             if self.with_dynamic:
@@ -242,13 +201,14 @@ Also write it in a markdown JSON block.
                 self.act_status = 'retry'
                 return True, {}
 
-    def handle_model_resource(self, user_prompt: str, response_content: Union[str, List], usage: Dict, seconds: float) -> None:
+    def handle_model_resource(self, user_prompt: str, response_content: Union[str, List], usage: Dict, seconds: float, cached: bool = False) -> None:
         append_jsonl(
             self.data['resource_file'],
             {
                 'type': 'llm', 'gen_id': self.data['gen_id'], 'agent': self.name,
                 'iters': self.iters, 'usage': usage,
-                'messages': extract_llm_messages(self.llm_messages), 'seconds': seconds
+                'messages': extract_llm_messages(self.llm_messages), 'seconds': seconds,
+                'cache_scope': self.data.get('cache_scope'), 'cached': cached,
             }
         )
         print_log(f'{self.name} - user', user_prompt, 0)
@@ -1,9 +1,11 @@
-from typing import Sequence, List, Dict, Tuple, Union, override
+from typing import Sequence, List, Dict, Tuple, Union, override, Optional
 import os
+import asyncio
+import hashlib
 from autogen_agentchat.messages import TextMessage, BaseChatMessage
 from autogen_agentchat.base import Response
 from autogen_core import CancellationToken
-from autogen_core.models import SystemMessage, UserMessage, AssistantMessage
+from autogen_core.models import SystemMessage, UserMessage, AssistantMessage, LLMMessage
 import json
 
 from utils import print_log, append_jsonl, read_file, write_file, read_json, write_json
@@ -13,9 +15,13 @@ from utils.python_utils.python_file_utils import get_python_test_file_assert_pre
 from utils.java_utils.java_file_utils import get_java_function_body_inline
 from utils.python_utils.python_file_utils import get_python_function_body_inline
 
+from utils.code_file_utils.symbol_index import get_symbol_index
+
+from ..tools.summary_cache import get_summary_cache
+
 from .utils import extract_llm_messages
 from .agent_with_tools import AgentWithTools
-from ..model_client import OpenAIAPIClient
+from ..model_client import OpenAIAPIClient, ResponseCache
 
 
 class ExploreAgent(AgentWithTools):
@@ -26,8 +32,14 @@ class ExploreAgent(AgentWithTools):
             sampling_args: Dict,
             generation_mode: str,
             lang: str,
-            placeholder: str
+            placeholder: str,
+            response_cache: Optional[ResponseCache] = None,
+            max_concurrent_requests: int = 8,
     ) -> None:
+        """
+        Args:
+            max_concurrent_requests: max summarization requests in flight at the same time
+        """
         name = 'ExploreAgent'
         description = 'Explore the repository.'
 
@@ -60,7 +72,8 @@ You should list them in points, using clear and concise language, and you can us
             generation_mode=generation_mode,
             tools=[],
             max_tool_calls=0,
-            system_prompt=''
+            system_prompt='',
+            response_cache=response_cache,
         )
         self.data = data
         self.lang = lang
@@ -70,6 +83,12 @@ You should list them in points, using clear and concise language, and you can us
         os.makedirs(self.agent_cache_dir, exist_ok=True)
 
         self.max_callees = 10  # set to 10
+        self.llm_semaphore = asyncio.Semaphore(max(1, max_concurrent_requests))
+        # shared by the runs / models given the same dir, by the samples of this run otherwise
+        summary_cache_dir = self.data.get('summary_cache_dir')
+        if summary_cache_dir is None:
+            summary_cache_dir = os.path.join(self.agent_cache_dir, 'summaries')
+        self.summary_cache = get_summary_cache(summary_cache_dir)
 
     def _init_all(self):
         super()._init_all()
@@ -80,19 +99,68 @@ You should list them in points, using clear and concise language, and you can us
     def _clear_no_system_messages(self):
         self.llm_messages = self.llm_messages[:1]
 
+    async def _summarize(self, system_prompt: str, user_prompt: str, cancellation_token) -> str:
+        """
+        One summarization request with its own messages, so that several can run at the same time.
+        """
+        messages = [
+            SystemMessage(content=system_prompt),
+            UserMessage(content=user_prompt, source='user'),
+        ]
+        async with self.llm_semaphore:
+            response = await self._call_llm(cancellation_token, messages)
+        response_content = response.content
+        messages.append(AssistantMessage(content=response_content, source='assistant'))
+        self.handle_model_resource(user_prompt, response_content, usage=response.usage, seconds=0, messages=messages, cached=response.cached)
+        return response_content
+
+    async def _summarize_callee(self, definition: Dict, fbinfo: Dict, cancellation_token) -> str:
+        user_prompt = f'''\
+### Target
+
+```{self.lang.lower()}
+{fbinfo['preview']}
+```
+'''
+        # the same callee is summarized once for all samples that call it
+        fields = {
+            'type': 'callee',
+            'lang': self.lang.lower(),
+            'repo_name': self.data['repo_name'],
+            'rel_file_path': definition['rel_file_path'],
+            'start_lineno': fbinfo['start_lineno'],
+            'content_hash': hashlib.sha256(user_prompt.encode('utf-8')).hexdigest(),
+            'system_prompt_hash': hashlib.sha256(self.system_prompt_callee.encode('utf-8')).hexdigest(),
+        }
+        return await self.summary_cache.get_or_create(
+            key=self.summary_cache.make_key(**fields),
+            create=lambda: self._summarize(self.system_prompt_callee, user_prompt, cancellation_token),
+            fields=fields,
+        )
+
     async def _explore_callees(
             self,
             callees: List[Dict],
+            rel_file_path: str,
             max_lineno: int,
             cancellation_token,
     ) -> str:
+        symbol_index = None
+        if self.data.get('symbol_index_dir') is not None:
+            symbol_index = await asyncio.to_thread(
+                get_symbol_index,
+                self.data['symbol_index_dir'], self.data['repo_name'], self.data['repo_path'], self.lang,
+            )
+
         calls_set = set()
-        callees_summary = ''
-        idx = 0
+        targets = []
         for callee in callees:
             if len(calls_set) >= self.max_callees:
                 break
             definition = callee['definition']
+            # the LSP did not answer at extraction time, calls extracted before receivers were recorded are not guessed
+            if definition is None and symbol_index is not None and callee.__contains__('receiver') and not callee.get('lsp_rejected', False):
+                definition = symbol_index.resolve(rel_file_path, callee['name'], receiver=callee['receiver'], kind=callee['type'])
             if definition is None:
                 continue
             file_path = str(os.path.join(self.data['repo_path'], definition['rel_file_path']))
@@ -114,26 +182,18 @@ You should list them in points, using clear and concise language, and you can us
             if calls_set.__contains__(f'''{file_path}:{fbinfo['start_lineno']}'''):
                 continue
             calls_set.add(f'''{file_path}:{fbinfo['start_lineno']}''')
-            user_prompt = f'''\
-### Target
+            targets.append((code, fbinfo, definition))
 
-```{self.lang.lower()}
-{fbinfo['preview']}
-```
-'''
-            self.llm_messages = [
-                SystemMessage(content=self.system_prompt_callee),
-                UserMessage(content=user_prompt, source='user'),
-            ]
-            response = await self._call_llm(cancellation_token)
-            response_content = response.content
-            usage = response.usage
-            self.llm_messages.append(AssistantMessage(content=response_content, source='assistant'))
-            self.handle_model_resource(user_prompt, response_content, usage=usage, seconds=0)
+        # all callees are summarized at the same time, at most `max_concurrent_requests` in flight
+        summaries = await asyncio.gather(*[
+            self._summarize_callee(definition, fbinfo, cancellation_token)
+            for code, fbinfo, definition in targets
+        ])
 
+        callees_summary = ''
+        for idx, ((code, fbinfo, _), response_content) in enumerate(zip(targets, summaries)):
             target_defs = '\n'.join(code.splitlines()[fbinfo['start_lineno']-1 : fbinfo['body_start_lineno']])
             callees_summary += f'{idx + 1}: ' + target_defs.strip() + '\n' + response_content + '\n\n'
-            idx += 1
 
         if callees_summary == '':
             callees_summary = '(empty)'
@@ -157,98 +217,122 @@ Please summarize the writing style and habits of assert statements in the follow
 
 {test_code_preview}
 '''
-        self.llm_messages = [
-            SystemMessage(content=self.system_prompt_style),
-            UserMessage(content=user_prompt, source='user'),
-        ]
-        response = await self._call_llm(cancellation_token)
-        response_content = response.content
-        usage = response.usage
-        self.llm_messages.append(AssistantMessage(content=response_content, source='assistant'))
-        self.handle_model_resource(user_prompt, response_content, usage=usage, seconds=0)
-        return response_content
-
-    @override
-    async def on_messages(
-            self,
-            messages: Sequence[BaseChatMessage],
-            cancellation_token: CancellationToken
-    ) -> Response:
-        self.agent_messages.extend(messages)
-        print(f'''>>> Call {self.name}, source: {self.agent_messages[-1].source}''')
+        return await self._summarize(
+            system_prompt=self.system_prompt_style,
+            user_prompt=user_prompt,
+            cancellation_token=cancellation_token,
+        )
 
-        # Explore Callees of Focal method
-        cache_dir = os.path.join(self.agent_cache_dir, self.data['repo_name'])
-        os.makedirs(cache_dir, exist_ok=True)
-        llm_cache_file1 = os.path.join(
+    async def _explore_focal_method_callees(self, cache_dir: str, cancellation_token) -> str:
+        llm_cache_file = os.path.join(
             cache_dir,
             f'''func-{self.data['focal_method_file_path'].replace('/', '-')}:{self.data['focal_method_start_lineno']}.json'''
         )
-        if os.path.exists(llm_cache_file1):
-            content = read_json(llm_cache_file1)
-            focal_method_callees = content['callees']
-        else:
-            call_extract_file = str(os.path.join(
-                self.data['calls_extract_dir'],
-                self.data['repo_name'],
-                f'''{self.data['focal_method_file_path'].replace('/', '-')}:{self.data['focal_method_start_lineno']}.json'''
-            ))
-            calls = read_json(call_extract_file)
-            focal_method_callees = await self._explore_callees(
-                callees=calls['calls'],
-                max_lineno=-1,
-                cancellation_token=cancellation_token
-            )
-            write_json(llm_cache_file1, {'callees': focal_method_callees})
+        if os.path.exists(llm_cache_file):
+            content = read_json(llm_cache_file)
+            return content['callees']
+
+        call_extract_file = str(os.path.join(
+            self.data['calls_extract_dir'],
+            self.data['repo_name'],
+            f'''{self.data['focal_method_file_path'].replace('/', '-')}:{self.data['focal_method_start_lineno']}.json'''
+        ))
+        calls = read_json(call_extract_file)
+        focal_method_callees = await self._explore_callees(
+            callees=calls['calls'],
+            rel_file_path=self.data['focal_method_file_path'],
+            max_lineno=-1,
+            cancellation_token=cancellation_token
+        )
+        write_json(llm_cache_file, {'callees': focal_method_callees})
+        return focal_method_callees
 
-        # Explore Callees of Test prefix
-        llm_cache_file2 = os.path.join(
+    async def _explore_test_prefix_callees(self, cache_dir: str, cancellation_token) -> str:
+        llm_cache_file = os.path.join(
             cache_dir,
             f'''func-{self.data['test_prefix_file_path'].replace('/', '-')}:{self.data['test_prefix_start_lineno']}.json'''
         )
-        if os.path.exists(llm_cache_file2):
-            content = read_json(llm_cache_file2)
-            test_prefix_callees = content['callees']
-        else:
-            call_extract_file = str(os.path.join(
-                self.data['calls_extract_dir'],
-                self.data['repo_name'],
-                f'''{self.data['test_prefix_file_path'].replace('/', '-')}:{self.data['test_prefix_start_lineno']}.json'''
-            ))
-            calls = read_json(call_extract_file)
-            test_prefix_callees = await self._explore_callees(
-                callees=calls['calls'],
-                max_lineno=self.data['ground_truth_oracle_lineno'],
-                cancellation_token=cancellation_token
-            )
-            write_json(llm_cache_file2, {'callees': test_prefix_callees})
+        if os.path.exists(llm_cache_file):
+            content = read_json(llm_cache_file)
+            return content['callees']
+
+        call_extract_file = str(os.path.join(
+            self.data['calls_extract_dir'],
+            self.data['repo_name'],
+            f'''{self.data['test_prefix_file_path'].replace('/', '-')}:{self.data['test_prefix_start_lineno']}.json'''
+        ))
+        calls = read_json(call_extract_file)
+        test_prefix_callees = await self._explore_callees(
+            callees=calls['calls'],
+            rel_file_path=self.data['test_prefix_file_path'],
+            max_lineno=self.data['ground_truth_oracle_lineno'],
+            cancellation_token=cancellation_token
+        )
+        write_json(llm_cache_file, {'callees': test_prefix_callees})
+        return test_prefix_callees
 
-        llm_cache_file3 = os.path.join(
+    async def _explore_test_assert_style(self, cache_dir: str, cancellation_token) -> str:
+        llm_cache_file = os.path.join(
             cache_dir,
             f'''style-{self.data['test_prefix_file_path'].replace('/', '-')}:{self.data['test_prefix_start_lineno']}.txt'''
         )
-        if os.path.exists(llm_cache_file3):
-            assert_style = read_file(llm_cache_file3)
+        if os.path.exists(llm_cache_file):
+            return read_file(llm_cache_file)
+
+        # the same preview (without the masked method) for all samples of the test file,
+        # so the style of a file is summarized once and only again when its preview changes
+        current_test_class = read_file(self.data['test_prefix_path'])
+        if self.lang.lower() == 'java':
+            test_code_preview = get_java_test_class_assert_preview(
+                code=current_test_class,
+                test_prefix=self.data['test_prefix'],
+                max_test_functions=10,
+                test_prefix_start_lineno=self.data['test_prefix_start_lineno'],
+                by_similarity=False,
+            )
         else:
-            current_test_class = read_file(self.data['test_prefix_path'])
-            if self.lang.lower() == 'java':
-                test_code_preview = get_java_test_class_assert_preview(
-                    code=current_test_class,
-                    test_prefix=self.data['test_prefix'],
-                    max_test_functions=10
-                )
-            else:
-                test_code_preview = get_python_test_file_assert_preview(
-                    code=current_test_class,
-                    test_prefix=self.data['test_prefix'],
-                    test_prefix_start_lineno=self.data['test_prefix_start_lineno'],
-                    max_test_functions=10
-                )
-            assert_style = await self._explore_assert_style(
-                test_code_preview=test_code_preview,
-                cancellation_token=cancellation_token
+            test_code_preview = get_python_test_file_assert_preview(
+                code=current_test_class,
+                test_prefix=self.data['test_prefix'],
+                test_prefix_start_lineno=self.data['test_prefix_start_lineno'],
+                max_test_functions=10,
+                exclude_test_prefix=True,
+                by_similarity=False,
             )
-            write_file(llm_cache_file3, assert_style)
+        fields = {
+            'type': 'assert_style',
+            'lang': self.lang.lower(),
+            'repo_name': self.data['repo_name'],
+            'rel_file_path': self.data['test_prefix_file_path'],
+            'content_hash': hashlib.sha256(test_code_preview.encode('utf-8')).hexdigest(),
+            'system_prompt_hash': hashlib.sha256(self.system_prompt_style.encode('utf-8')).hexdigest(),
+        }
+        assert_style = await self.summary_cache.get_or_create(
+            key=self.summary_cache.make_key(**fields),
+            create=lambda: self._explore_assert_style(test_code_preview, cancellation_token),
+            fields=fields,
+        )
+        write_file(llm_cache_file, assert_style)
+        return assert_style
+
+    @override
+    async def on_messages(
+            self,
+            messages: Sequence[BaseChatMessage],
+            cancellation_token: CancellationToken
+    ) -> Response:
+        self.agent_messages.extend(messages)
+        print(f'''>>> Call {self.name}, source: {self.agent_messages[-1].source}''')
+
+        cache_dir = os.path.join(self.agent_cache_dir, self.data['repo_name'])
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Callees of the focal method, callees of the test prefix, and the assert style are independent
+        focal_method_callees, test_prefix_callees, assert_style = await asyncio.gather(
+            self._explore_focal_method_callees(cache_dir, cancellation_token),
+            self._explore_test_prefix_callees(cache_dir, cancellation_token),
+            self._explore_test_assert_style(cache_dir, cancellation_token),
+        )
 
         explore_focal_method = f'''\
 ### Callees
@@ -278,11 +362,12 @@ Please summarize the writing style and habits of assert statements in the follow
     async def after_call_llm(self, response_content: str, text_calls: int) -> Tuple[bool, str]:
         raise NotImplementedError
 
-    def handle_model_resource(self, user_prompt: str, response_content: Union[str, List], usage: Dict, seconds: float = 0) -> None:
+    def handle_model_resource(self, user_prompt: str, response_content: Union[str, List], usage: Dict, seconds: float = 0, messages: Optional[List[LLMMessage]] = None, cached: bool = False) -> None:
         log = {
             'type': 'llm', 'gen_id': self.data['gen_id'], 'agent': self.name,
             'iters': self.iters, 'usage': usage,
-            'messages': extract_llm_messages(self.llm_messages),
+            'messages': extract_llm_messages(self.llm_messages if messages is None else messages),
+            'cache_scope': self.data.get('cache_scope'), 'cached': cached,
         }
         if seconds > 0:
             log['seconds'] = seconds
@@ -0,0 +1,74 @@
+"""
+Prompt layout shared by AssertAgent and ReviewerAgent.
+
+Everything that is fixed for a sample (task, method under test, test setup, unit test, explore results)
+goes into the system message, byte-identical for both agents and all generations of the sample,
+so that the prefix cache of the server reuses it. The agents only append what changes
+(their instructions, candidate answers, check results) in the user messages.
+"""
+from typing import Dict, Optional
+
+from .utils import add_line_number
+
+
+def build_sample_context(data: Dict, lang: str, explore_content: Optional[Dict]) -> str:
+    """
+    Args:
+        explore_content: the output of ExploreAgent, None without it
+    """
+    focal_method = add_line_number(
+        data['focal_method'],
+        [i for i in range(data['focal_method_start_lineno'], data['focal_method_end_lineno'] + 1)],
+    )
+    if lang.lower() == 'java':
+        test_setup = '\n...\n'.join([
+            add_line_number(
+                ts['test_setup'],
+                [i for i in range(ts['start_lineno'], ts['end_lineno'] + 1)]
+            ) for ts in data['test_setup_list']
+        ])
+    else:
+        test_setup = add_line_number(
+            data['test_setup'],
+            [i for i in range(data['test_setup_start_lineno'], data['test_setup_end_lineno'] + 1)]
+        )
+    test_prefix = add_line_number(
+        data['test_prefix'],
+        [i for i in range(data['test_prefix_start_lineno'], data['test_prefix_end_lineno'] + 1)]
+    )
+
+    context = ''
+    if explore_content is not None and explore_content['explore_focal_method'] != '':
+        context += f'''\n\n\n# Code Context Related to Method Under Test\n\n{explore_content['explore_focal_method']}\n'''
+
+    context += f'''\n# Method Under Test\n...\n{focal_method}\n...\n'''
+    context += f'''\n\n# Test Setup\n...\n{test_setup}\n...\n'''
+
+    if explore_content is not None and explore_content['explore_test_prefix'] != '':
+        context += f'''\n\n# Code Context Related to Unit Test\n\n{explore_content['explore_test_prefix']}\n'''
+
+    context += f'''\n# Unit Test\n...\n{test_prefix}\n...\n'''
+
+    if explore_content is not None:
+        if lang.lower() == 'java':
+            context += f'''\n\n# Conclusion of Assert Statement Style in the Current Test Class\n\n{explore_content['explore_assert_style']}\n'''
+        elif lang.lower() == 'python':
+            context += f'''\n\n# Conclusion of Assert Statement Style in the Current Test File\n\n{explore_content['explore_assert_style']}\n'''
+        else:
+            raise NotImplementedError
+    return context
+
+
+def build_shared_system_prompt(data: Dict, lang: str, explore_content: Optional[Dict]) -> str:
+    """
+    The system message of both agents, the same bytes for every generation of the sample.
+    """
+    system_prompt = f'''\
+You are a professional software engineer.
+You will be provided with the file path and function body of a method under test, a test setup, and the corresponding unit test.
+The other parts of the unit test have already been written, but there is still one assert statement that has not been completed, which is located in the `{data['placeholder']}` position.
+'''
+    if explore_content is not None:
+        system_prompt += 'You will also be provided with the callees of method under test and unit test, along with the advice on the style of assert statement writing.\n'
+    return system_prompt + build_sample_context(data, lang, explore_content)
+
@@ -1,9 +1,12 @@
-from typing import List, Dict, Tuple, Union
+from typing import List, Dict, Tuple, Union, Optional
 import json
 
-from .utils import extract_llm_messages, add_line_number
+from autogen_core.models import SystemMessage
+
+from .utils import extract_llm_messages
+from .prompt_layout import build_shared_system_prompt
 from .agent_with_tools import AgentWithTools
-from ..model_client import OpenAIAPIClient
+from ..model_client import OpenAIAPIClient, ResponseCache
 
 from ..tools.project_tools import ProjectTools
 
@@ -29,6 +32,7 @@ class ReviewerAgent(AgentWithTools):
             with_locals: bool,
             with_dynamic: bool,
             with_explore_agent: bool,
+            response_cache: Optional[ResponseCache] = None,
     ) -> None:
         name = 'ReviewerAgent'
         description = 'Generate the assert statement based on the check target and expected behaviour.'
@@ -36,19 +40,21 @@ class ReviewerAgent(AgentWithTools):
         self.with_dynamic = with_dynamic and len(tools) > 0
         self.with_locals = with_locals and len(tools) > 0
 
+        # the system prompt is replaced by the shared context of the sample on the first call, see `prompt_layout`
+        system_prompt = 'You are a professional software engineer.'
         if lang.lower() == 'java':
-            system_prompt = f'''\
+            role_prompt = f'''\
 You are a professional software reviewer.
 You can determine whether the assert statement written by the programmer is correct based on static check result and test run result.'''
         elif lang.lower() == 'python':
-            system_prompt = f'''\
+            role_prompt = f'''\
 You are a professional software reviewer.
 You can determine whether the assert statement written by the programmer is correct based on static check result and test run result.'''
         else:
             raise ValueError()
 
         if self.with_dynamic:
-            system_prompt += '\nYou can use the `get_debug_value` tool to query the values of variables or expressions in the test function. Do not repeat the query and call this tool up to 5 times at most.'
+            role_prompt += '\nYou can use the `get_debug_value` tool to query the values of variables or expressions in the test function. Do not repeat the query and call this tool up to 5 times at most.'
 
         super().__init__(
             name=name,
@@ -59,7 +65,8 @@ You can determine whether the assert statement written by the programmer is corr
             tools=tools,
             max_tool_calls=max_tool_calls,
             system_prompt=system_prompt,
-            json_output=None
+            json_output=None,
+            response_cache=response_cache,
         )
         self.data = data
         self.project_tools = project_tools
@@ -68,6 +75,7 @@ You can determine whether the assert statement written by the programmer is corr
         self.reviews = 0
         self.max_reviews = max_reviews
         self.with_explore_agent = with_explore_agent
+        self.role_prompt = role_prompt
 
     def _init_all(self):
         super()._init_all()
@@ -107,33 +115,14 @@ You can determine whether the assert statement written by the programmer is corr
 
             # first round
             if self.iters == 1:
-                focal_method = self.data['focal_method']
-                test_prefix = self.data['test_prefix']
-                focal_method = add_line_number(
-                    focal_method,
-                    [i for i in range(self.data['focal_method_start_lineno'], self.data['focal_method_end_lineno'] + 1)]
-                )
-                if self.lang.lower() == 'java':
-                    test_setup = '\n...\n'.join([
-                        add_line_number(
-                            ts['test_setup'],
-                            [i for i in range(ts['start_lineno'], ts['end_lineno'] + 1)]
-                        ) for ts in self.data['test_setup_list']
-                    ])
-                else:
-                    test_setup = add_line_number(
-                        self.data['test_setup'],
-                        [i for i in range(self.data['test_setup_start_lineno'], self.data['test_setup_end_lineno'] + 1)]
-                    )
-                test_prefix = add_line_number(
-                    test_prefix,
-                    [i for i in range(self.data['test_prefix_start_lineno'], self.data['test_prefix_end_lineno'] + 1)]
-                )
+                # stable context of the sample first (shared with AssertAgent), changing parts last
+                explore_content = self.get_last_source_content('ExploreAgent') if self.with_explore_agent else None
+                self.system_prompt = build_shared_system_prompt(self.data, self.lang, explore_content)
+                self.llm_messages[0] = SystemMessage(content=self.system_prompt)
 
+                user_prompt = self.role_prompt
                 if self.lang.lower() == 'java':
-                    user_prompt = f'''\
-You will be provided with the file path and function body of a method under test, a test setup, and the corresponding unit test.
-The other parts of the unit test have already been written, but there is still one assert statement that has not been completed, which is located in the `{self.data['placeholder']}` position.
+                    user_prompt += '''
 
 A programmer is trying to write this assert statement.
 Your task is to determine if the programmer's answer is correct and provide suggestions.
@@ -145,9 +134,7 @@ This assert statement should meet the following requirements:
 5. Cannot introduce any additional dependencies that are not currently introduced.
 '''
                 elif self.lang.lower() == 'python':
-                    user_prompt = f'''\
-You will be provided with the file path and function body of a method under test, a test setup, and the corresponding unit test.
-The other parts of the unit test have already been written, but there is still one assert statement that has not been completed, which is located in the `{self.data['placeholder']}` position.
+                    user_prompt += '''
 
 A programmer is trying to write this assert statement.
 Your task is to determine if the programmer's answer is correct and provide suggestions.
@@ -160,9 +147,6 @@ This assert statement should meet the following requirements:
                 else:
                     raise NotImplementedError()
 
-                if self.with_explore_agent:
-                    user_prompt += '\nYou will also be provided with the callees of method under test and unit test, along with the advice on the style of assert statement writing.\n'
-
                 user_prompt += '''
 Your final result needs to be in strictly JSON dictionary type, which includes a boolean type field `decision` indicating whether the assert statement is correct (true means correct), and a string type field `suggestions` indicating your suggestions. For example:
 ```json
@@ -172,29 +156,6 @@ Your final result needs to be in strictly JSON dictionary type, which includes a
 }
 ```
 '''
-                if self.with_explore_agent:
-                    explore_content = self.get_last_source_content('ExploreAgent')
-                    if explore_content['explore_focal_method'] != '':
-                        user_prompt += f'''\n\n\n# Code Context Related to Method Under Test\n\n{explore_content['explore_focal_method']}\n'''
-
-                user_prompt += f'''\n# Method Under Test\n...\n{focal_method}\n...\n'''
-                user_prompt += f'''\n\n# Test Setup\n...\n{test_setup}\n...\n'''
-
-                if self.with_explore_agent:
-                    explore_content = self.get_last_source_content('ExploreAgent')
-                    if explore_content['explore_test_prefix'] != '':
-                        user_prompt += f'''\n\n# Code Context Related to Unit Test\n\n{explore_content['explore_test_prefix']}\n'''
-
-                user_prompt += f'''\n# Unit Test\n...\n{test_prefix}\n...\n'''
-
-                if self.with_explore_agent:
-                    explore_content = self.get_last_source_content('ExploreAgent')
-                    if self.lang.lower() == 'java':
-                        user_prompt += f'''\n\n# Conclusion of Assert Statement Style in the Current Test Class\n\n{explore_content['explore_assert_style']}\n'''
-                    elif self.lang.lower() == 'python':
-                        user_prompt += f'''\n\n# Conclusion of Assert Statement Style in the Current Test File\n\n{explore_content['explore_assert_style']}\n'''
-                    else:
-                        raise NotImplementedError()
 
                 if self.with_locals:
                     local_vars = await self.project_tools.get_locals()
@@ -305,13 +266,14 @@ Your check result needs to be strictly JSON type, which includes a boolean type
                 self.act_status = 'retry'
                 return True, {}
 
-    def handle_model_resource(self, user_prompt: str, response_content: Union[str, List], usage: Dict, seconds: float) -> None:
+    def handle_model_resource(self, user_prompt: str, response_content: Union[str, List], usage: Dict, seconds: float, cached: bool = False) -> None:
         append_jsonl(
             self.data['resource_file'],
             {
                 'type': 'llm', 'gen_id': self.data['gen_id'], 'agent': self.name,
                 'iters': self.iters, 'usage': usage,
-                'messages': extract_llm_messages(self.llm_messages), 'seconds': seconds
+                'messages': extract_llm_messages(self.llm_messages), 'seconds': seconds,
+                'cache_scope': self.data.get('cache_scope'), 'cached': cached,
             }
         )
         print_log(f'{self.name} - user', user_prompt, 0)
@@ -1,4 +1,4 @@
-from typing import Dict, List, Sequence
+from typing import Dict, List, Sequence, Optional, Union
 import asyncio
 import json
 
@@ -15,9 +15,12 @@ from .agents.empty_agent import EmptyAgent
 from .agents.pass_agent import PassAgent
 
 from utils import print_log
+from utils.code_utils import is_assert_same
 from .tools.java_project_tools import get_java_project_tools
 from .tools.python_project_tools import get_python_project_tools
 from .model_client.openai_api_client import OpenAIAPIClient
+from .model_client.response_cache import ResponseCache
+from .model_client.client_registry import close_shared_clients
 
 
 def check_termination(messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> bool:
@@ -32,8 +35,8 @@ async def run_pipeline(
         lang: str,
 
         model_path: str,
-        api_key: str,
-        base_url: str,
+        api_key: Union[str, List[str]],
+        base_url: Union[str, List[str]],
         max_tool_calls: int,
         max_reviews: int,
         debug_port: int,
@@ -47,7 +50,19 @@ async def run_pipeline(
         nums: int,
         max_tries: int,
         existing_assert_code: List[str],
+        batch_size: int = 1,
+        response_cache: Optional[ResponseCache] = None,
+        warm_test_runner: bool = False,
+        explore_concurrency: int = 8,
 ) -> List[str]:
+    """
+    Args:
+        base_url: a list to balance the requests over several servers of the same model.
+        batch_size: number of Assert/Reviewer flows started at the same time, 1 means one after another.
+        response_cache: reuse model responses of identical requests from previous runs.
+        warm_test_runner: run the candidate tests in a long-lived test runner of the repo.
+        explore_concurrency: max summarization requests of one ExploreAgent in flight at the same time.
+    """
     logging.getLogger('autogen').setLevel(logging.CRITICAL)
 
     kwargs = {
@@ -61,128 +76,172 @@ async def run_pipeline(
             'structured_output': True,
             'family': 'api'
         },
+        # connections are kept for the next samples of this event loop
+        'shared_client': True,
+        # all requests of the sample go to the same server, whatever the prefix cache scope
+        'affinity_key': data.get('affinity_key'),
     }
     model_client = OpenAIAPIClient(**kwargs)
 
-    if lang.lower() == 'java':
-        project_tools, tools = get_java_project_tools(data, debug_port, debug_cache_dir)
-    else:
-        project_tools, tools = get_python_project_tools(data, debug_cache_dir)
-
-    if with_dynamic or with_locals:
-        project_tools.start_debugger()
-
-    tries = 0
-    all_assert_codes = [a for a in existing_assert_code]
-    while tries < max_tries:
-        gen_id = len(all_assert_codes)
-        data['gen_id'] = gen_id
-        print_log(f'[{gen_id}]', level=2)
-
-        builder = DiGraphBuilder()
-        part = []
-
-        if with_explore_agent:
-            explore_agent = ExploreAgent(
-                data=data,
+    project_tools = None
+    # a failed sample must not leave debuggers, sandboxes or the masked test file behind
+    try:
+        if lang.lower() == 'java':
+            project_tools, tools = get_java_project_tools(data, debug_port, debug_cache_dir, warm_test_runner, num_sandboxes=batch_size)
+        else:
+            project_tools, tools = get_python_project_tools(data, debug_cache_dir, warm_test_runner, num_sandboxes=batch_size)
+
+        if with_dynamic or with_locals:
+            await asyncio.to_thread(project_tools.start_debugger)
+
+        async def run_flow(gen_id: int, existing_assert_codes: List[str]) -> str:
+            flow_data = dict(data)
+            flow_data['gen_id'] = gen_id
+            print_log(f'[{gen_id}]', level=2)
+
+            builder = DiGraphBuilder()
+            part = []
+
+            if with_explore_agent:
+                explore_agent = ExploreAgent(
+                    data=flow_data,
+                    model_client=model_client,
+                    sampling_args=sampling_args,
+                    generation_mode=generation_mode,
+                    lang=flow_data['lang'],
+                    placeholder=flow_data['placeholder'],
+                    response_cache=response_cache,
+                    max_concurrent_requests=explore_concurrency,
+                )
+                builder.add_node(explore_agent)
+                part.append(explore_agent)
+            else:
+                starter = PassAgent()
+                builder.add_node(starter)
+                part.append(starter)
+
+            if with_dynamic:
+                debug_tool = [tools['get_debug_value']]
+            else:
+                debug_tool = []
+
+            assert_agent = AssertAgent(
+                data=flow_data,
                 model_client=model_client,
                 sampling_args=sampling_args,
                 generation_mode=generation_mode,
-                lang=data['lang'],
-                placeholder=data['placeholder'],
+                tools=[],
+                project_tools=project_tools,
+                max_tool_calls=max_tool_calls,
+                lang=flow_data['lang'],
+                placeholder=flow_data['placeholder'],
+                with_dynamic=with_dynamic,
+                with_locals=with_locals,
+                with_explore_agent=with_explore_agent,
+                existing_assert_codes=existing_assert_codes,
+                response_cache=response_cache,
             )
-            builder.add_node(explore_agent)
-            part.append(explore_agent)
-        else:
-            starter = PassAgent()
-            builder.add_node(starter)
-            part.append(starter)
+            reviewer_agent = ReviewerAgent(
+                data=flow_data,
+                model_client=model_client,
+                sampling_args=sampling_args,
+                generation_mode=generation_mode,
+                tools=debug_tool,
+                project_tools=project_tools,
+                max_tool_calls=max_tool_calls,
+                lang=flow_data['lang'],
+                placeholder=flow_data['placeholder'],
+                max_reviews=max_reviews,
+                with_dynamic=with_dynamic,
+                with_locals=with_locals,
+                with_explore_agent=with_explore_agent,
+                response_cache=response_cache,
+            )
+            empty_agent = EmptyAgent()
+            builder.add_node(assert_agent)
+            part.append(assert_agent)
 
-        if with_dynamic:
-            debug_tool = [tools['get_debug_value']]
-        else:
-            debug_tool = []
-
-        assert_agent = AssertAgent(
-            data=data,
-            model_client=model_client,
-            sampling_args=sampling_args,
-            generation_mode=generation_mode,
-            tools=[],
-            project_tools=project_tools,
-            max_tool_calls=max_tool_calls,
-            lang=data['lang'],
-            placeholder=data['placeholder'],
-            with_dynamic=with_dynamic,
-            with_locals=with_locals,
-            with_explore_agent=with_explore_agent,
-            existing_assert_codes=all_assert_codes,
-        )
-        reviewer_agent = ReviewerAgent(
-            data=data,
-            model_client=model_client,
-            sampling_args=sampling_args,
-            generation_mode=generation_mode,
-            tools=debug_tool,
-            project_tools=project_tools,
-            max_tool_calls=max_tool_calls,
-            lang=data['lang'],
-            placeholder=data['placeholder'],
-            max_reviews=max_reviews,
-            with_dynamic=with_dynamic,
-            with_locals=with_locals,
-            with_explore_agent=with_explore_agent,
-        )
-        empty_agent = EmptyAgent()
-        builder.add_node(assert_agent)
-        part.append(assert_agent)
-
-        builder.add_node(reviewer_agent)
-        part.append(reviewer_agent)
-
-        builder.add_node(empty_agent)
-        part.append(empty_agent)
-
-        if with_explore_agent:
-            builder.add_edge(explore_agent, assert_agent, activation_group='initial')
-        else:
-            builder.add_edge(starter, assert_agent, activation_group='initial')
+            builder.add_node(reviewer_agent)
+            part.append(reviewer_agent)
+
+            builder.add_node(empty_agent)
+            part.append(empty_agent)
+
+            if with_explore_agent:
+                builder.add_edge(explore_agent, assert_agent, activation_group='initial')
+            else:
+                builder.add_edge(starter, assert_agent, activation_group='initial')
 
-        builder.add_edge(assert_agent, reviewer_agent)
+            builder.add_edge(assert_agent, reviewer_agent)
 
-        builder.add_edge(reviewer_agent, assert_agent, activation_group='feedback', condition=lambda msg: not json.loads(msg.content)['termination'])
-        builder.add_edge(reviewer_agent, empty_agent, condition=lambda msg: json.loads(msg.content)['termination'])
+            builder.add_edge(reviewer_agent, assert_agent, activation_group='feedback', condition=lambda msg: not json.loads(msg.content)['termination'])
+            builder.add_edge(reviewer_agent, empty_agent, condition=lambda msg: json.loads(msg.content)['termination'])
 
-        graph = builder.build()
+            graph = builder.build()
 
-        print(f'Graph: {graph}')
+            print(f'Graph: {graph}')
 
-        flow = GraphFlow(
-            part,
-            graph=graph,
-            termination_condition=FunctionalTermination(check_termination),
-        )
+            flow = GraphFlow(
+                part,
+                graph=graph,
+                termination_condition=FunctionalTermination(check_termination),
+            )
 
-        data['termination'] = False
-        user_msg = TextMessage(
-            source='user',
-            content=json.dumps(data)
-        )
-        result = await flow.run(task=user_msg)
+            flow_data['termination'] = False
+            user_msg = TextMessage(
+                source='user',
+                content=json.dumps(flow_data)
+            )
+            result = await flow.run(task=user_msg)
 
-        print(result.stop_reason)
-        final_result = json.loads(result.messages[-1].content)['assert_code']
+            print(result.stop_reason)
+            final_result = json.loads(result.messages[-1].content)['assert_code']
+            return final_result
 
-        if final_result != '':
-            all_assert_codes.append(final_result)
+        tries = 0
+        all_assert_codes = [a for a in existing_assert_code]
+        if batch_size <= 1:
+            while tries < max_tries:
+                final_result = await run_flow(len(all_assert_codes), all_assert_codes)
 
-        if len(all_assert_codes) >= nums:
-            break
+                if final_result != '':
+                    all_assert_codes.append(final_result)
 
-        tries += 1
+                if len(all_assert_codes) >= nums:
+                    break
 
-    project_tools.close()
-    await model_client.close()
+                tries += 1
+        else:
+            # Each round starts `batch_size` flows at once, they all see the candidates of the previous rounds.
+            # Duplicates within a round are removed afterwards.
+            while tries < max_tries and len(all_assert_codes) < nums:
+                k = min(batch_size, max_tries - tries, nums - len(all_assert_codes))
+                round_assert_codes = [a for a in all_assert_codes]
+                tasks = [
+                    asyncio.create_task(run_flow(len(all_assert_codes) + j, round_assert_codes)) for j in range(k)
+                ]
+                try:
+                    final_results = await asyncio.gather(*tasks)
+                except BaseException:
+                    # the other flows must stop before the tools and the model client are closed
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
+
+                for final_result in final_results:
+                    if final_result == '':
+                        continue
+                    if any(is_assert_same(final_result, a, lang, mask_str=False) for a in all_assert_codes):
+                        print_log(f'Duplicated: {final_result}', level=2)
+                        continue
+                    all_assert_codes.append(final_result)
+
+                tries += k
+    finally:
+        if project_tools is not None:
+            await asyncio.to_thread(project_tools.close)
+        await model_client.close()
 
     return all_assert_codes
 
@@ -194,8 +253,8 @@ def generate_assert(
         lang: str,
 
         model_path: str,
-        base_url: str,
-        api_key: str,
+        base_url: Union[str, List[str]],
+        api_key: Union[str, List[str]],
         max_tool_calls: int,
         max_reviews: int,
         debug_port: int,
@@ -208,28 +267,41 @@ def generate_assert(
         nums: int,
         max_tries: int,
         existing_assert_code: List[str],
+        batch_size: int = 1,
+        response_cache: Optional[ResponseCache] = None,
+        warm_test_runner: bool = False,
+        explore_concurrency: int = 8,
 ) -> List[str]:
-    return asyncio.run(
-        run_pipeline(
-            data=data,
-            sampling_args=sampling_args,
-            generation_mode=generation_mode,
-            lang=lang,
-
-            model_path=model_path,
-            base_url=base_url,
-            api_key=api_key,
-            max_tool_calls=max_tool_calls,
-            max_reviews=max_reviews,
-            debug_port=debug_port,
-
-            with_explore_agent=with_explore_agent,
-            debug_cache_dir=debug_cache_dir,
-            with_dynamic=with_dynamic,
-            with_locals=with_locals,
-
-            nums=nums,
-            max_tries=max_tries,
-            existing_assert_code=existing_assert_code,
-        )
-    )
+    async def run() -> List[str]:
+        try:
+            return await run_pipeline(
+                data=data,
+                sampling_args=sampling_args,
+                generation_mode=generation_mode,
+                lang=lang,
+
+                model_path=model_path,
+                base_url=base_url,
+                api_key=api_key,
+                max_tool_calls=max_tool_calls,
+                max_reviews=max_reviews,
+                debug_port=debug_port,
+
+                with_explore_agent=with_explore_agent,
+                debug_cache_dir=debug_cache_dir,
+                with_dynamic=with_dynamic,
+                with_locals=with_locals,
+
+                nums=nums,
+                max_tries=max_tries,
+                existing_assert_code=existing_assert_code,
+                batch_size=batch_size,
+                response_cache=response_cache,
+                warm_test_runner=warm_test_runner,
+                explore_concurrency=explore_concurrency,
+            )
+        finally:
+            # the connections belong to this event loop
+            await close_shared_clients()
+
+    return asyncio.run(run())
@@ -1 +1,2 @@
 from .openai_api_client import OpenAIAPIClient
+from .response_cache import ResponseCache
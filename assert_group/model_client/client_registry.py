@@ -0,0 +1,94 @@
+"""
+AsyncOpenAI clients shared by all samples (and agents) of the process, one per server config and event loop,
+so that concurrent samples reuse the open connections instead of each opening its own pool.
+
+An httpx connection belongs to the event loop that opened it: a run that starts a new loop per sample
+(`asyncio.run`) gets new clients per sample, a run with one loop (`--concurrency`) shares them all.
+"""
+from typing import Dict, Any, Mapping
+import asyncio
+import importlib.util
+import json
+import threading
+import weakref
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+
+class ClientPoolConfig:
+    def __init__(
+            self,
+            max_connections: int = 256,
+            max_keepalive_connections: int = 64,
+            keepalive_expiry: float = 60.0,
+            http2: bool = False,
+    ) -> None:
+        """
+        Args:
+            max_connections: max open connections of a client, requests beyond wait for a free one
+            max_keepalive_connections: max idle connections kept open
+            keepalive_expiry: seconds an idle connection is kept open
+            http2: multiplex requests over HTTP/2 connections, needs the `h2` package
+        """
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+
+
+client_pool_config = ClientPoolConfig()
+
+# event loop -> config key -> client
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncOpenAI]]" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def configure_client_pool(max_connections: int, max_keepalive_connections: int, keepalive_expiry: float, http2: bool) -> None:
+    """
+    Applies to the clients created afterwards.
+    """
+    if http2 and importlib.util.find_spec('h2') is None:
+        print('HTTP/2 needs the h2 package (pip install httpx[http2]), using HTTP/1.1.')
+        http2 = False
+    client_pool_config.max_connections = max_connections
+    client_pool_config.max_keepalive_connections = max_keepalive_connections
+    client_pool_config.keepalive_expiry = keepalive_expiry
+    client_pool_config.http2 = http2
+
+
+def _make_http_client() -> httpx.AsyncClient:
+    return DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=client_pool_config.max_connections,
+            max_keepalive_connections=client_pool_config.max_keepalive_connections,
+            keepalive_expiry=client_pool_config.keepalive_expiry,
+        ),
+        http2=client_pool_config.http2,
+    )
+
+
+def get_shared_client(openai_config: Mapping[str, Any]) -> AsyncOpenAI:
+    """
+    The client of `openai_config` (the kwargs of AsyncOpenAI) in the running event loop, created on first use.
+    Do not close it, `close_shared_clients` does at the end of the loop.
+    """
+    loop = asyncio.get_running_loop()
+    key = json.dumps(dict(openai_config), sort_keys=True, default=str)
+    with _clients_lock:
+        clients = _clients.get(loop)
+        if clients is None:
+            clients = _clients[loop] = {}
+        if not clients.__contains__(key):
+            clients[key] = AsyncOpenAI(**openai_config, http_client=_make_http_client())
+        return clients[key]
+
+
+async def close_shared_clients() -> None:
+    """
+    Close the shared clients of the running event loop.
+    """
+    with _clients_lock:
+        clients = _clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
@@ -0,0 +1,144 @@
+"""
+AIMD limit on the requests in flight to a model server, shared by all agents and samples of the process.
+
+The window grows by about one request per window of successful requests, and is halved when the server
+is overloaded (429, 503, timeout), at most once per round of requests. Requests beyond the window wait in
+FIFO order, so many concurrent agents neither flood a saturated server nor leave it idle.
+"""
+from typing import Dict, Tuple, Deque
+from collections import deque
+import asyncio
+import threading
+import time
+
+
+class AdaptiveLimiter:
+    def __init__(
+            self,
+            initial_window: float = 16.0,
+            min_window: float = 1.0,
+            max_window: float = 256.0,
+            increase: float = 1.0,
+            decrease: float = 0.5,
+    ) -> None:
+        """
+        Args:
+            increase: window growth per window of successful requests
+            decrease: factor of the window on overload
+        """
+        self.window = initial_window
+        self.min_window = min_window
+        self.max_window = max_window
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self.successes = 0
+        self.overloads = 0
+        self.last_decrease = 0.0
+        # waiters of any event loop, woken with `call_soon_threadsafe`
+        self.waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self.lock = threading.Lock()
+
+    def _limit(self) -> int:
+        return max(1, int(self.window))
+
+    @staticmethod
+    def _grant(future: asyncio.Future) -> None:
+        if not future.done():
+            future.set_result(None)
+
+    def _wake(self) -> None:
+        # holding self.lock
+        while len(self.waiters) > 0 and self.in_flight < self._limit():
+            loop, future = self.waiters.popleft()
+            self.in_flight += 1
+            try:
+                loop.call_soon_threadsafe(self._grant, future)
+            except RuntimeError:
+                # the loop of the waiter is closed
+                self.in_flight -= 1
+
+    async def acquire(self) -> float:
+        """
+        Wait for a free slot of the window, call `release` when the request is done.
+        Returns:
+            the start time of the request
+        """
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if len(self.waiters) == 0 and self.in_flight < self._limit():
+                self.in_flight += 1
+                return time.monotonic()
+            future = loop.create_future()
+            waiter = (loop, future)
+            self.waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                else:
+                    # granted while being cancelled, pass the slot on
+                    self.in_flight -= 1
+                    self._wake()
+            raise
+        return time.monotonic()
+
+    def release(self, start: float, ok: bool = True, overloaded: bool = False) -> None:
+        """
+        Args:
+            start: returned by `acquire`
+            ok: the request succeeded
+            overloaded: the server rejected the request for load (429, 503, timeout)
+        """
+        with self.lock:
+            self.in_flight -= 1
+            if overloaded:
+                self.overloads += 1
+                # the requests started before the last decrease saw the same congestion, decrease once
+                if start >= self.last_decrease:
+                    self.window = max(self.min_window, self.window * self.decrease)
+                    self.last_decrease = time.monotonic()
+            elif ok:
+                self.successes += 1
+                self.window = min(self.max_window, self.window + self.increase / self.window)
+            self._wake()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'window': round(self.window, 2),
+                'in_flight': self.in_flight,
+                'waiting': len(self.waiters),
+                'successes': self.successes,
+                'overloads': self.overloads,
+            }
+
+
+limiter_args = {
+    'initial_window': 16.0,
+    'max_window': 256.0,
+}
+
+_limiters: Dict[tuple, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def configure_concurrency_limiter(initial_window: float, max_window: float) -> None:
+    """
+    Applies to the limiters created afterwards.
+    """
+    limiter_args['initial_window'] = min(initial_window, max_window)
+    limiter_args['max_window'] = max_window
+
+
+def get_concurrency_limiter(base_urls: Tuple) -> AdaptiveLimiter:
+    """
+    One limiter per group of servers, shared by all clients of the process.
+    """
+    key = tuple(base_urls)
+    with _limiters_lock:
+        if not _limiters.__contains__(key):
+            _limiters[key] = AdaptiveLimiter(**limiter_args)
+        return _limiters[key]
@@ -0,0 +1,149 @@
+"""
+Routing of requests over several OpenAI compatible servers (e.g. vLLM replicas of the same model).
+
+A request goes to the healthy server with the least outstanding requests weighted by its observed latency.
+Requests with the same affinity key (e.g. the requests of a sample) stay on the server of the first one,
+so the prefix cache of that server is reused. A server that fails `max_failures` times in a row is left out
+for `cooldown` seconds, then gets requests again.
+The stats are per server, shared by all clients of the process.
+"""
+from typing import Dict, List, Optional
+from collections import OrderedDict
+import threading
+import time
+
+
+# outcome of a request on a server
+SUCCESS = 'success'
+# connection error, 5xx: counts toward taking the server out of rotation
+FAILURE = 'failure'
+# e.g. 4xx or cancelled: says nothing about the health of the server
+NEUTRAL = 'neutral'
+
+
+class EndpointStats:
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url
+        self.in_flight = 0
+        # exponentially weighted moving average of the request seconds, None before the first response
+        self.latency: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+
+    def is_healthy(self, now: float) -> bool:
+        return self.down_until <= now
+
+
+class EndpointPool:
+    def __init__(
+            self,
+            base_urls: List[str],
+            max_failures: int = 3,
+            cooldown: float = 30.0,
+            latency_alpha: float = 0.2,
+            max_affinity_keys: int = 100000,
+    ) -> None:
+        """
+        Args:
+            max_failures: consecutive failures before a server is taken out of rotation
+            cooldown: seconds a failed server is left out
+            latency_alpha: weight of the newest request in the latency average
+            max_affinity_keys: least recently used affinity keys are forgotten first
+        """
+        assert len(base_urls) > 0
+        self.endpoints = [EndpointStats(base_url) for base_url in base_urls]
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.latency_alpha = latency_alpha
+        self.max_affinity_keys = max_affinity_keys
+        # affinity key -> endpoint index
+        self.affinity: OrderedDict[str, int] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _score(self, endpoint: EndpointStats, default_latency: float) -> float:
+        latency = endpoint.latency if endpoint.latency is not None else default_latency
+        return (endpoint.in_flight + 1) * latency
+
+    def _least_loaded(self, now: float) -> int:
+        candidates = [i for i, e in enumerate(self.endpoints) if e.is_healthy(now)]
+        if len(candidates) == 0:
+            # all servers are down, try the one that comes back first
+            return min(range(len(self.endpoints)), key=lambda i: self.endpoints[i].down_until)
+
+        latencies = [self.endpoints[i].latency for i in candidates if self.endpoints[i].latency is not None]
+        default_latency = sum(latencies) / len(latencies) if len(latencies) > 0 else 1.0
+        return min(candidates, key=lambda i: self._score(self.endpoints[i], default_latency))
+
+    def acquire(self, affinity_key: Optional[str] = None) -> int:
+        """
+        Pick a server for a request and count it as outstanding, call `release` when it is done.
+        Returns:
+            the index of the server
+        """
+        now = time.monotonic()
+        with self.lock:
+            index = self.affinity.get(affinity_key) if affinity_key is not None else None
+            if index is None or not self.endpoints[index].is_healthy(now):
+                index = self._least_loaded(now)
+            if affinity_key is not None:
+                self.affinity[affinity_key] = index
+                self.affinity.move_to_end(affinity_key)
+                while len(self.affinity) > self.max_affinity_keys:
+                    self.affinity.popitem(last=False)
+
+            endpoint = self.endpoints[index]
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+        return index
+
+    def release(self, index: int, seconds: Optional[float] = None, outcome: str = SUCCESS) -> None:
+        """
+        Args:
+            seconds: duration of the request, None to leave the latency unchanged
+            outcome: SUCCESS | FAILURE | NEUTRAL, only a success brings a server in cooldown back
+        """
+        with self.lock:
+            endpoint = self.endpoints[index]
+            endpoint.in_flight -= 1
+            if outcome == SUCCESS:
+                endpoint.consecutive_failures = 0
+                endpoint.down_until = 0.0
+                if seconds is not None:
+                    if endpoint.latency is None:
+                        endpoint.latency = seconds
+                    else:
+                        endpoint.latency += self.latency_alpha * (seconds - endpoint.latency)
+            elif outcome == FAILURE:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= self.max_failures:
+                    endpoint.down_until = time.monotonic() + self.cooldown
+
+    def stats(self) -> List[Dict]:
+        now = time.monotonic()
+        with self.lock:
+            return [
+                {
+                    'base_url': e.base_url,
+                    'healthy': e.is_healthy(now),
+                    'in_flight': e.in_flight,
+                    'latency': e.latency,
+                    'requests': e.requests,
+                    'failures': e.failures,
+                }
+                for e in self.endpoints
+            ]
+
+
+_pools: Dict[tuple, EndpointPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_endpoint_pool(base_urls: List[str]) -> EndpointPool:
+    key = tuple(base_urls)
+    with _pools_lock:
+        if not _pools.__contains__(key):
+            _pools[key] = EndpointPool(base_urls=list(base_urls))
+        return _pools[key]
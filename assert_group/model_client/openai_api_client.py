@@ -22,7 +22,9 @@ import json
 import logging
 import math
 import os
+import random
 import re
+import time
 import warnings
 from asyncio import Task
 from dataclasses import dataclass
@@ -38,6 +40,7 @@ from typing import (
     Optional,
     Sequence,
     Set,
+    Tuple,
     Type,
     Union,
     cast,
@@ -69,7 +72,16 @@ from autogen_core.models import (
     validate_model_info,
 )
 from autogen_core.tools import Tool, ToolSchema
-from openai import NOT_GIVEN, AsyncAzureOpenAI, AsyncOpenAI
+from openai import (
+    NOT_GIVEN,
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncAzureOpenAI,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
 from openai.types.chat import (
     ChatCompletion,
     ChatCompletionChunk,
@@ -92,6 +104,9 @@ from pydantic import BaseModel, SecretStr
 from typing_extensions import Self, Unpack
 
 from utils import append_jsonl
+from .endpoint_pool import EndpointPool, get_endpoint_pool, SUCCESS, FAILURE, NEUTRAL
+from .client_registry import get_shared_client
+from .concurrency_limiter import AdaptiveLimiter, get_concurrency_limiter
 
 ############################################
 
@@ -167,12 +182,45 @@ def _azure_openai_client_from_config(config: Mapping[str, Any]) -> AsyncAzureOpe
     return AsyncAzureOpenAI(**azure_config)
 
 
-def _openai_client_from_config(config: Mapping[str, Any]) -> AsyncOpenAI:
+def _openai_client_from_config(config: Mapping[str, Any], shared: bool = False) -> AsyncOpenAI:
     # Shave down the config to just the OpenAI kwargs
     openai_config = {k: v for k, v in config.items() if k in openai_init_kwargs}
+    if shared:
+        return get_shared_client(openai_config)
     return AsyncOpenAI(**openai_config)
 
 
+def _endpoint_configs_from_config(config: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Split a config whose `base_url` is a list into one config per server,
+    `api_key` is either one key for all servers or a list of the same length.
+    """
+    base_urls = config.get("base_url")
+    api_keys = config.get("api_key")
+    if isinstance(api_keys, (list, tuple)) and len(api_keys) == 1:
+        api_keys = api_keys[0]
+    if not isinstance(base_urls, (list, tuple)):
+        if isinstance(api_keys, (list, tuple)):
+            raise ValueError(f"Got {len(api_keys)} api_key for one base_url")
+        return [dict(config, api_key=api_keys)] if config.__contains__("api_key") else [dict(config)]
+    if not isinstance(api_keys, (list, tuple)):
+        api_keys = [api_keys] * len(base_urls)
+    if len(api_keys) != len(base_urls):
+        raise ValueError(f"Got {len(base_urls)} base_url but {len(api_keys)} api_key")
+    return [dict(config, base_url=base_url, api_key=api_key) for base_url, api_key in zip(base_urls, api_keys)]
+
+
+# failures of the server, not of the request
+ENDPOINT_ERRORS = (APIConnectionError, InternalServerError)
+
+
+def _is_overloaded(error: BaseException) -> bool:
+    # the server is saturated, shrink the window of requests in flight
+    if isinstance(error, (RateLimitError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code == 503
+
+
 def _create_args_from_config(config: Mapping[str, Any]) -> Dict[str, Any]:
     create_args = {k: v for k, v in config.items() if k in create_kwargs}
     create_args_keys = set(create_args.keys())
@@ -465,8 +513,29 @@ class BaseOpenAIAPIClient(ChatCompletionClient):
         model_info: Optional[ModelInfo] = None,
         add_name_prefixes: bool = False,
         include_name_in_message: bool = True,
+        clients: Optional[List[Union[AsyncOpenAI, AsyncAzureOpenAI]]] = None,
+        endpoint_pool: Optional[EndpointPool] = None,
+        owns_clients: bool = True,
+        limiter: Optional[AdaptiveLimiter] = None,
+        max_attempts: int = 5,
+        affinity_key: Optional[str] = None,
     ):
+        """
+        Args:
+            clients: one client per server, requests are routed by `endpoint_pool`. Only `client` by default.
+            affinity_key: requests with the same key stay on the same server (e.g. all requests of a sample),
+                None to route every request on its own.
+            owns_clients: False if the clients are shared with other model clients, `close` leaves them open.
+            limiter: limits the requests in flight, `create` retries overloaded and failed requests through it.
+            max_attempts: tries of a request with `limiter`
+        """
+        self._limiter = limiter
+        self._max_attempts = max_attempts
         self._client = client
+        self._clients = clients if clients is not None else [client]
+        self._endpoint_pool = endpoint_pool
+        self._affinity_key = affinity_key
+        self._owns_clients = owns_clients
         self._add_name_prefixes = add_name_prefixes
         self._include_name_in_message = include_name_in_message
         if model_capabilities is None and model_info is None:
@@ -513,6 +582,26 @@ class BaseOpenAIAPIClient(ChatCompletionClient):
     def create_from_config(cls, config: Dict[str, Any]) -> ChatCompletionClient:
         return OpenAIAPIClient(**config)
 
+    @property
+    def model(self) -> str:
+        return self._create_args["model"]
+
+    def _acquire_client(self) -> Tuple[Optional[int], Union[AsyncOpenAI, AsyncAzureOpenAI]]:
+        if self._endpoint_pool is None:
+            return None, self._client
+        # not the prompt cache key, which is shared by all samples of a repo (or the run) with a wider cache scope
+        index = self._endpoint_pool.acquire(self._affinity_key)
+        return index, self._clients[index]
+
+    def _release_client(self, index: Optional[int], start_t: float, error: Optional[BaseException] = None) -> None:
+        if index is None:
+            return
+        if error is None:
+            self._endpoint_pool.release(index, time.monotonic() - start_t, SUCCESS)
+        else:
+            # the latency of a rejected or cancelled request says nothing about the server
+            self._endpoint_pool.release(index, None, FAILURE if isinstance(error, ENDPOINT_ERRORS) else NEUTRAL)
+
     def _rstrip_last_assistant_message(self, messages: Sequence[LLMMessage]) -> Sequence[LLMMessage]:
         """
         Remove the last assistant message if it is empty.
@@ -695,6 +784,49 @@ class BaseOpenAIAPIClient(ChatCompletionClient):
         json_output: Optional[bool | type[BaseModel]] = None,
         extra_create_args: Mapping[str, Any] = {},
         cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        kwargs = dict(
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+        if self._limiter is None:
+            return await self._create_once(messages, **kwargs)
+
+        attempts = 0
+        while True:
+            start = await self._limiter.acquire()
+            try:
+                result = await self._create_once(messages, **kwargs)
+            except BaseException as e:
+                overloaded = _is_overloaded(e)
+                self._limiter.release(start, ok=False, overloaded=overloaded)
+                attempts += 1
+                # cancellation is not retried
+                if attempts >= self._max_attempts or not isinstance(e, Exception):
+                    raise
+                if overloaded or isinstance(e, ENDPOINT_ERRORS):
+                    # the smaller window already spaces the retries, a short jitter avoids a burst
+                    await asyncio.sleep(random.uniform(0, min(2.0, 0.1 * 2 ** attempts)))
+                else:
+                    # e.g. an unparsable structured output or a truncated response, may pass with another sample
+                    print(f'Retry after {type(e).__name__}: {e}')
+                    await asyncio.sleep(max(3.0, random.uniform(0, min(10.0, 2 ** attempts))))
+                continue
+            self._limiter.release(start)
+            return result
+
+    async def _create_once(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
     ) -> CreateResult:
         create_params = self._process_create_args(
             messages,
@@ -707,31 +839,38 @@ class BaseOpenAIAPIClient(ChatCompletionClient):
 
         # append_jsonl('tmp_msg.jsonl', {"msg": create_params.messages})
 
-        future: Union[Task[ParsedChatCompletion[BaseModel]], Task[ChatCompletion]]
-        if create_params.response_format is not None:
-            # Use beta client if response_format is not None
-            future = asyncio.ensure_future(
-                self._client.beta.chat.completions.parse(
-                    messages=create_params.messages,
-                    tools=(create_params.tools if len(create_params.tools) > 0 else NOT_GIVEN),
-                    response_format=create_params.response_format,
-                    **create_params.create_args,
+        index, client = self._acquire_client()
+        start_t = time.monotonic()
+        try:
+            future: Union[Task[ParsedChatCompletion[BaseModel]], Task[ChatCompletion]]
+            if create_params.response_format is not None:
+                # Use beta client if response_format is not None
+                future = asyncio.ensure_future(
+                    client.beta.chat.completions.parse(
+                        messages=create_params.messages,
+                        tools=(create_params.tools if len(create_params.tools) > 0 else NOT_GIVEN),
+                        response_format=create_params.response_format,
+                        **create_params.create_args,
+                    )
                 )
-            )
-        else:
-            # Use the regular client
-            future = asyncio.ensure_future(
-                self._client.chat.completions.create(
-                    messages=create_params.messages,
-                    stream=False,
-                    tools=(create_params.tools if len(create_params.tools) > 0 else NOT_GIVEN),
-                    **create_params.create_args,
+            else:
+                # Use the regular client
+                future = asyncio.ensure_future(
+                    client.chat.completions.create(
+                        messages=create_params.messages,
+                        stream=False,
+                        tools=(create_params.tools if len(create_params.tools) > 0 else NOT_GIVEN),
+                        **create_params.create_args,
+                    )
                 )
-            )
 
-        if cancellation_token is not None:
-            cancellation_token.link_future(future)
-        result: Union[ParsedChatCompletion[BaseModel], ChatCompletion] = await future
+            if cancellation_token is not None:
+                cancellation_token.link_future(future)
+            result: Union[ParsedChatCompletion[BaseModel], ChatCompletion] = await future
+        except BaseException as e:
+            self._release_client(index, start_t, e)
+            raise
+        self._release_client(index, start_t)
         if create_params.response_format is not None:
             result = cast(ParsedChatCompletion[Any], result)
 
@@ -1119,26 +1258,33 @@ class BaseOpenAIAPIClient(ChatCompletionClient):
         create_args: Dict[str, Any],
         cancellation_token: Optional[CancellationToken],
     ) -> AsyncGenerator[ChatCompletionChunk, None]:
-        stream_future = asyncio.ensure_future(
-            self._client.chat.completions.create(
-                messages=oai_messages,
-                stream=True,
-                tools=tool_params if len(tool_params) > 0 else NOT_GIVEN,
-                **create_args,
+        index, client = self._acquire_client()
+        start_t = time.monotonic()
+        try:
+            stream_future = asyncio.ensure_future(
+                client.chat.completions.create(
+                    messages=oai_messages,
+                    stream=True,
+                    tools=tool_params if len(tool_params) > 0 else NOT_GIVEN,
+                    **create_args,
+                )
             )
-        )
-        if cancellation_token is not None:
-            cancellation_token.link_future(stream_future)
-        stream = await stream_future
-        while True:
-            try:
-                chunk_future = asyncio.ensure_future(anext(stream))
-                if cancellation_token is not None:
-                    cancellation_token.link_future(chunk_future)
-                chunk = await chunk_future
-                yield chunk
-            except StopAsyncIteration:
-                break
+            if cancellation_token is not None:
+                cancellation_token.link_future(stream_future)
+            stream = await stream_future
+            while True:
+                try:
+                    chunk_future = asyncio.ensure_future(anext(stream))
+                    if cancellation_token is not None:
+                        cancellation_token.link_future(chunk_future)
+                    chunk = await chunk_future
+                    yield chunk
+                except StopAsyncIteration:
+                    break
+        except BaseException as e:
+            self._release_client(index, start_t, e)
+            raise
+        self._release_client(index, start_t)
 
     async def _create_stream_chunks_beta_client(
         self,
@@ -1148,32 +1294,42 @@ class BaseOpenAIAPIClient(ChatCompletionClient):
         response_format: Optional[Type[BaseModel]],
         cancellation_token: Optional[CancellationToken],
     ) -> AsyncGenerator[ChatCompletionChunk, None]:
-        async with self._client.beta.chat.completions.stream(
-            messages=oai_messages,
-            tools=tool_params if len(tool_params) > 0 else NOT_GIVEN,
-            response_format=(response_format if response_format is not None else NOT_GIVEN),
-            **create_args_no_response_format,
-        ) as stream:
-            while True:
-                try:
-                    event_future = asyncio.ensure_future(anext(stream))
-                    if cancellation_token is not None:
-                        cancellation_token.link_future(event_future)
-                    event = await event_future
-
-                    if event.type == "chunk":
-                        chunk = event.chunk
-                        yield chunk
-                    # We don't handle other event types from the beta client stream.
-                    # As the other event types are auxiliary to the chunk event.
-                    # See: https://github.com/openai/openai-python/blob/main/helpers.md#chat-completions-events.
-                    # Once the beta client is stable, we can move all the logic to the beta client.
-                    # Then we can consider handling other event types which may simplify the code overall.
-                except StopAsyncIteration:
-                    break
+        index, client = self._acquire_client()
+        start_t = time.monotonic()
+        try:
+            async with client.beta.chat.completions.stream(
+                messages=oai_messages,
+                tools=tool_params if len(tool_params) > 0 else NOT_GIVEN,
+                response_format=(response_format if response_format is not None else NOT_GIVEN),
+                **create_args_no_response_format,
+            ) as stream:
+                while True:
+                    try:
+                        event_future = asyncio.ensure_future(anext(stream))
+                        if cancellation_token is not None:
+                            cancellation_token.link_future(event_future)
+                        event = await event_future
+
+                        if event.type == "chunk":
+                            chunk = event.chunk
+                            yield chunk
+                        # We don't handle other event types from the beta client stream.
+                        # As the other event types are auxiliary to the chunk event.
+                        # See: https://github.com/openai/openai-python/blob/main/helpers.md#chat-completions-events.
+                        # Once the beta client is stable, we can move all the logic to the beta client.
+                        # Then we can consider handling other event types which may simplify the code overall.
+                    except StopAsyncIteration:
+                        break
+        except BaseException as e:
+            self._release_client(index, start_t, e)
+            raise
+        self._release_client(index, start_t)
 
     async def close(self) -> None:
-        await self._client.close()
+        if not self._owns_clients:
+            return
+        for client in self._clients:
+            await client.close()
 
     def actual_usage(self) -> RequestUsage:
         # return self._actual_usage
@@ -1516,26 +1672,46 @@ class OpenAIAPIClient(BaseOpenAIAPIClient, Component[OpenAIClientConfigurationCo
             if "api_key" not in copied_args and "LLAMA_API_KEY" in os.environ:
                 copied_args["api_key"] = os.environ["LLAMA_API_KEY"]
 
-        client = _openai_client_from_config(copied_args)
+        # borrow the process-wide clients (and their connections) of the running event loop
+        shared_client: bool = kwargs.get("shared_client", False)
+        # e.g. the sample, whose requests share the prefix cache of one server
+        affinity_key: Optional[str] = kwargs.get("affinity_key")
+
+        # a list of base_url: one client per server, routed by the endpoint pool
+        endpoint_configs = _endpoint_configs_from_config(copied_args)
+        # retried by `create` through the concurrency limiter, so that the limiter sees every 429 / 503 / timeout
+        for c in endpoint_configs:
+            c.setdefault("max_retries", 0)
+        clients = [_openai_client_from_config(c, shared=shared_client) for c in endpoint_configs]
+        base_urls = [c.get("base_url") for c in endpoint_configs]
+        endpoint_pool = get_endpoint_pool(base_urls) if len(clients) > 1 else None
         create_args = _create_args_from_config(copied_args)
 
         super().__init__(
-            client=client,
+            client=clients[0],
             create_args=create_args,
             model_capabilities=model_capabilities,
             model_info=model_info,
             add_name_prefixes=add_name_prefixes,
             include_name_in_message=include_name_in_message,
+            clients=clients,
+            endpoint_pool=endpoint_pool,
+            owns_clients=not shared_client,
+            limiter=get_concurrency_limiter(tuple(base_urls)),
+            affinity_key=affinity_key,
         )
 
     def __getstate__(self) -> Dict[str, Any]:
         state = self.__dict__.copy()
         state["_client"] = None
+        state["_clients"] = None
         return state
 
     def __setstate__(self, state: Dict[str, Any]) -> None:
         self.__dict__.update(state)
-        self._client = _openai_client_from_config(state["_raw_config"])
+        self._clients = [_openai_client_from_config(c) for c in _endpoint_configs_from_config(state["_raw_config"])]
+        self._client = self._clients[0]
+        self._owns_clients = True
 
     def _to_config(self) -> OpenAIClientConfigurationConfigModel:
         copied_config = self._raw_config.copy()
@@ -0,0 +1,135 @@
+"""
+On-disk cache of model responses, keyed by the content of the request.
+"""
+from typing import Dict, Sequence, Optional, Any, Mapping
+from collections import Counter
+import hashlib
+import json
+import os
+import threading
+
+from autogen_core.models import LLMMessage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from .openai_api_client import CreateResult
+
+
+# keys of `extra_create_args` that change on every run but not the response
+IGNORED_CREATE_ARGS = ('prompt_cache_key', 'cache_salt')
+
+
+class ResponseCache:
+    def __init__(self, cache_dir: str, max_size_mb: float = 1024) -> None:
+        """
+        Args:
+            cache_dir: one json file per response
+            max_size_mb: the least recently used responses are removed when the cache grows larger than this
+        """
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # the n-th identical request of this run maps to the n-th cached response,
+        # so that sampling several times with the same prompt still gives different responses
+        self.occurrences = Counter()
+        self.lock = threading.Lock()
+        self.total_size = sum(
+            os.path.getsize(os.path.join(self.cache_dir, f)) for f in os.listdir(self.cache_dir) if f.endswith('.json')
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(
+            self,
+            model: str,
+            messages: Sequence[LLMMessage],
+            tools: Sequence[Tool | ToolSchema],
+            extra_create_args: Mapping[str, Any],
+            json_output: Optional[bool | type[BaseModel]] = None,
+    ) -> str:
+        """
+        Args:
+            model: the model name, a cache dir shared by runs of different models never mixes their responses
+        """
+        create_args = {k: v for k, v in extra_create_args.items() if k not in IGNORED_CREATE_ARGS}
+        if isinstance(create_args.get('extra_body'), dict):
+            create_args['extra_body'] = {k: v for k, v in create_args['extra_body'].items() if k not in IGNORED_CREATE_ARGS}
+
+        if isinstance(json_output, type):
+            json_output = json_output.model_json_schema()
+
+        content = json.dumps({
+            'model': model,
+            'messages': [m.model_dump(mode='json') for m in messages],
+            'tools': [t.schema if isinstance(t, Tool) else t for t in tools],
+            'extra_create_args': create_args,
+            'json_output': json_output,
+        }, sort_keys=True, default=str)
+        key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+        with self.lock:
+            n = self.occurrences[key]
+            self.occurrences[key] += 1
+        return f'{key}-{n}'
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def get(self, key: str) -> Optional[CreateResult]:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                content = json.load(file)
+            # mtime is used as the last access time
+            os.utime(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        result = CreateResult.model_validate(content)
+        result.cached = True
+        return result
+
+    def put(self, key: str, result: CreateResult) -> None:
+        path = self._path(key)
+        content = json.dumps(result.model_dump(mode='json'))
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.total_size += os.path.getsize(path) - old_size
+            if self.total_size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        files = []
+        for f in os.listdir(self.cache_dir):
+            if not f.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, f)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        self.total_size = sum(f[1] for f in files)
+        # shrink to 90% to avoid evicting on every write
+        for _, size, path in files:
+            if self.total_size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+                self.total_size -= size
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': self.total_size}
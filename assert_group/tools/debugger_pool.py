@@ -0,0 +1,126 @@
+"""
+Suspended debugger sessions kept alive after a sample is done, and handed to later samples
+that stop at the same line of the same test of the same repo checkout.
+
+A session is only pooled while the debugged program is in the state it was suspended in:
+a query that may change it (anything but reading variables, fields and indexes) marks the session dirty,
+and a dirty session is closed when released.
+"""
+from typing import Dict, Tuple, List, Optional, Callable, Any
+import atexit
+import re
+import threading
+import time
+
+from utils.sandbox_utils import remove_repo_sandbox
+
+
+READ_ONLY_EXPR = re.compile(r'^[A-Za-z_$][\w$]*(\s*\.\s*[A-Za-z_$][\w$]*|\s*\[\s*\d+\s*\])*$')
+
+
+def is_read_only_expr(var_or_expr: str) -> bool:
+    """
+    A variable, field or constant index access, evaluating it can not change the program state.
+    """
+    return READ_ONLY_EXPR.match(var_or_expr.strip()) is not None
+
+
+class DebugSession:
+    def __init__(self, debugger: Any, debug_repo_path: str, debug_port: Optional[int] = None) -> None:
+        self.debugger = debugger
+        self.debug_repo_path = debug_repo_path
+        self.debug_port = debug_port
+        self.last_used = time.time()
+        # an expression evaluated in the session may have changed the program state
+        self.dirty = False
+
+    def record_query(self, var_or_expr: str) -> None:
+        if not is_read_only_expr(var_or_expr):
+            self.dirty = True
+
+    def close(self) -> None:
+        try:
+            self.debugger.close()
+        finally:
+            remove_repo_sandbox(self.debug_repo_path)
+
+
+class DebuggerPool:
+    def __init__(self, max_sessions: int = 0, idle_timeout: float = 600.0) -> None:
+        """
+        Args:
+            max_sessions: max idle sessions kept alive, 0 closes every session when it is released
+            idle_timeout: seconds an idle session is kept
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.idle_sessions: Dict[Tuple, List[DebugSession]] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_sessions > 0
+
+    def acquire(self, key: Tuple) -> Optional[DebugSession]:
+        self.evict_idle()
+        with self.lock:
+            sessions = self.idle_sessions.get(key, [])
+            while len(sessions) > 0:
+                session = sessions.pop()
+                if session.debugger.started:
+                    session.last_used = time.time()
+                    print(f'>>> reuse debugger session {key}')
+                    return session
+                session.close()
+        return None
+
+    def release(self, key: Tuple, session: DebugSession) -> None:
+        if not self.enabled or not session.debugger.started or session.dirty:
+            session.close()
+            return
+
+        session.last_used = time.time()
+        with self.lock:
+            self.idle_sessions.setdefault(key, []).append(session)
+        self.evict_idle()
+
+    def evict_where(self, condition: Callable[[DebugSession], bool]) -> None:
+        evicted = []
+        with self.lock:
+            for key in list(self.idle_sessions.keys()):
+                keep = []
+                for session in self.idle_sessions[key]:
+                    (evicted if condition(session) else keep).append(session)
+                if len(keep) > 0:
+                    self.idle_sessions[key] = keep
+                else:
+                    del self.idle_sessions[key]
+        for session in evicted:
+            session.close()
+
+    def evict_idle(self) -> None:
+        now = time.time()
+        self.evict_where(lambda s: now - s.last_used > self.idle_timeout)
+
+        # keep the most recently used sessions
+        with self.lock:
+            sessions = [s for ss in self.idle_sessions.values() for s in ss]
+        if len(sessions) > self.max_sessions:
+            sessions.sort(key=lambda s: s.last_used)
+            least_used = set(id(s) for s in sessions[:len(sessions) - self.max_sessions])
+            self.evict_where(lambda s: id(s) in least_used)
+
+    def close_all(self) -> None:
+        self.evict_where(lambda s: True)
+
+
+debugger_pool = DebuggerPool()
+
+
+def configure_debugger_pool(max_sessions: int, idle_timeout: float) -> None:
+    debugger_pool.max_sessions = max_sessions
+    debugger_pool.idle_timeout = idle_timeout
+    debugger_pool.evict_idle()
+
+
+atexit.register(debugger_pool.close_all)
@@ -1,4 +1,4 @@
-import shutil
+import asyncio
 from typing import Annotated, Dict, List, Tuple, Optional
 from datetime import datetime
 
@@ -10,10 +10,12 @@ from utils import read_file, write_file
 from utils.code_file_utils.code_file_utils import replace_code_lines
 from utils.java_utils.java_file_utils import get_lineno
 from utils.java_utils.java_debugger import JavaDebugger, DEBUG_MARK
-from utils.java_utils.java_tester import run_java_repo_test
+from utils.java_utils.java_tester import run_java_repo_test, compile_java_repo_test
 from utils.java_utils.java_assert import check_assert_code
+from utils.sandbox_utils import create_repo_sandbox
 
 from .project_tools import ProjectTools
+from .debugger_pool import debugger_pool, DebugSession
 
 
 class JavaProjectTools(ProjectTools):
@@ -21,7 +23,10 @@ class JavaProjectTools(ProjectTools):
             self,
             data: Dict,
             debug_port: int,
-            debug_cache_dir: str
+            debug_cache_dir: str,
+            warm_test_runner: bool = False,
+            compile_check: bool = True,
+            num_sandboxes: int = 1,
     ) -> None:
         """
 
@@ -60,10 +65,16 @@ class JavaProjectTools(ProjectTools):
 
                     resource_file:
                     gen_id: n
+            warm_test_runner: run tests in a long-lived JVM of the repo instead of a new mvn process
+            compile_check: compile the test file with javac before running mvn, candidates that do not compile are not run
+            num_sandboxes: number of candidates tested at the same time
         """
         self.data = data
         self.check_cache: Dict[str, Tuple] = {}
         self.run_test_cache: Dict[str, Tuple] = {}
+        # the debugger is shared by all flows of a sample
+        self.debugger_lock = asyncio.Lock()
+        self.compile_check_lock = asyncio.Lock()
         self.debug_value_cache: Dict[str, str] = {}
 
         self.original_test_prefix_file_content = read_file(self.data['test_prefix_path'])
@@ -75,16 +86,24 @@ class JavaProjectTools(ProjectTools):
             start_lineno=self.data['test_prefix_start_lineno'],
             end_lineno=self.data['test_prefix_end_lineno'],
         )
-        write_file(self.data['test_prefix_path'], self.masked_test_prefix_file_content)
 
         self.debug_port = debug_port
         self.debug_cache_dir = debug_cache_dir
+        self.warm_test_runner = warm_test_runner
+        # the warm runner compiles the test file before running it
+        self.compile_check = compile_check and not warm_test_runner
+        # None: the masked test file has not been compiled yet
+        self.compile_check_available: Optional[bool] = None
+
+        self.init_sandboxes(data=self.data, sandbox_dir=os.path.join(self.debug_cache_dir, 'sandbox'), num_sandboxes=num_sandboxes)
 
         self.java_debugger: Optional[JavaDebugger] = None
         self.debugger_started = False
 
         self.local_vars = None
 
+        # last, `close` restores the file once the tools exist
+        write_file(self.data['test_prefix_path'], self.masked_test_prefix_file_content)
         print('=== All Started ===')
 
     def clean_content(self, content: str):
@@ -92,36 +111,53 @@ class JavaProjectTools(ProjectTools):
 
     def start_debugger(self):
         if not self.debugger_started:
-            # copy to tmp dir
-            os.makedirs(self.debug_cache_dir, exist_ok=True)
-            self.debug_repo_path = os.path.join(self.debug_cache_dir, self.data['repo_name'])
-            if os.path.exists(self.debug_repo_path):
-                shutil.rmtree(self.debug_repo_path, ignore_errors=True)
-            shutil.copytree(self.data['repo_path'], self.debug_repo_path, dirs_exist_ok=True)
-
             self.debug_test_prefix_file_content = self.masked_test_prefix_file_content.replace(self.data['placeholder'], DEBUG_MARK)
-            write_file(
-                os.path.join(self.debug_repo_path, self.data['test_prefix_file_path']),
-                self.debug_test_prefix_file_content
-            )
-
             breakpoint_lineno = get_lineno(self.data['test_prefix'], self.data['placeholder'], self.data['test_prefix_start_lineno'])
-            self.java_debugger = JavaDebugger(
-                repo_path=self.debug_repo_path,
-                sub_repo=self.data['test_prefix_sub_repo'],
-                test_class=self.data['test_class'],
-                test_target=self.data['test_target'],
-                lineno=breakpoint_lineno,
-                debug_port=self.debug_port,
+
+            # samples stopping at the same line of the same test share a suspended session,
+            # the code run up to the breakpoint is the same, whatever is masked after it
+            self.debug_session_key = (
+                self.data['repo_path'],
+                self.data['test_target'],
+                breakpoint_lineno,
             )
+            self.debug_session = debugger_pool.acquire(self.debug_session_key)
+            if self.debug_session is None:
+                if self.debug_port != 0:
+                    # a pooled session keeps the fixed port, it can not be used by two sessions
+                    debugger_pool.evict_where(lambda s: s.debug_port == self.debug_port)
+
+                # sandbox in tmp dir, removed by `cleanup_stale_sandboxes` if the run crashes
+                debug_repo_path = os.path.join(self.debug_cache_dir, 'sandbox', f'''debug-{self.data['repo_name']}-{os.getpid()}''')
+                if debugger_pool.enabled:
+                    debug_repo_path += f'''-{self.data['index']}'''
+                create_repo_sandbox(self.data['repo_path'], debug_repo_path, [self.data['test_prefix_file_path']])
+
+                write_file(
+                    os.path.join(debug_repo_path, self.data['test_prefix_file_path']),
+                    self.debug_test_prefix_file_content
+                )
+
+                java_debugger = JavaDebugger(
+                    repo_path=debug_repo_path,
+                    sub_repo=self.data['test_prefix_sub_repo'],
+                    test_class=self.data['test_class'],
+                    test_target=self.data['test_target'],
+                    lineno=breakpoint_lineno,
+                    debug_port=self.debug_port,
+                )
+                self.debug_session = DebugSession(java_debugger, debug_repo_path, debug_port=java_debugger.debug_port)
+
+            self.java_debugger = self.debug_session.debugger
+            self.debug_repo_path = self.debug_session.debug_repo_path
             self.debugger_started = True
 
     def close_debugger(self):
         if self.debugger_started:
-            self.java_debugger.close()
+            debugger_pool.release(self.debug_session_key, self.debug_session)
             self.debugger_started = False
             self.java_debugger = None
-            shutil.rmtree(self.debug_repo_path, ignore_errors=True)
+            self.debug_session = None
 
     def handle_test_prefix_file(self, file_path: str, file_content: str) -> str:
         if file_path == self.data['test_prefix_path']:
@@ -129,10 +165,14 @@ class JavaProjectTools(ProjectTools):
         return file_content
 
 
+    async def call_debugger(self, func, *args):
+        async with self.debugger_lock:
+            return await asyncio.to_thread(func, *args)
+
     ### Tools Started ###
     async def get_locals(self) -> str:
         if self.local_vars is None:
-            self.local_vars = self.java_debugger.print_locals()
+            self.local_vars = await self.call_debugger(self.java_debugger.print_locals)
         return self.local_vars
 
     async def get_debug_value(
@@ -140,7 +180,8 @@ class JavaProjectTools(ProjectTools):
             var_or_expr: Annotated[str, "The variable name or an expression."],
     ) -> str:
         if not self.debug_value_cache.__contains__(var_or_expr):
-            v = self.java_debugger.print_var_or_expr(var_or_expr)
+            self.debug_session.record_query(var_or_expr)
+            v = await self.call_debugger(self.java_debugger.print_var_or_expr, var_or_expr)
             self.debug_value_cache[var_or_expr] = v
         return self.debug_value_cache[var_or_expr]
 
@@ -152,6 +193,7 @@ class JavaProjectTools(ProjectTools):
         var_or_expr_list = [v.strip() for v in var_or_expr_list if v.strip() != '']
         res = []
         for var_or_expr in var_or_expr_list:
+            self.debug_session.record_query(var_or_expr)
             if not self.debug_value_cache.__contains__(var_or_expr):
                 v = self.java_debugger.print_var_or_expr(var_or_expr)
                 self.debug_value_cache[var_or_expr] = v
@@ -298,40 +340,87 @@ class JavaProjectTools(ProjectTools):
         if self.run_test_cache.__contains__(assert_code):
             return self.run_test_cache[assert_code]
 
-        self.run_test_prefix_file_content = self.masked_test_prefix_file_content.replace(self.data['placeholder'], assert_code)
-        write_file(self.data['test_prefix_path'], self.run_test_prefix_file_content)
-
-        start_t = datetime.now()
-        res, test_run_result = run_java_repo_test(
-            repo_path=self.data['repo_path'],
-            sub_repo=self.data['test_prefix_sub_repo'],
-            test_class=self.data['test_prefix_pkg'],
-            test_target=self.data['test_target'],
-        )
-        passed = res['score'] == 1.0
-        end_t = datetime.now()
-        seconds = (end_t - start_t).total_seconds()
-
-        write_file(self.data['test_prefix_path'], self.masked_test_prefix_file_content)
+        async with self.compile_check_lock:
+            if self.compile_check and self.compile_check_available is None:
+                self.compile_check_available = await self.check_compile_available()
+
+        # the candidate is written into a sandbox of the repo, the cached repo is never edited
+        sandbox_path = await self.acquire_sandbox()
+        try:
+            test_file_path = os.path.join(sandbox_path, self.data['test_prefix_file_path'])
+            run_test_prefix_file_content = self.masked_test_prefix_file_content.replace(self.data['placeholder'], assert_code)
+            write_file(test_file_path, run_test_prefix_file_content)
+
+            start_t = datetime.now()
+            if self.compile_check_available:
+                compile_res, compile_output = await asyncio.to_thread(
+                    compile_java_repo_test,
+                    repo_path=sandbox_path,
+                    sub_repo=self.data['test_prefix_sub_repo'],
+                    test_file_path=test_file_path,
+                )
+                if not compile_res['passed']:
+                    seconds = (datetime.now() - start_t).total_seconds()
+                    test_run_result = f'Compile failed, did not start running.\n{compile_output}'
+                    self.run_test_cache[assert_code] = (False, test_run_result, 0)
+                    return False, test_run_result, seconds
+
+            res, test_run_result = await asyncio.to_thread(
+                run_java_repo_test,
+                repo_path=sandbox_path,
+                sub_repo=self.data['test_prefix_sub_repo'],
+                test_class=self.data['test_prefix_pkg'],
+                test_target=self.data['test_target'],
+                test_file_path=test_file_path,
+                warm=self.warm_test_runner,
+            )
+            passed = res['score'] == 1.0
+            end_t = datetime.now()
+            seconds = (end_t - start_t).total_seconds()
+        finally:
+            self.release_sandbox(sandbox_path)
 
         self.run_test_cache[assert_code] = (passed, test_run_result, 0)
         return passed, test_run_result, seconds
 
     ### Tools Ended ###
+    async def check_compile_available(self) -> bool:
+        """
+        The javac fast path is only trusted if the masked test file itself compiles,
+        otherwise (e.g. no cp.txt, generated sources) every candidate goes to mvn.
+        """
+        if not os.path.exists(os.path.join(self.data['repo_path'], self.data['test_prefix_sub_repo'], 'cp.txt')):
+            return False
+        res, _ = await asyncio.to_thread(
+            compile_java_repo_test,
+            repo_path=self.data['repo_path'],
+            sub_repo=self.data['test_prefix_sub_repo'],
+            test_file_path=self.data['test_prefix_path'],
+        )
+        return res['passed']
+
     def close(self):
-        self.close_debugger()
-        write_file(self.data['test_prefix_path'], self.original_test_prefix_file_content)
+        try:
+            self.close_debugger()
+            # the warm test runners of the sandboxes are kept for the next samples, and closed at exit
+            self.close_sandboxes()
+        finally:
+            write_file(self.data['test_prefix_path'], self.original_test_prefix_file_content)
 
 
 def get_java_project_tools(
         data: Dict,
         debug_port: int,
         debug_cache_dir: str,
+        warm_test_runner: bool = False,
+        num_sandboxes: int = 1,
 ) -> Tuple[JavaProjectTools, Dict[str, FunctionTool]]:
     java_project_tools = JavaProjectTools(
         data=data,
         debug_port=debug_port,
-        debug_cache_dir=debug_cache_dir
+        debug_cache_dir=debug_cache_dir,
+        warm_test_runner=warm_test_runner,
+        num_sandboxes=num_sandboxes,
     )
     return java_project_tools, {
         'run_test': FunctionTool(
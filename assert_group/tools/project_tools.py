@@ -1,4 +1,90 @@
-from typing import Annotated, Tuple
+from typing import Annotated, Tuple, Dict, List
+import asyncio
+import atexit
+import os
+import threading
+
+from utils.file_utils import write_file
+from utils.sandbox_utils import create_repo_sandbox, remove_repo_sandbox, cleanup_stale_sandboxes, make_private_file
+
+
+class SandboxPool:
+    def __init__(self, sandbox_dir: str, repo_name: str) -> None:
+        """
+        The sandboxes of a repo in a sandbox dir (one per worker), kept for the later samples of the repo,
+        so that their private build dirs and the warm test runners started in them are reused.
+        """
+        self.sandbox_dir = sandbox_dir
+        self.repo_name = repo_name
+        self.idle: List[str] = []
+        self.paths: List[str] = []
+        # sandbox path -> files replaced by private copies -> their original content
+        self.private_files: Dict[str, Dict[str, str]] = {}
+        self.lock = threading.Lock()
+
+    def checkout(self, repo_path: str, test_file_path: str, original_content: str) -> str:
+        """
+        An idle sandbox of the repo, created if there is none.
+        Args:
+            test_file_path: relative to the repo, a private copy in the sandbox
+            original_content: of the test file, restored by `checkin` (the cached repo may hold the masked one)
+        """
+        with self.lock:
+            sandbox_path = self.idle.pop() if len(self.idle) > 0 else None
+            if sandbox_path is None:
+                sandbox_path = os.path.join(self.sandbox_dir, f'{self.repo_name}-{os.getpid()}-{len(self.paths)}')
+                self.paths.append(sandbox_path)
+
+        if not os.path.isdir(sandbox_path):
+            create_repo_sandbox(repo_path, sandbox_path, [test_file_path])
+            self.private_files[sandbox_path] = {}
+        elif not self.private_files[sandbox_path].__contains__(test_file_path):
+            # created for another test file of the repo, this one is still a hardlink to the cached repo
+            make_private_file(sandbox_path, test_file_path)
+        if not self.private_files[sandbox_path].__contains__(test_file_path):
+            self.private_files[sandbox_path][test_file_path] = original_content
+        return sandbox_path
+
+    def checkin(self, sandbox_paths: List[str]) -> None:
+        """
+        The private files get their original content back, the candidates written by `run_test` must not be
+        compiled or collected with the tests of a later sample.
+        """
+        for sandbox_path in sandbox_paths:
+            for test_file_path, content in self.private_files.get(sandbox_path, {}).items():
+                write_file(os.path.join(sandbox_path, test_file_path), content)
+        with self.lock:
+            self.idle.extend(sandbox_paths)
+
+    def remove_all(self) -> None:
+        with self.lock:
+            for sandbox_path in self.paths:
+                remove_repo_sandbox(sandbox_path)
+            self.paths = []
+            self.idle = []
+            self.private_files = {}
+
+
+_sandbox_pools: Dict[Tuple[str, str], SandboxPool] = {}
+_sandbox_pools_lock = threading.Lock()
+
+
+def get_sandbox_pool(sandbox_dir: str, repo_name: str) -> SandboxPool:
+    key = (os.path.abspath(sandbox_dir), repo_name)
+    with _sandbox_pools_lock:
+        if not _sandbox_pools.__contains__(key):
+            os.makedirs(key[0], exist_ok=True)
+            cleanup_stale_sandboxes(key[0])
+            _sandbox_pools[key] = SandboxPool(sandbox_dir=key[0], repo_name=repo_name)
+        return _sandbox_pools[key]
+
+
+@atexit.register
+def remove_sandbox_pools() -> None:
+    with _sandbox_pools_lock:
+        for pool in _sandbox_pools.values():
+            pool.remove_all()
+        _sandbox_pools.clear()
 
 
 class ProjectTools:
@@ -8,6 +94,36 @@ class ProjectTools:
     def close_debugger(self):
         raise NotImplementedError
 
+    def init_sandboxes(self, data: Dict, sandbox_dir: str, num_sandboxes: int) -> None:
+        """
+        Candidates are tested in sandboxes of the repo (see `utils.sandbox_utils`), at most `num_sandboxes` at the same time.
+        The sandboxes are taken from the pool of the repo on first use, and returned to it by `close_sandboxes`
+        for the later samples of the repo, they are removed at exit.
+        """
+        self.sandbox_pool = get_sandbox_pool(sandbox_dir, data['repo_name'])
+        self.num_sandboxes = max(num_sandboxes, 1)
+        self.sandbox_paths: List[str] = []
+        self.free_sandboxes = asyncio.Queue()
+
+    async def acquire_sandbox(self) -> str:
+        if self.free_sandboxes.empty() and len(self.sandbox_paths) < self.num_sandboxes:
+            sandbox_path = await asyncio.to_thread(
+                self.sandbox_pool.checkout,
+                self.data['repo_path'],
+                self.data['test_prefix_file_path'],
+                self.original_test_prefix_file_content,
+            )
+            self.sandbox_paths.append(sandbox_path)
+            return sandbox_path
+        return await self.free_sandboxes.get()
+
+    def release_sandbox(self, sandbox_path: str) -> None:
+        self.free_sandboxes.put_nowait(sandbox_path)
+
+    def close_sandboxes(self) -> None:
+        self.sandbox_pool.checkin(self.sandbox_paths)
+        self.sandbox_paths = []
+
 
     async def static_check_assert(
             self,
@@ -24,4 +140,3 @@ class ProjectTools:
     ### Tools Ended ###
     def close(self):
         raise NotImplementedError
-
@@ -1,4 +1,4 @@
-import shutil
+import asyncio
 from typing import Annotated, Dict, List, Tuple, Optional
 from datetime import datetime
 
@@ -10,23 +10,19 @@ from utils.code_file_utils.code_file_utils import replace_code_lines
 from utils.python_utils.python_debugger import PythonDebugger, insert_breakpoint
 from utils.python_utils.python_tester import run_py_repo_test
 from utils.python_utils.python_assert import check_assert_code
+from utils.sandbox_utils import create_repo_sandbox
 
 from .project_tools import ProjectTools
-
-
-def ignore_dirs(dir, files):
-    ignore_list = []
-    for f in files:
-        if f in {'.venv'}:
-            ignore_list.append(f)
-    return ignore_list
+from .debugger_pool import debugger_pool, DebugSession
 
 
 class PythonProjectTools(ProjectTools):
     def __init__(
             self,
             data: Dict,
-            debug_cache_dir: str
+            debug_cache_dir: str,
+            warm_test_runner: bool = False,
+            num_sandboxes: int = 1,
     ) -> None:
         """
 
@@ -56,10 +52,15 @@ class PythonProjectTools(ProjectTools):
 
                     resource_file:
                     gen_id: n
+            warm_test_runner: run tests in a long-lived python process of the repo venv instead of a new pytest process
+            num_sandboxes: number of candidates tested at the same time
         """
         self.data = data
         self.check_cache: Dict[str, Tuple] = {}
         self.run_test_cache: Dict[str, Tuple] = {}
+        self.warm_test_runner = warm_test_runner
+        # the debugger is shared by all flows of a sample
+        self.debugger_lock = asyncio.Lock()
 
         self.test_file_cache = []
 
@@ -71,26 +72,21 @@ class PythonProjectTools(ProjectTools):
             start_lineno=self.data['test_prefix_start_lineno'],
             end_lineno=self.data['test_prefix_end_lineno'],
         )
-        write_file(self.data['test_prefix_path'], self.masked_test_prefix_file_content)
 
         self.debug_cache_dir = debug_cache_dir
+        self.init_sandboxes(data=self.data, sandbox_dir=os.path.join(self.debug_cache_dir, 'sandbox'), num_sandboxes=num_sandboxes)
 
         self.python_debugger: Optional[PythonDebugger] = None
         self.debugger_started = False
 
         self.local_vars = None
 
+        # last, `close` restores the file once the tools exist
+        write_file(self.data['test_prefix_path'], self.masked_test_prefix_file_content)
         print('=== All Started ===')
 
     def start_debugger(self):
         if not self.debugger_started:
-            # copy to tmp dir
-            os.makedirs(self.debug_cache_dir, exist_ok=True)
-            self.debug_repo_path = os.path.join(self.debug_cache_dir, self.data['repo_name'])
-            if os.path.exists(self.debug_repo_path):
-                shutil.rmtree(self.debug_repo_path, ignore_errors=True)
-            shutil.copytree(self.data['repo_path'], self.debug_repo_path, dirs_exist_ok=True, ignore=ignore_dirs)
-
             debug_test_prefix = insert_breakpoint(
                 self.data['test_prefix'],
                 self.data['ground_truth_oracle_lineno'] - self.data['test_prefix_start_lineno'] + 1,
@@ -101,26 +97,46 @@ class PythonProjectTools(ProjectTools):
                 start_lineno=self.data['test_prefix_start_lineno'],
                 end_lineno=self.data['test_prefix_end_lineno'],
             )
-            write_file(
-                os.path.join(self.debug_repo_path, self.data['test_prefix_file_path']),
-                self.debug_test_prefix_file_content
-            )
 
-            self.python_debugger = PythonDebugger(
-                repo_path=self.data['repo_path'],
-                debug_repo_path=self.debug_repo_path,
-                test_file_path=self.data['test_prefix_file_path'],
-                test_target=self.data['test_target'],
-                lineno=self.data['ground_truth_oracle_lineno'],
+            # samples stopping at the same line of the same test share a suspended session,
+            # the code run up to the breakpoint is the same, whatever is masked after it
+            self.debug_session_key = (
+                self.data['repo_path'],
+                self.data['test_target'],
+                self.data['ground_truth_oracle_lineno'],
             )
+            self.debug_session = debugger_pool.acquire(self.debug_session_key)
+            if self.debug_session is None:
+                # sandbox in tmp dir, removed by `cleanup_stale_sandboxes` if the run crashes
+                debug_repo_path = os.path.join(self.debug_cache_dir, 'sandbox', f'''debug-{self.data['repo_name']}-{os.getpid()}''')
+                if debugger_pool.enabled:
+                    debug_repo_path += f'''-{self.data['index']}'''
+                create_repo_sandbox(self.data['repo_path'], debug_repo_path, [self.data['test_prefix_file_path']])
+
+                write_file(
+                    os.path.join(debug_repo_path, self.data['test_prefix_file_path']),
+                    self.debug_test_prefix_file_content
+                )
+
+                python_debugger = PythonDebugger(
+                    repo_path=self.data['repo_path'],
+                    debug_repo_path=debug_repo_path,
+                    test_file_path=self.data['test_prefix_file_path'],
+                    test_target=self.data['test_target'],
+                    lineno=self.data['ground_truth_oracle_lineno'],
+                )
+                self.debug_session = DebugSession(python_debugger, debug_repo_path)
+
+            self.python_debugger = self.debug_session.debugger
+            self.debug_repo_path = self.debug_session.debug_repo_path
             self.debugger_started = True
 
     def close_debugger(self):
         if self.debugger_started:
-            self.python_debugger.close()
+            debugger_pool.release(self.debug_session_key, self.debug_session)
             self.debugger_started = False
             self.python_debugger = None
-            shutil.rmtree(self.debug_repo_path, ignore_errors=True)
+            self.debug_session = None
 
     def handle_test_prefix_file(self, file_path: str, file_content: str) -> str:
         if file_path == self.data['test_prefix_path']:
@@ -128,10 +144,14 @@ class PythonProjectTools(ProjectTools):
         return file_content
 
 
+    async def call_debugger(self, func, *args):
+        async with self.debugger_lock:
+            return await asyncio.to_thread(func, *args)
+
     ### Tools Started ###
     async def get_locals(self) -> str:
         if self.local_vars is None:
-            v = self.python_debugger.print_locals()
+            v = await self.call_debugger(self.python_debugger.print_locals)
             if len(v) > 1024:
                 v = v[:1024] + '...'
             self.local_vars = v
@@ -141,7 +161,8 @@ class PythonProjectTools(ProjectTools):
             self,
             var_or_expr: Annotated[str, "The variable name or an expression."],
     ) -> str:
-        value = self.python_debugger.print_var_or_expr(var_or_expr)
+        self.debug_session.record_query(var_or_expr)
+        value = await self.call_debugger(self.python_debugger.print_var_or_expr, var_or_expr)
         if len(value) > 1024:
             value = value[:1024] + '...'
         return value
@@ -156,6 +177,7 @@ class PythonProjectTools(ProjectTools):
         for v in var_or_expr_list:
             if len(v) > 1024:
                 v = v[:1024] + '...'
+            self.debug_session.record_query(v)
             r = self.python_debugger.print_var_or_expr(v)
             res.append(r)
         return '\n'.join(res)
@@ -190,36 +212,49 @@ class PythonProjectTools(ProjectTools):
         if self.run_test_cache.__contains__(assert_code):
             return self.run_test_cache[assert_code]
 
-        self.run_test_prefix_file_content = self.masked_test_prefix_file_content.replace(self.data['placeholder'], assert_code)
-        write_file(self.data['test_prefix_path'], self.run_test_prefix_file_content)
-
-        start_t = datetime.now()
-        res, test_run_result = run_py_repo_test(
-            repo_path=self.data['repo_path'],
-            test_target=self.data['test_target'],
-        )
-        passed = res['score'] == 1.0
-        end_t = datetime.now()
-        seconds = (end_t - start_t).total_seconds()
+        # the candidate is written into a sandbox of the repo, the cached repo is never edited
+        sandbox_path = await self.acquire_sandbox()
+        try:
+            run_test_prefix_file_content = self.masked_test_prefix_file_content.replace(self.data['placeholder'], assert_code)
+            write_file(os.path.join(sandbox_path, self.data['test_prefix_file_path']), run_test_prefix_file_content)
 
-        write_file(self.data['test_prefix_path'], self.masked_test_prefix_file_content)
+            start_t = datetime.now()
+            res, test_run_result = await asyncio.to_thread(
+                run_py_repo_test,
+                repo_path=sandbox_path,
+                test_target=self.data['test_target'],
+                warm=self.warm_test_runner,
+            )
+            passed = res['score'] == 1.0
+            end_t = datetime.now()
+            seconds = (end_t - start_t).total_seconds()
+        finally:
+            self.release_sandbox(sandbox_path)
 
         self.run_test_cache[assert_code] = (passed, test_run_result, 0)
         return passed, test_run_result, seconds
 
     ### Tools Ended ###
     def close(self):
-        self.close_debugger()
-        write_file(self.data['test_prefix_path'], self.original_test_prefix_file_content)
+        try:
+            self.close_debugger()
+            # the warm test runners of the sandboxes are kept for the next samples, and closed at exit
+            self.close_sandboxes()
+        finally:
+            write_file(self.data['test_prefix_path'], self.original_test_prefix_file_content)
 
 
 def get_python_project_tools(
         data: Dict,
         debug_cache_dir: str,
+        warm_test_runner: bool = False,
+        num_sandboxes: int = 1,
 ) -> Tuple[PythonProjectTools, Dict[str, FunctionTool]]:
     python_project_tools = PythonProjectTools(
         data=data,
-        debug_cache_dir=debug_cache_dir
+        debug_cache_dir=debug_cache_dir,
+        warm_test_runner=warm_test_runner,
+        num_sandboxes=num_sandboxes,
     )
     return python_project_tools, {
         'run_test': FunctionTool(
@@ -0,0 +1,167 @@
+"""
+On-disk cache of LLM summaries keyed by what is summarized (e.g. a callee definition and its content),
+shared by all samples, and by all runs / models pointed at the same dir.
+
+A key is summarized once: concurrent requests in this process wait for the first one,
+other processes wait on the lock file of the key, which is removed once the summary is written.
+"""
+from typing import Dict, Optional, Callable, Awaitable, Any
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import threading
+
+from utils import read_json, write_json
+
+
+class OwnerCancelled(Exception):
+    """
+    The request creating a summary was cancelled, one of its waiters creates it instead.
+    """
+
+
+class SummaryCache:
+    def __init__(self, cache_dir: str, lock_poll_interval: float = 0.5) -> None:
+        """
+        Args:
+            cache_dir: one json file per summary
+            lock_poll_interval: seconds between tries of a lock held by another process
+        """
+        self.cache_dir = cache_dir
+        self.lock_poll_interval = lock_poll_interval
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # key -> summary being created in this process
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(**fields: Any) -> str:
+        content = json.dumps(fields, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            return read_json(self._path(key))['summary']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, summary: str, fields: Optional[Dict] = None) -> None:
+        write_json(self._path(key), {'fields': fields, 'summary': summary})
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.lock')
+
+    async def _acquire_file_lock(self, key: str):
+        lock_file = open(self._lock_path(key), 'w')
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except OSError:
+                await asyncio.sleep(self.lock_poll_interval)
+
+    @staticmethod
+    def _release_file_lock(lock_file) -> None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
+
+    async def get_or_create(
+            self,
+            key: str,
+            create: Callable[[], Awaitable[str]],
+            fields: Optional[Dict] = None,
+    ) -> str:
+        """
+        Args:
+            create: makes the summary on a miss
+            fields: what the key was made of, stored with the summary for inspection
+        """
+        summary = self.get(key)
+        if summary is not None:
+            with self.lock:
+                self.hits += 1
+            return summary
+
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.lock:
+                future = self.in_flight.get(key)
+                owner = future is None or future.get_loop() is not loop
+                if owner:
+                    future = loop.create_future()
+                    self.in_flight[key] = future
+            if owner:
+                break
+            try:
+                summary = await asyncio.shield(future)
+            except OwnerCancelled:
+                # the entry is cleared, try to become the owner
+                continue
+            with self.lock:
+                self.hits += 1
+            return summary
+
+        try:
+            lock_file = await self._acquire_file_lock(key)
+            try:
+                # written by another process while waiting for the lock
+                summary = self.get(key)
+                with self.lock:
+                    if summary is not None:
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+                if summary is None:
+                    summary = await create()
+                    self.put(key, summary, fields)
+                    # later requests find the summary, the lock is not needed anymore
+                    try:
+                        os.unlink(self._lock_path(key))
+                    except FileNotFoundError:
+                        pass
+            finally:
+                self._release_file_lock(lock_file)
+            future.set_result(summary)
+            return summary
+        except asyncio.CancelledError:
+            # only this request is cancelled, not the flows waiting for the same summary
+            future.set_exception(OwnerCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark it retrieved, the waiters (if any) get it from their own await
+            future.exception()
+            raise
+        finally:
+            with self.lock:
+                if self.in_flight.get(key) is future:
+                    del self.in_flight[key]
+
+    def stats(self) -> Dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / (self.hits + self.misses) if self.hits + self.misses > 0 else 0.0,
+        }
+
+
+_caches: Dict[str, SummaryCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_summary_cache(cache_dir: str) -> SummaryCache:
+    key = os.path.abspath(cache_dir)
+    with _caches_lock:
+        if not _caches.__contains__(key):
+            _caches[key] = SummaryCache(cache_dir=key)
+        return _caches[key]
@@ -3,16 +3,25 @@ from dataset_utils import read_dataset
 from utils import create_dirs, write_json, init_log, read_json
 from tqdm import tqdm
 import os
-import time
-from typing import List, Dict
-
-from assert_group.assert_group import generate_assert
+import copy
+import shutil
+import asyncio
+import traceback
+from typing import List, Dict, Tuple, Optional, Union
+
+from assert_group.assert_group import generate_assert, run_pipeline
+from assert_group.model_client import ResponseCache
+from assert_group.model_client.endpoint_pool import get_endpoint_pool
+from assert_group.model_client.client_registry import configure_client_pool, close_shared_clients
+from assert_group.model_client.concurrency_limiter import configure_concurrency_limiter, get_concurrency_limiter
+from assert_group.tools.debugger_pool import configure_debugger_pool
 
 from utils.java_utils.pkg_utils import path_to_pkg, DEFAULT_SOURCE_ROOT
 from utils.java_utils.java_file_utils import JAVA_ASSERT_PLACEHOLDER, JAVA_COM_ASSERT_PLACEHOLDER, get_java_method_name
 from utils.python_utils.python_file_utils import PY_ASSERT_PLACEHOLDER, PY_COM_ASSERT_PLACEHOLDER, get_python_method_name
 
-from utils import print_log
+from utils import print_log, init_task_log, close_task_log
+from utils.prompt_cache_utils import CACHE_SCOPES, make_cache_salt
 
 
 def get_placeholder_line(code: str, placeholder: str) -> int:
@@ -25,6 +34,7 @@ def get_placeholder_line(code: str, placeholder: str) -> int:
 
 def make_java_input_data(
         data: Dict,
+        index: int,
         repo_path: str,
         calls_extract_dir: str,
 ) -> Dict:
@@ -36,7 +46,7 @@ def make_java_input_data(
     test_setup_sub_repo, test_setup_pkg = path_to_pkg(data['test_setup_file_path'])
 
     input_data = {
-        'index': i,
+        'index': index,
 
         'source_root': DEFAULT_SOURCE_ROOT,
 
@@ -87,13 +97,14 @@ def make_java_input_data(
 
 def make_python_input_data(
         data: Dict,
+        index: int,
         repo_path: str,
 ):
     placeholder = PY_ASSERT_PLACEHOLDER
     new_placeholder = PY_COM_ASSERT_PLACEHOLDER
 
     return {
-        'index': i,
+        'index': index,
 
         'repo_name': data['repo_name'],
         'repo_path': repo_path,
@@ -129,6 +140,51 @@ def make_python_input_data(
     }
 
 
+def make_generate_input(
+        i: int,
+        agent_cache_dir: str,
+        calls_msg_cache_dir: str,
+        repo_cache_dir: str,
+        calls_extract_dir: str,
+        data: Dict,
+        lang: str,
+        sampling_args: Dict,
+        resource_file: str,
+        debug_cache_dir: str,
+        symbol_index_dir: Optional[str] = None,
+        summary_cache_dir: Optional[str] = None,
+        cache_scope: str = 'sample',
+) -> Tuple[Dict, Dict]:
+    """
+    Returns:
+        input_data: the data passed to the agents
+        sampling_args: a copy of sampling_args with the prompt cache key of this sample
+    """
+    sampling_args = copy.deepcopy(sampling_args)
+    # the same for reruns of the sample, so the server can reuse the prefixes of earlier runs
+    sampling_args['prompt_cache_key'] = make_cache_salt(cache_scope, data)
+    sampling_args['extra_body']['cache_salt'] = sampling_args['prompt_cache_key']
+
+    repo_path = os.path.abspath(os.path.join(f'''{repo_cache_dir}/{data['repo_name']}'''))
+
+    if lang.lower() == 'java':
+        input_data = make_java_input_data(data, i, repo_path, calls_extract_dir)
+    else:
+        input_data = make_python_input_data(data, i, repo_path)
+
+    input_data['agent_cache_dir'] = agent_cache_dir
+    input_data['calls_msg_cache_dir'] = calls_msg_cache_dir
+    input_data['calls_extract_dir'] = calls_extract_dir
+    input_data['debug_cache_dir'] = debug_cache_dir
+    input_data['resource_file'] = resource_file
+    input_data['symbol_index_dir'] = symbol_index_dir
+    input_data['summary_cache_dir'] = summary_cache_dir
+    input_data['cache_scope'] = cache_scope
+    # routes the requests of this sample to one server, independent of the cache scope
+    input_data['affinity_key'] = make_cache_salt('sample', data)
+    return input_data, sampling_args
+
+
 def generate(
         i: int,
         agent_cache_dir: str,
@@ -136,8 +192,8 @@ def generate(
         repo_cache_dir: str,
         calls_extract_dir: str,
         model_path: str,
-        base_url: str,
-        api_key: str,
+        base_url: Union[str, List[str]],
+        api_key: Union[str, List[str]],
         data: Dict,
         generation_mode: str,
         lang: str,
@@ -153,6 +209,13 @@ def generate(
 
         max_tries: int,
         existing_assert_code: List[str],
+        batch_size: int = 1,
+        response_cache: Optional[ResponseCache] = None,
+        warm_test_runner: bool = False,
+        symbol_index_dir: Optional[str] = None,
+        explore_concurrency: int = 8,
+        summary_cache_dir: Optional[str] = None,
+        cache_scope: str = 'sample',
 ) -> List:
     """
     Args:
@@ -164,26 +227,103 @@ def generate(
         gen_oracles: ['assert ...', ]
         resources: ["messages": [], "input_tokens": ..., "output_tokens": ...}]
     """
-    sampling_args['prompt_cache_key'] = f'assertagent_{i}_{time.time()}'
-    sampling_args['extra_body']['cache_salt'] = sampling_args['prompt_cache_key']
+    input_data, sampling_args = make_generate_input(
+        i=i,
+        agent_cache_dir=agent_cache_dir,
+        calls_msg_cache_dir=calls_msg_cache_dir,
+        repo_cache_dir=repo_cache_dir,
+        calls_extract_dir=calls_extract_dir,
+        data=data,
+        lang=lang,
+        sampling_args=sampling_args,
+        resource_file=resource_file,
+        debug_cache_dir=debug_cache_dir,
+        symbol_index_dir=symbol_index_dir,
+        summary_cache_dir=summary_cache_dir,
+        cache_scope=cache_scope,
+    )
 
-    if lang.lower() == 'java':
-        repo_path = os.path.abspath(os.path.join(f'''{repo_cache_dir}/{data['repo_name']}'''))
-    else:
-        repo_path = os.path.abspath(os.path.join(f'''{repo_cache_dir}/{data['repo_name']}'''))
+    gen_oracles = generate_assert(
+        data=input_data,
+        generation_mode=generation_mode,
+        lang=lang,
 
-    if lang.lower() == 'java':
-        input_data = make_java_input_data(data, repo_path, calls_extract_dir)
-    else:
-        input_data = make_python_input_data(data, repo_path)
+        sampling_args=sampling_args,
+        model_path=model_path,
+        base_url=base_url,
+        api_key=api_key,
 
-    input_data['agent_cache_dir'] = agent_cache_dir
-    input_data['calls_msg_cache_dir'] = calls_msg_cache_dir
-    input_data['calls_extract_dir'] = calls_extract_dir
-    input_data['debug_cache_dir'] = debug_cache_dir
-    input_data['resource_file'] = resource_file
+        max_tool_calls=5,
+        max_reviews=3,
+        debug_port=debug_port,
 
-    gen_oracles = generate_assert(
+        with_explore_agent=with_explore_agent,
+        with_dynamic=with_dynamic,
+        with_locals=with_locals,
+        debug_cache_dir=debug_cache_dir,
+        nums=nums,
+        max_tries=max_tries,
+        existing_assert_code=existing_assert_code,
+        batch_size=batch_size,
+        response_cache=response_cache,
+        warm_test_runner=warm_test_runner,
+        explore_concurrency=explore_concurrency,
+    )
+    return gen_oracles
+
+
+async def generate_async(
+        i: int,
+        agent_cache_dir: str,
+        calls_msg_cache_dir: str,
+        repo_cache_dir: str,
+        calls_extract_dir: str,
+        model_path: str,
+        base_url: Union[str, List[str]],
+        api_key: Union[str, List[str]],
+        data: Dict,
+        generation_mode: str,
+        lang: str,
+        sampling_args: Dict,
+        resource_file: str,
+        nums: int,
+        debug_port: int,
+
+        with_dynamic: bool,
+        with_explore_agent: bool,
+        with_locals: bool,
+        debug_cache_dir: str,
+
+        max_tries: int,
+        existing_assert_code: List[str],
+        batch_size: int = 1,
+        response_cache: Optional[ResponseCache] = None,
+        warm_test_runner: bool = False,
+        symbol_index_dir: Optional[str] = None,
+        explore_concurrency: int = 8,
+        summary_cache_dir: Optional[str] = None,
+        cache_scope: str = 'sample',
+) -> List:
+    """
+    Same as `generate`, but runs inside the caller's event loop, so that several samples can run concurrently.
+    """
+    input_data, sampling_args = make_generate_input(
+        i=i,
+        agent_cache_dir=agent_cache_dir,
+        calls_msg_cache_dir=calls_msg_cache_dir,
+        repo_cache_dir=repo_cache_dir,
+        calls_extract_dir=calls_extract_dir,
+        data=data,
+        lang=lang,
+        sampling_args=sampling_args,
+        resource_file=resource_file,
+        debug_cache_dir=debug_cache_dir,
+        symbol_index_dir=symbol_index_dir,
+        summary_cache_dir=summary_cache_dir,
+        cache_scope=cache_scope,
+    )
+
+    return await run_pipeline(
         data=input_data,
         generation_mode=generation_mode,
         lang=lang,
@@ -204,8 +344,140 @@ def generate(
         nums=nums,
         max_tries=max_tries,
         existing_assert_code=existing_assert_code,
+        batch_size=batch_size,
+        response_cache=response_cache,
+        warm_test_runner=warm_test_runner,
+        explore_concurrency=explore_concurrency,
     )
-    return gen_oracles
+
+
+def read_existing_assert_code(output_file: str) -> List[str]:
+    if os.path.exists(output_file):
+        output = read_json(output_file)
+        return [r['gen_oracle'] for r in output['results']]
+    return []
+
+
+def write_output(output_file: str, i: int, data: Dict, gen_oracles: List[str]) -> None:
+    output_content = {
+        'index': i,
+        'ground_truth_oracle': data['ground_truth_oracle'],
+        'results': [
+            {'gen_oracle': a} for a in gen_oracles
+        ],
+    }
+    write_json(output_file, output_content)
+
+
+def prepare_worker_repo(repo_cache_dir: str, worker_repo_cache_dir: str, repo_name: str) -> None:
+    """
+    Copy a repo into the worker's own checkout once, `.venv` is linked instead of copied.
+    """
+    worker_repo_path = os.path.join(worker_repo_cache_dir, repo_name)
+    if os.path.exists(worker_repo_path):
+        return
+
+    repo_path = os.path.join(repo_cache_dir, repo_name)
+    tmp_repo_path = worker_repo_path + '.tmp'
+    shutil.rmtree(tmp_repo_path, ignore_errors=True)
+    os.makedirs(worker_repo_cache_dir, exist_ok=True)
+    shutil.copytree(repo_path, tmp_repo_path, symlinks=True, ignore=shutil.ignore_patterns('.venv'))
+    if os.path.exists(os.path.join(repo_path, '.venv')):
+        os.symlink(os.path.join(repo_path, '.venv'), os.path.join(tmp_repo_path, '.venv'))
+    os.rename(tmp_repo_path, worker_repo_path)
+
+
+async def run_concurrent(
+        indices: List[int],
+        dataset: List[Dict],
+        args: argparse.Namespace,
+        sampling_args: Dict,
+        log_dir: str,
+        output_dir: str,
+        resource_dir: str,
+        agent_cache_dir: str,
+        response_cache: Optional[ResponseCache] = None,
+) -> None:
+    """
+    Run samples with `args.concurrency` workers in one event loop.
+    Worker k owns the repo checkout `<repo_cache_dir>_worker<k>` and the debug dir `<debug_cache_dir>_worker<k>`.
+    Debug ports are allocated per session, or `debug_port + k` if a fixed `debug_port` is given.
+    """
+    queue = asyncio.Queue()
+    for i in indices:
+        queue.put_nowait(i)
+
+    repo_cache_dir = os.path.abspath(args.repo_cache_dir)
+    debug_cache_dir = os.path.abspath(args.debug_cache_dir)
+    progress = tqdm(total=len(indices))
+
+    async def worker(worker_id: int):
+        worker_repo_cache_dir = f'{repo_cache_dir}_worker{worker_id}'
+        worker_debug_cache_dir = f'{debug_cache_dir}_worker{worker_id}'
+        worker_debug_port = args.debug_port + worker_id if args.debug_port != 0 else 0
+
+        while not queue.empty():
+            i = queue.get_nowait()
+            data = dataset[i]
+            output_file = os.path.join(output_dir, f'{i}.json')
+
+            existing_assert_code = read_existing_assert_code(output_file)
+            if len(existing_assert_code) >= args.nums:
+                print_log(content=f'Skip {i}.')
+                progress.update(1)
+                continue
+
+            log_file = os.path.join(log_dir, f'{i}.log')
+            resource_file = os.path.join(resource_dir, f'{i}.jsonl')
+            init_task_log(log_file=log_file)
+
+            try:
+                await asyncio.to_thread(prepare_worker_repo, repo_cache_dir, worker_repo_cache_dir, data['repo_name'])
+                gen_oracles = await generate_async(
+                    i=i,
+                    agent_cache_dir=agent_cache_dir,
+                    calls_msg_cache_dir=args.calls_msg_cache_dir,
+                    calls_extract_dir=args.calls_extract_dir,
+                    repo_cache_dir=worker_repo_cache_dir,
+                    model_path=args.model_path,
+                    base_url=args.base_url,
+                    api_key=args.api_key,
+                    data=data,
+                    generation_mode=args.generation_mode,
+                    lang=args.lang,
+                    sampling_args=sampling_args,
+                    resource_file=resource_file,
+                    nums=args.nums,
+                    debug_port=worker_debug_port,
+
+                    with_dynamic=args.with_dynamic,
+                    with_explore_agent=args.with_explore_agent,
+                    with_locals=args.with_locals,
+
+                    debug_cache_dir=worker_debug_cache_dir,
+
+                    max_tries=args.max_tries,
+                    existing_assert_code=existing_assert_code,
+                    batch_size=args.batch_size,
+                    response_cache=response_cache,
+                    warm_test_runner=args.warm_test_runner,
+                    symbol_index_dir=args.symbol_index_dir,
+                    explore_concurrency=args.explore_concurrency,
+                    summary_cache_dir=args.summary_cache_dir,
+                    cache_scope=args.cache_scope,
+                )
+                write_output(output_file, i, data, gen_oracles)
+            except Exception:
+                # keep the other workers running, the sample is retried on the next run
+                print(f'[worker {worker_id}] Sample {i} failed.')
+                traceback.print_exc()
+            finally:
+                close_task_log()
+                progress.update(1)
+
+    await asyncio.gather(*[worker(k) for k in range(args.concurrency)])
+    progress.close()
+    await close_shared_clients()
 
 
 if __name__ == '__main__':
@@ -218,10 +490,17 @@ if __name__ == '__main__':
 
     parser.add_argument('--calls_extract_dir', type=str, default='cache/teco500')
     parser.add_argument('--calls_msg_cache_dir', type=str, default='cache/teco500_calls_msg')
+    parser.add_argument('--symbol_index_dir', type=str, default=None, help='Resolve the callees the LSP did not find with a tree-sitter symbol index of the repo.')
 
     parser.add_argument('--model_path', type=str, default=None)
-    parser.add_argument('--base_url', type=str)
-    parser.add_argument('--api_key', type=str)
+    parser.add_argument('--base_url', type=str, nargs='+', help='One or more servers of the same model, requests are balanced over them and a sample stays on one server.')
+    parser.add_argument('--api_key', type=str, nargs='+', help='One key for all servers, or one per --base_url.')
+    parser.add_argument('--max_connections', type=int, default=256, help='Max open connections per server, shared by all samples running at the same time.')
+    parser.add_argument('--max_keepalive_connections', type=int, default=64, help='Max idle connections per server kept open for later requests.')
+    parser.add_argument('--keepalive_expiry', type=float, default=60.0, help='Seconds an idle connection is kept open.')
+    parser.add_argument('--http2', action='store_true', help='Use HTTP/2 if the h2 package is installed.')
+    parser.add_argument('--initial_in_flight', type=float, default=16, help='Requests in flight to the servers at the start, the limit then grows on success and halves on 429 / 503 / timeouts.')
+    parser.add_argument('--max_in_flight', type=float, default=256, help='Max requests in flight to the servers.')
     parser.add_argument('--generation_mode', type=str, default='', choices=['think', 'no_think', ''], help='For Qwen3, set this to think or no_think, for Qwen3-Coder set to empty.')
 
     parser.add_argument('--lang', type=str, default='Java', choices=['Java', 'Python'])
@@ -237,16 +516,29 @@ if __name__ == '__main__':
     parser.add_argument('--start_index', type=int, default=0)
     parser.add_argument('--end_index', type=int, default=500)
 
-    parser.add_argument('--debug_port', type=int, default=6001)
+    parser.add_argument('--debug_port', type=int, default=0, help='JDWP port of the Java debugger, 0 to allocate a free port per debugger session.')
 
     parser.add_argument('--v', type=int, default=-1)
 
     parser.add_argument('--max_tries', type=int, default=10)
+    parser.add_argument('--warm_test_runner', action='store_true', help='Run candidate tests in a long-lived test runner per repo instead of a new mvn process per run.')
+    parser.add_argument('--batch_size', type=int, default=1, help='Number of candidates generated at the same time for one sample, duplicated candidates are dropped.')
 
     parser.add_argument('--with_dynamic', action='store_true')
     parser.add_argument('--with_explore_agent', action='store_true')
+    parser.add_argument('--summary_cache_dir', type=str, default=None, help='Share the ExploreAgent summaries of callees across runs / models, by default they are shared by the samples of this run.')
+    parser.add_argument('--explore_concurrency', type=int, default=8, help='Max summarization requests of the ExploreAgent in flight at the same time, 1 sends them one after another.')
 
     parser.add_argument('--with_locals', action='store_true')
+    parser.add_argument('--debugger_pool_size', type=int, default=0, help='Number of suspended debugger sessions kept for later samples that stop at the same line of the same test, 0 to close each session after its sample.')
+    parser.add_argument('--debugger_idle_timeout', type=float, default=600, help='Seconds an unused debugger session is kept.')
+
+    parser.add_argument('--concurrency', type=int, default=1, help='Number of samples running at the same time, each with its own repo checkout and debug port.')
+
+    parser.add_argument('--cache_scope', type=str, default='sample', choices=CACHE_SCOPES, help='Requests that may share the prefix cache of the server: of the same sample, of the same repo, or all requests.')
+
+    parser.add_argument('--response_cache_dir', type=str, default=None, help='Cache model responses on disk, identical requests of later runs are not sent again.')
+    parser.add_argument('--response_cache_size', type=float, default=1024, help='Max size of the response cache in MB, least recently used responses are removed first.')
     args = parser.parse_args()
 
     assert args.lang in {'Java', 'Python'}, f'Unknown language: {args.lang}'
@@ -274,6 +566,19 @@ if __name__ == '__main__':
     create_dirs(resource_dir)
     create_dirs(agent_cache_dir)
 
+    configure_debugger_pool(max_sessions=args.debugger_pool_size, idle_timeout=args.debugger_idle_timeout)
+    configure_client_pool(
+        max_connections=args.max_connections,
+        max_keepalive_connections=args.max_keepalive_connections,
+        keepalive_expiry=args.keepalive_expiry,
+        http2=args.http2,
+    )
+    configure_concurrency_limiter(initial_window=args.initial_in_flight, max_window=args.max_in_flight)
+
+    response_cache = None
+    if args.response_cache_dir is not None:
+        response_cache = ResponseCache(cache_dir=args.response_cache_dir, max_size_mb=args.response_cache_size)
+
     # generate
     if args.start_index < args.end_index:
         start_index = args.start_index
@@ -285,56 +590,72 @@ if __name__ == '__main__':
     assert args.start_index >= 0
     assert args.end_index <= len(dataset)
 
-    for i in tqdm(range(start_index, end_index)):
-        data = dataset[i]
-        output_file = os.path.join(output_dir, f'{i}.json')
-
-        existing_assert_code = []
-        if os.path.exists(output_file):
-            output = read_json(output_file)
-            existing_assert_code = [r['gen_oracle'] for r in output['results']]
-
-        if len(existing_assert_code) >= args.nums:
-            print_log(content=f'Skip {i}.')
-            continue
-
-        log_file = os.path.join(log_dir, f'{i}.log')
-        resource_file = os.path.join(resource_dir, f'{i}.jsonl')
-
-        init_log(log_file=log_file, terminal=False)
-
-        gen_oracles = generate(
-            i=i,
-            agent_cache_dir=agent_cache_dir,
-            calls_msg_cache_dir=args.calls_msg_cache_dir,
-            calls_extract_dir=args.calls_extract_dir,
-            repo_cache_dir=os.path.abspath(args.repo_cache_dir),
-            model_path=args.model_path,
-            base_url=args.base_url,
-            api_key=args.api_key,
-            data=data,
-            generation_mode=args.generation_mode,
-            lang=args.lang,
+    if args.concurrency > 1:
+        asyncio.run(run_concurrent(
+            indices=list(range(start_index, end_index)),
+            dataset=dataset,
+            args=args,
             sampling_args=sampling_args,
-            resource_file=resource_file,
-            nums=args.nums,
-            debug_port=args.debug_port,
-
-            with_dynamic=args.with_dynamic,
-            with_explore_agent=args.with_explore_agent,
-            with_locals=args.with_locals,
-
-            debug_cache_dir=os.path.abspath(args.debug_cache_dir),
-
-            max_tries=args.max_tries,
-            existing_assert_code=existing_assert_code,
-        )
-
-        output_content = {
-            'index': i,
-            'ground_truth_oracle': data['ground_truth_oracle'],
-            'results': [
-                {'gen_oracle': a} for a in gen_oracles
-            ],
-        }
-        write_json(output_file, output_content)
+            log_dir=log_dir,
+            output_dir=output_dir,
+            resource_dir=resource_dir,
+            agent_cache_dir=agent_cache_dir,
+            response_cache=response_cache,
+        ))
+    else:
+        for i in tqdm(range(start_index, end_index)):
+            data = dataset[i]
+            output_file = os.path.join(output_dir, f'{i}.json')
+
+            existing_assert_code = read_existing_assert_code(output_file)
+
+            if len(existing_assert_code) >= args.nums:
+                print_log(content=f'Skip {i}.')
+                continue
+
+            log_file = os.path.join(log_dir, f'{i}.log')
+            resource_file = os.path.join(resource_dir, f'{i}.jsonl')
+
+            init_log(log_file=log_file, terminal=False)
+
+            gen_oracles = generate(
+                i=i,
+                agent_cache_dir=agent_cache_dir,
+                calls_msg_cache_dir=args.calls_msg_cache_dir,
+                calls_extract_dir=args.calls_extract_dir,
+                repo_cache_dir=os.path.abspath(args.repo_cache_dir),
+                model_path=args.model_path,
+                base_url=args.base_url,
+                api_key=args.api_key,
+                data=data,
+                generation_mode=args.generation_mode,
+                lang=args.lang,
+                sampling_args=sampling_args,
+                resource_file=resource_file,
+                nums=args.nums,
+                debug_port=args.debug_port,
+
+                with_dynamic=args.with_dynamic,
+                with_explore_agent=args.with_explore_agent,
+                with_locals=args.with_locals,
+
+                debug_cache_dir=os.path.abspath(args.debug_cache_dir),
+
+                max_tries=args.max_tries,
+                existing_assert_code=existing_assert_code,
+                batch_size=args.batch_size,
+                response_cache=response_cache,
+                warm_test_runner=args.warm_test_runner,
+                symbol_index_dir=args.symbol_index_dir,
+                explore_concurrency=args.explore_concurrency,
+                summary_cache_dir=args.summary_cache_dir,
+                cache_scope=args.cache_scope,
+            )
+
+            write_output(output_file, i, data, gen_oracles)
+
+    if response_cache is not None:
+        print(f'Response cache: {response_cache.stats()}')
+    if args.base_url is not None and len(args.base_url) > 1:
+        print(f'Endpoints: {get_endpoint_pool(args.base_url).stats()}')
+    print(f'Requests in flight: {get_concurrency_limiter(tuple(args.base_url) if args.base_url is not None else (None,)).stats()}')
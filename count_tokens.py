@@ -14,12 +14,14 @@ def count_tokens(resources: List, use_prefix_cache: bool) -> Tuple[int, int]:
         if r['type'] != 'llm':
             continue
 
-        if use_prefix_cache:
-            prompt_tokens += r['usage']['prompt_tokens'] - (r['usage']['prompt_tokens_details']['cached_tokens'] if r['usage']['prompt_tokens_details'] is not None else 0)
-        else:
-            prompt_tokens += r['usage']['prompt_tokens']
-
-        completion_tokens += r['usage']['completion_tokens']
+        # a response replayed from the response cache spent no tokens in this run
+        if not r.get('cached', False):
+            if use_prefix_cache:
+                prompt_tokens += r['usage']['prompt_tokens'] - (r['usage']['prompt_tokens_details']['cached_tokens'] if r['usage']['prompt_tokens_details'] is not None else 0)
+            else:
+                prompt_tokens += r['usage']['prompt_tokens']
+
+            completion_tokens += r['usage']['completion_tokens']
         if r['gen_id'] > 0:
             break
     return prompt_tokens, completion_tokens
@@ -39,6 +41,24 @@ def count_directly_prompt_tokens(resources: List, use_prefix_cache: bool) -> Tup
     return prompt_tokens, completion_tokens
 
 
+def count_cached_tokens(resources: List, cached: Dict[Tuple[str, str], List[int]]) -> None:
+    """
+    Add up the prompt tokens and the prefix cache hits (`prompt_tokens_details.cached_tokens`) of all generations,
+    responses replayed from the response cache are left out.
+    Args:
+        cached: (cache scope, agent) -> [prompt tokens, cached tokens], updated in place
+    """
+    for r in resources:
+        if r.get('type', 'llm') != 'llm' or not r.__contains__('usage') or r.get('cached', False):
+            continue
+        # runs before the cache scope was recorded used a new salt per run
+        scope = r.get('cache_scope') or 'run'
+        counts = cached.setdefault((scope, r.get('agent', 'all')), [0, 0])
+        counts[0] += r['usage']['prompt_tokens']
+        if r['usage'].get('prompt_tokens_details') is not None:
+            counts[1] += r['usage']['prompt_tokens_details'].get('cached_tokens') or 0
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--run_name', type=str)
@@ -52,8 +72,10 @@ if __name__ == '__main__':
     resources_dir = f'resources/{args.run_name}/{args.dataset_name}_{args.method}'
 
     avg_prompt_tokens, avg_completion_tokens = 0.0, 0.0
+    cached: Dict[Tuple[str, str], List[int]] = {}
     for i in range(500):
         resources_file = os.path.join(resources_dir, f'{i}.jsonl')
+        count_cached_tokens(read_jsonl(resources_file), cached)
         if args.method in {'chatassert', 'assertagent'}:
             prompt_tokens, completion_tokens = count_tokens(read_jsonl(resources_file), args.use_prefix_cache)
             avg_prompt_tokens += prompt_tokens
@@ -75,5 +97,9 @@ if __name__ == '__main__':
 === {args.dataset_name} {args.run_name} {args.method} {w_prefix_cache} ===
 avg prompt tokens: {avg_prompt_tokens}
 avg completion tokens: {avg_completion_tokens}
-
 ''')
+    # how much of the prefill the server skipped thanks to its prefix cache
+    for (scope, agent), (prompt_tokens, cached_tokens) in sorted(cached.items()):
+        ratio = cached_tokens / prompt_tokens if prompt_tokens > 0 else 0.0
+        print(f'prefix cache hit ratio (scope {scope}, {agent}): {round(ratio * 100, 2)}% of {prompt_tokens} prompt tokens')
+    print()
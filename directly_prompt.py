@@ -5,10 +5,10 @@ from prompt_utils import get_directly_prompt_messages
 from utils import create_dirs, write_json, append_jsonl, extract_blocks, init_log, print_log
 from tqdm import tqdm
 import os
-import time
 from evaluate import evaluate_result
 from utils.code_utils import extract_assert_statements
 from datetime import datetime
+from utils.prompt_cache_utils import CACHE_SCOPES, make_cache_salt
 
 
 if __name__ == '__main__':
@@ -32,6 +32,8 @@ if __name__ == '__main__':
     parser.add_argument('--start_index', type=int, default=0)
     parser.add_argument('--end_index', type=int, default=-1)
 
+    parser.add_argument('--cache_scope', type=str, default='sample', choices=CACHE_SCOPES, help='Requests that may share the prefix cache of the server: of the same sample, of the same repo, or all requests.')
+
     # parser.add_argument('--rerun', action='store_true')
     args = parser.parse_args()
 
@@ -75,9 +77,8 @@ if __name__ == '__main__':
     assert args.end_index <= len(dataset)
 
     for i in tqdm(range(start_index, end_index)):
-        sampling_args['cache_salt'] = f'assertagent_{i}_{time.time()}'
-
         data = dataset[i]
+        sampling_args['cache_salt'] = make_cache_salt(args.cache_scope, data)
 
         log_file = os.path.join(log_dir, f'{i}.log')
         output_file = os.path.join(output_dir, f'{i}.json')
@@ -132,6 +133,7 @@ if __name__ == '__main__':
             'messages': messages,
             'usage': usage,
             'seconds': seconds,
+            'cache_scope': args.cache_scope,
         }
         append_jsonl(resource_file, resource_content)
 
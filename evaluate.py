@@ -5,20 +5,14 @@ from typing import List, Tuple, Dict
 from utils import read_jsonl, write_jsonl, write_json, read_json
 import os
 from nltk.translate.bleu_score import corpus_bleu, SmoothingFunction
-from tree_sitter import Language, Parser
-import tree_sitter_java, tree_sitter_python
+from utils.code_file_utils.tree_cache import parse_code
 from codebleu import calc_codebleu
 from rouge import Rouge
 from nltk import edit_distance
 
 
 def extract_tokens(code: str, lang):
-    if lang.lower() == 'java':
-        lang_ptr = tree_sitter_java.language()
-    else:
-        lang_ptr = tree_sitter_python.language()
-    parser = Parser(language=Language(lang_ptr))
-    tree = parser.parse(bytes(code, "utf8"))
+    tree = parse_code(code, 'java' if lang.lower() == 'java' else 'python')
     root_node = tree.root_node
 
     def traverse(node):
@@ -13,7 +13,7 @@ from utils.python_utils.python_tester import run_py_repo_test
 from utils.java_utils.java_tester import run_java_repo_test
 
 
-def evaluate_run(dataset: List, repo_cache_dir: str, output_content: List[Dict], lang: str, rerun: bool) -> Tuple:
+def evaluate_run(dataset: List, repo_cache_dir: str, output_content: List[Dict], lang: str, rerun: bool, warm_test_runner: bool = False) -> Tuple:
     count_result = {
         'run@1': 0.0
     }
@@ -46,6 +46,8 @@ def evaluate_run(dataset: List, repo_cache_dir: str, output_content: List[Dict],
                         sub_repo=test_prefix_sub_repo,
                         test_class=test_prefix_pkg,
                         test_target=data['test_target'],
+                        test_file_path=test_file_path,
+                        warm=warm_test_runner,
                     )
                     write_file(test_file_path, original_test_file_content)
                 else:
@@ -62,6 +64,7 @@ def evaluate_run(dataset: List, repo_cache_dir: str, output_content: List[Dict],
                     res, _ = run_py_repo_test(
                         repo_path=repo_path,
                         test_target=data['test_target'],
+                        warm=warm_test_runner,
                     )
                     write_file(test_file_path, original_test_file_content)
                 results[0]['run'] = res['score'] == 1.0
@@ -87,6 +90,7 @@ def evaluate_result(
         rerun: bool,
         start_index: int,
         end_index: int,
+        warm_test_runner: bool = False,
 ) -> None:
     count_output_file = f'results/{run_name}/{dataset_name}_{method}_result_run.json'
     if result_type == 'jsonl':
@@ -102,7 +106,7 @@ def evaluate_result(
         raise NotImplementedError()
 
     dataset = read_dataset(dataset_name)
-    output_content, count_result = evaluate_run(dataset, repo_cache_dir, output_content, lang, rerun)
+    output_content, count_result = evaluate_run(dataset, repo_cache_dir, output_content, lang, rerun, warm_test_runner)
 
     if result_type == 'jsonl':
         write_jsonl(output_file, output_content)
@@ -126,6 +130,7 @@ if __name__ == '__main__':
     parser.add_argument('--start_index', type=int, default=0)
     parser.add_argument('--end_index', type=int, default=500)
     parser.add_argument('--rerun', action='store_true')
+    parser.add_argument('--warm_test_runner', action='store_true')
     args = parser.parse_args()
     evaluate_result(
         run_name=args.run_name,
@@ -136,5 +141,6 @@ if __name__ == '__main__':
         result_type=args.result_type,
         rerun=args.rerun,
         start_index=args.start_index,
-        end_index=args.end_index
+        end_index=args.end_index,
+        warm_test_runner=args.warm_test_runner,
     )
@@ -1,80 +1,93 @@
-from utils import read_jsonl, write_json
+from typing import Dict, List, Optional, Tuple
+from utils import read_jsonl, write_json, read_file
 from utils.java_utils.java_code_utils import get_java_method_name_pos
 from utils.java_utils.java_repo_utils import find_java_function_calls
 from utils.java_utils.java_lsp_client import JavaLSPClient
+from utils.lsp_cache import LSPCache
+from utils.code_file_utils.symbol_index import SymbolIndex, get_symbol_index
 from utils.java_utils.java_file_utils import JAVA_ASSERT_PLACEHOLDER, JAVA_COM_ASSERT_PLACEHOLDER
-from utils.code_file_utils.code_repo_utils import backup_file, recover_file
+from utils.code_file_utils.code_file_utils import replace_code_lines
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
 import argparse
 
 
-if __name__ == "__main__":
-    teco500 = read_jsonl('./data/teco500.jsonl')
-
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--jdtls_path', type=str, default="./data/resources/jdt-language-server")
-    parser.add_argument('--start_index', type=int, default=0)
-    parser.add_argument('--end_index', type=int, default=500)
-
-    parser.add_argument('--repo_cache_dir', type=str, default="/tmp/work1/teco500")
-    parser.add_argument('--workspace_dir', type=str, default="./cache/teco500_jdt_cache")
-    args = parser.parse_args()
-
-    for i in range(args.start_index, args.end_index):
-        print(f'====== {i} ======')
-        data = teco500[i]
-
-        repo_path = str(os.path.join(args.repo_cache_dir, data['repo_name']))
-
-        save_dir = f'''./cache/teco500/{data['repo_name']}'''
-        os.makedirs(save_dir, exist_ok=True)
-
-        fm_cache_file_path = os.path.join(
-            save_dir,
-            f'''{data['focal_method_file_path'].replace('/', '-')}:{data['focal_method_start_lineno']}.json'''
-        )
-
-        tp_cache_file_path = os.path.join(
-            save_dir,
-            f'''{data['test_prefix_file_path'].replace('/', '-')}:{data['test_prefix_start_lineno']}.json'''
-        )
-
-        if os.path.exists(fm_cache_file_path) and os.path.exists(tp_cache_file_path):
-            print(f'Skip {i}')
-            continue
-
-        #### remove all gradle file, force to use maven ####
-        os.system(f'find {repo_path} -type f -name "build.gradle" -delete')
-        ####################################################
-
-        #### Mask the ground truth
-        test_prefix = data['test_prefix'].replace(JAVA_ASSERT_PLACEHOLDER, JAVA_COM_ASSERT_PLACEHOLDER)
-        test_file_path = str(os.path.join(repo_path, data['test_prefix_file_path']))
-        original_file_content, masked_file_content = backup_file(
-            file_path=test_file_path,
-            code=test_prefix,
-            start_lineno=data['test_prefix_start_lineno'],
-            end_lineno=data['test_prefix_end_lineno'],
-        )
-
-        workspace_path = str(os.path.join(args.workspace_dir, data['repo_name']))
-        lsp_client = JavaLSPClient(args.jdtls_path, workspace_path, repo_path)
-        print("=" * 60)
-        print("Starting LSP server...")
-        print("=" * 60)
-        lsp_client.start_server()
-
+def get_cache_file_paths(data: Dict) -> Tuple[str, str]:
+    save_dir = f'''./cache/teco500/{data['repo_name']}'''
+    os.makedirs(save_dir, exist_ok=True)
+
+    fm_cache_file_path = os.path.join(
+        save_dir,
+        f'''{data['focal_method_file_path'].replace('/', '-')}:{data['focal_method_start_lineno']}.json'''
+    )
+
+    tp_cache_file_path = os.path.join(
+        save_dir,
+        f'''{data['test_prefix_file_path'].replace('/', '-')}:{data['test_prefix_start_lineno']}.json'''
+    )
+    return fm_cache_file_path, tp_cache_file_path
+
+
+def find_call_definitions(
+        lsp_client: JavaLSPClient,
+        symbol_index: Optional[SymbolIndex],
+        rel_file_path: str,
+        calls: List[Dict],
+        masked_file_path: str,
+) -> None:
+    """
+    Set the `definition` of the calls, resolved with the symbol index first, the LSP only looks up the rest.
+    `lsp_rejected` marks the calls the LSP answered without a definition in the repo, they are not guessed later.
+    """
+    missed = []
+    for i, call in enumerate(calls):
+        call['definition'] = None
+        call['lsp_rejected'] = False
+        if symbol_index is not None:
+            definition = symbol_index.resolve(rel_file_path, call['name'], receiver=call['receiver'], kind=call['type'])
+            # the index has the original test file, the server has the masked one
+            if definition is not None and definition['rel_file_path'] != masked_file_path:
+                call['definition'] = definition
+                continue
+        missed.append(i)
+
+    lsp_definitions = lsp_client.find_definitions_with_status(
+        rel_file_path=rel_file_path,
+        positions=[(calls[i]['start_line'], calls[i]['start_character']) for i in missed],
+    )
+    for i, (ok, definition) in zip(missed, lsp_definitions):
+        calls[i]['definition'] = definition
+        calls[i]['lsp_rejected'] = ok and definition is None
+
+
+def extract_sample(lsp_client: JavaLSPClient, symbol_index: Optional[SymbolIndex], repo_path: str, data: Dict):
+    fm_cache_file_path, tp_cache_file_path = get_cache_file_paths(data)
+
+    #### Mask the ground truth, only in the server, the file on disk is not changed
+    test_prefix = data['test_prefix'].replace(JAVA_ASSERT_PLACEHOLDER, JAVA_COM_ASSERT_PLACEHOLDER)
+    test_file_path = str(os.path.join(repo_path, data['test_prefix_file_path']))
+    original_file_content = read_file(test_file_path)
+    masked_file_content = replace_code_lines(
+        file_code=original_file_content,
+        code=test_prefix,
+        start_lineno=data['test_prefix_start_lineno'],
+        end_lineno=data['test_prefix_end_lineno'],
+    )
+    lsp_client.sync_document(test_file_path, masked_file_content)
+
+    try:
         if not os.path.exists(fm_cache_file_path):
             calls = find_java_function_calls(
                 code=data['focal_method'],
                 start_lineno=data['focal_method_start_lineno'],
             )
-            for c in range(len(calls)):
-                calls[c]['definition'] = lsp_client.find_definition(
-                    rel_file_path=data['focal_method_file_path'],
-                    line=calls[c]['start_line'],
-                    character=calls[c]['start_character'],
-                )
+            find_call_definitions(
+                lsp_client=lsp_client,
+                symbol_index=symbol_index,
+                rel_file_path=data['focal_method_file_path'],
+                calls=calls,
+                masked_file_path=data['test_prefix_file_path'],
+            )
 
             pos = get_java_method_name_pos(
                 method_code=data['focal_method'],
@@ -103,12 +116,13 @@ if __name__ == "__main__":
                 code=test_prefix,
                 start_lineno=data['test_prefix_start_lineno'],
             )
-            for c in range(len(calls)):
-                calls[c]['definition'] = lsp_client.find_definition(
-                    rel_file_path=data['test_prefix_file_path'],
-                    line=calls[c]['start_line'],
-                    character=calls[c]['start_character'],
-                )
+            find_call_definitions(
+                lsp_client=lsp_client,
+                symbol_index=symbol_index,
+                rel_file_path=data['test_prefix_file_path'],
+                calls=calls,
+                masked_file_path=data['test_prefix_file_path'],
+            )
 
             print('=== Test Prefix Calls ===')
             for c in calls: print(c)
@@ -118,12 +132,75 @@ if __name__ == "__main__":
                 'calls': calls,
                 'called_by': [],
             })
+    finally:
+        #### Recover
+        lsp_client.sync_document(test_file_path, wait=False)
+
+
+def extract_repo(repo_name: str, samples: List[Tuple[int, Dict]], args) -> None:
+    print(f'====== {repo_name}: {len(samples)} samples ======')
+    repo_path = str(os.path.join(args.repo_cache_dir, repo_name))
+
+    #### remove all gradle file, force to use maven ####
+    os.system(f'find {repo_path} -type f -name "build.gradle" -delete')
+    ####################################################
 
+    workspace_path = str(os.path.join(args.workspace_dir, repo_name))
+    cache = LSPCache(args.lsp_cache_dir, repo_name) if args.lsp_cache_dir is not None else None
+    symbol_index = get_symbol_index(args.symbol_index_dir, repo_name, repo_path, 'Java') if args.symbol_index_dir is not None else None
+    # started on the first lookup that misses the cache
+    lsp_client = JavaLSPClient(args.jdtls_path, workspace_path, repo_path, max_heap=args.jvm_heap, cache=cache)
+
+    try:
+        for i, data in samples:
+            print(f'====== {i} ======')
+            extract_sample(lsp_client, symbol_index, repo_path, data)
+    finally:
         print("\n" + "=" * 60)
         print("Shutting down LSP server...")
         print("=" * 60)
         lsp_client.shutdown()
+        if cache is not None:
+            print(f'LSP cache: {cache.stats()}')
 
-        #### Recover
-        recover_file(file_path=test_file_path)
 
+if __name__ == "__main__":
+    teco500 = read_jsonl('./data/teco500.jsonl')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jdtls_path', type=str, default="./data/resources/jdt-language-server")
+    parser.add_argument('--start_index', type=int, default=0)
+    parser.add_argument('--end_index', type=int, default=500)
+
+    parser.add_argument('--repo_cache_dir', type=str, default="/tmp/work1/teco500")
+    parser.add_argument('--workspace_dir', type=str, default="./cache/teco500_jdt_cache")
+    parser.add_argument('--workers', type=int, default=1, help='Number of repos extracted at the same time, each by its own JDTLS.')
+    parser.add_argument('--jvm_heap', type=str, default='1G', help='Max heap of each JDTLS, e.g. 1G, 2G.')
+    parser.add_argument('--lsp_cache_dir', type=str, default=None, help='Cache definitions and references on disk, a rerun only starts JDTLS for new lookups.')
+    parser.add_argument('--symbol_index_dir', type=str, default=None, help='Resolve calls with a tree-sitter symbol index of the repo first, JDTLS only looks up the calls it can not resolve.')
+    args = parser.parse_args()
+
+    # one indexed server per repo, shared by all samples of the repo
+    repo_samples: Dict[str, List[Tuple[int, Dict]]] = {}
+    for i in range(args.start_index, args.end_index):
+        data = teco500[i]
+        if all(os.path.exists(p) for p in get_cache_file_paths(data)):
+            print(f'Skip {i}')
+            continue
+        repo_samples.setdefault(data['repo_name'], []).append((i, data))
+
+    if args.workers <= 1:
+        for repo_name, samples in repo_samples.items():
+            extract_repo(repo_name, samples, args)
+    else:
+        # results are written atomically, rerun the same command to resume an interrupted run
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = {
+                executor.submit(extract_repo, repo_name, samples, args): repo_name
+                for repo_name, samples in repo_samples.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f'Extract {futures[future]} failed: {e}')
@@ -1,13 +1,15 @@
-import shutil
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 from dataset_utils import read_dataset
-from utils import read_file, write_file, write_json
+from utils import read_file, write_json
 from utils.code_file_utils.code_file_utils import replace_code_lines
 from utils.python_utils.python_file_utils import PY_ASSERT_PLACEHOLDER, PY_COM_ASSERT_PLACEHOLDER
 from utils.python_utils.python_code_utils import get_python_method_name_pos
 from utils.python_utils.python_repo_utils import find_python_function_calls
 from utils.python_utils.py_lsp_client import PyLSPClient
+from utils.lsp_cache import LSPCache
+from utils.code_file_utils.symbol_index import SymbolIndex, get_symbol_index
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
 import argparse
 
@@ -21,95 +23,82 @@ def is_subpath(path, base):
         return False
 
 
-def backup_file(file_path: str, code: str, start_lineno: int, end_lineno: int) -> Tuple:
-    backup_file_path = file_path[ : file_path.rindex('.')] + '.backup'
-    shutil.copy(file_path, backup_file_path)
-    original_file_content = read_file(file_path)
+def get_cache_file_paths(data: Dict) -> Tuple[str, str]:
+    save_dir = f'''./cache/py500/{data['repo_name']}'''
+    os.makedirs(save_dir, exist_ok=True)
 
-    masked_file_content = replace_code_lines(
-        file_code=original_file_content,
-        code=code,
-        start_lineno=start_lineno,
-        end_lineno=end_lineno,
+    fm_cache_file_path = os.path.join(
+        save_dir,
+        f'''{data['focal_method_file_path'].replace('/', '-')}:{data['focal_method_start_lineno']}.json'''
     )
-    write_file(file_path, masked_file_content)
-
-    return original_file_content, masked_file_content
-
-
-def recover_file(file_path: str) -> bool:
-    backup_file_path = file_path[ : file_path.rindex('.')] + '.backup'
-    if not os.path.exists(backup_file_path):
-        return False
-    shutil.copy(backup_file_path, file_path)
-    os.remove(backup_file_path)
-    return True
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--pyright_executable_path', type=str, default="pyright-langserver")
-    parser.add_argument('--start_index', type=int, default=0)
-    parser.add_argument('--end_index', type=int, default=500)
-    parser.add_argument('--dataset_name', type=str, default="py500")
-
-    parser.add_argument('--repo_cache_dir', type=str, default="/tmp/pywork1/py500")
-    args = parser.parse_args()
-
-    dataset = read_dataset(args.dataset_name)
-
-    for i in range(args.start_index, args.end_index):
-        print(f'====== {i} ======')
-        data = dataset[i]
-
-        repo_path = str(os.path.join(args.repo_cache_dir, data['repo_name']))
-
-        save_dir = f'''./cache/py500/{data['repo_name']}'''
-        os.makedirs(save_dir, exist_ok=True)
-
-        fm_cache_file_path = os.path.join(
-            save_dir,
-            f'''{data['focal_method_file_path'].replace('/', '-')}:{data['focal_method_start_lineno']}.json'''
-        )
-
-        tp_cache_file_path = os.path.join(
-            save_dir,
-            f'''{data['test_prefix_file_path'].replace('/', '-')}:{data['test_prefix_start_lineno']}.json'''
-        )
-
-        if os.path.exists(fm_cache_file_path) and os.path.exists(tp_cache_file_path):
-            print(f'Skip {i}')
-            continue
 
+    tp_cache_file_path = os.path.join(
+        save_dir,
+        f'''{data['test_prefix_file_path'].replace('/', '-')}:{data['test_prefix_start_lineno']}.json'''
+    )
+    return fm_cache_file_path, tp_cache_file_path
+
+
+def find_call_definitions(
+        lsp_client: PyLSPClient,
+        symbol_index: Optional[SymbolIndex],
+        rel_file_path: str,
+        calls: List[Dict],
+        masked_file_path: str,
+) -> None:
+    """
+    Set the `definition` of the calls, resolved with the symbol index first, the LSP only looks up the rest.
+    `lsp_rejected` marks the calls the LSP answered without a definition in the repo, they are not guessed later.
+    """
+    missed = []
+    for i, call in enumerate(calls):
+        call['definition'] = None
+        call['lsp_rejected'] = False
+        if symbol_index is not None:
+            definition = symbol_index.resolve(rel_file_path, call['name'], receiver=call['receiver'], kind=call['type'])
+            # the index has the original test file, the server has the masked one
+            if definition is not None and definition['rel_file_path'] != masked_file_path:
+                call['definition'] = definition
+                continue
+        missed.append(i)
+
+    lsp_definitions = lsp_client.find_definitions_with_status(
+        rel_file_path=rel_file_path,
+        positions=[(calls[i]['line'], calls[i]['character']) for i in missed],
+    )
+    for i, (ok, definition) in zip(missed, lsp_definitions):
+        calls[i]['definition'] = definition
+        calls[i]['lsp_rejected'] = ok and definition is None
 
-        #### Mask the ground truth
-        test_prefix = data['test_prefix'].replace(PY_ASSERT_PLACEHOLDER, PY_COM_ASSERT_PLACEHOLDER)
-        test_file_path = str(os.path.join(repo_path, data['test_prefix_file_path']))
 
-        original_file_content, masked_file_content = backup_file(
-            file_path=test_file_path,
-            code=test_prefix,
-            start_lineno=data['test_prefix_start_lineno'],
-            end_lineno=data['test_prefix_end_lineno'],
-        )
+def extract_sample(lsp_client: PyLSPClient, symbol_index: Optional[SymbolIndex], repo_path: str, data: Dict):
+    fm_cache_file_path, tp_cache_file_path = get_cache_file_paths(data)
 
-        lsp_client = PyLSPClient(args.pyright_executable_path, repo_path)
-        print("=" * 60)
-        print("Starting LSP server...")
-        print("=" * 60)
-        lsp_client.start_server()
+    #### Mask the ground truth, only in the server, the file on disk is not changed
+    test_prefix = data['test_prefix'].replace(PY_ASSERT_PLACEHOLDER, PY_COM_ASSERT_PLACEHOLDER)
+    test_file_path = str(os.path.join(repo_path, data['test_prefix_file_path']))
+    original_file_content = read_file(test_file_path)
+    masked_file_content = replace_code_lines(
+        file_code=original_file_content,
+        code=test_prefix,
+        start_lineno=data['test_prefix_start_lineno'],
+        end_lineno=data['test_prefix_end_lineno'],
+    )
+    lsp_client.sync_document(test_file_path, masked_file_content)
 
+    try:
         if not os.path.exists(fm_cache_file_path):
             calls = find_python_function_calls(
                 code=data['focal_method'],
                 start_lineno=data['focal_method_start_lineno'],
             )
-            for c in range(len(calls)):
-                calls[c]['definition'] = lsp_client.find_definition(
-                    rel_file_path=data['focal_method_file_path'],
-                    line=calls[c]['line'],
-                    character=calls[c]['character'],
-                )
+            find_call_definitions(
+                lsp_client=lsp_client,
+                symbol_index=symbol_index,
+                rel_file_path=data['focal_method_file_path'],
+                calls=calls,
+                masked_file_path=data['test_prefix_file_path'],
+            )
             pos = get_python_method_name_pos(
                 method_code=data['focal_method'],
                 start_lineno=data['focal_method_start_lineno'],
@@ -136,12 +125,13 @@ if __name__ == "__main__":
                 code=test_prefix,
                 start_lineno=data['test_prefix_start_lineno'],
             )
-            for c in range(len(calls)):
-                calls[c]['definition'] = lsp_client.find_definition(
-                    rel_file_path=data['test_prefix_file_path'],
-                    line=calls[c]['line'],
-                    character=calls[c]['character'],
-                )
+            find_call_definitions(
+                lsp_client=lsp_client,
+                symbol_index=symbol_index,
+                rel_file_path=data['test_prefix_file_path'],
+                calls=calls,
+                masked_file_path=data['test_prefix_file_path'],
+            )
 
             print('=== Test Prefix Calls ===')
             for c in calls: print(c)
@@ -151,11 +141,69 @@ if __name__ == "__main__":
                 'calls': calls,
                 'called_by': [],
             })
+    finally:
+        #### Recover
+        lsp_client.sync_document(test_file_path, wait=False)
+
+
+def extract_repo(repo_name: str, samples: List[Tuple[int, Dict]], args) -> None:
+    print(f'====== {repo_name}: {len(samples)} samples ======')
+    repo_path = str(os.path.join(args.repo_cache_dir, repo_name))
+
+    cache = LSPCache(args.lsp_cache_dir, repo_name) if args.lsp_cache_dir is not None else None
+    symbol_index = get_symbol_index(args.symbol_index_dir, repo_name, repo_path, 'Python') if args.symbol_index_dir is not None else None
+    # started on the first lookup that misses the cache
+    lsp_client = PyLSPClient(args.pyright_executable_path, repo_path, cache=cache)
 
+    try:
+        for i, data in samples:
+            print(f'====== {i} ======')
+            extract_sample(lsp_client, symbol_index, repo_path, data)
+    finally:
         print("\n" + "=" * 60)
         print("Shutting down LSP server...")
         print("=" * 60)
         lsp_client.shutdown()
+        if cache is not None:
+            print(f'LSP cache: {cache.stats()}')
 
-        #### Recover
-        recover_file(file_path=test_file_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pyright_executable_path', type=str, default="pyright-langserver")
+    parser.add_argument('--start_index', type=int, default=0)
+    parser.add_argument('--end_index', type=int, default=500)
+    parser.add_argument('--dataset_name', type=str, default="py500")
+
+    parser.add_argument('--repo_cache_dir', type=str, default="/tmp/pywork1/py500")
+    parser.add_argument('--lsp_cache_dir', type=str, default=None, help='Cache definitions and references on disk, a rerun only starts pyright for new lookups.')
+    parser.add_argument('--symbol_index_dir', type=str, default=None, help='Resolve calls with a tree-sitter symbol index of the repo first, pyright only looks up the calls it can not resolve.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of repos extracted at the same time, each by its own pyright.')
+    args = parser.parse_args()
+
+    dataset = read_dataset(args.dataset_name)
+
+    # one analyzed server per repo, shared by all samples of the repo
+    repo_samples: Dict[str, List[Tuple[int, Dict]]] = {}
+    for i in range(args.start_index, args.end_index):
+        data = dataset[i]
+        if all(os.path.exists(p) for p in get_cache_file_paths(data)):
+            print(f'Skip {i}')
+            continue
+        repo_samples.setdefault(data['repo_name'], []).append((i, data))
+
+    if args.workers <= 1:
+        for repo_name, samples in repo_samples.items():
+            extract_repo(repo_name, samples, args)
+    else:
+        # results are written atomically, rerun the same command to resume an interrupted run
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = {
+                executor.submit(extract_repo, repo_name, samples, args): repo_name
+                for repo_name, samples in repo_samples.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f'Extract {futures[future]} failed: {e}')
@@ -1,5 +1,5 @@
 from .file_utils import write_file, create_dirs, exists_file, read_file, load_config, create_or_clear_file, read_json, write_json, delete_dirs
-from .log_utils import init_log, print_log
+from .log_utils import init_log, print_log, init_task_log, close_task_log
 from .jsonl_utils import read_jsonl, write_jsonl, append_jsonl, dir_jsonl_files
 from .code_utils import add_block, format_code, extract_blocks, extract_first_block, extract_last_block, extract_first_boxed, extract_boxed
 from .yaml_utils import read_yaml
@@ -0,0 +1,320 @@
+"""
+Repo-wide index of the declared classes and methods / functions, built with tree-sitter.
+
+It resolves the callee of a call site from the callee name, the receiver, and the imports / package of the calling file,
+in milliseconds and without a language server.
+Calls that can not be resolved for sure (e.g. `obj.method()` on an object of unknown type, overloads)
+return None and are left to the LSP.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+import hashlib
+import os
+import threading
+
+from ..file_utils import read_file, read_json, write_json
+from ..java_utils.java_repo_utils import extract_java_symbols
+from ..python_utils.python_repo_utils import extract_python_symbols
+
+
+INDEX_VERSION = 1
+IGNORED_DIRS = ('target', 'build', 'node_modules', '__pycache__', 'venv')
+# parent of a symbol declared in any class
+ANY_CLASS = '*'
+# parent of a symbol declared outside of classes
+TOP_LEVEL = '^'
+
+
+class SymbolIndex:
+    def __init__(self, index_dir: str, repo_name: str, repo_path: str, lang: str) -> None:
+        """
+        Args:
+            index_dir: one json file per checkout of a repo (e.g. the checkout of each worker)
+            lang: Java or Python
+        """
+        self.lang = lang.lower()
+        self.file_type = '.java' if self.lang == 'java' else '.py'
+        self.repo_path = os.path.abspath(repo_path)
+        checkout_hash = hashlib.sha256(self.repo_path.encode('utf-8')).hexdigest()[:12]
+        self.index_file = os.path.join(index_dir, f'{repo_name}-{self.lang}-{checkout_hash}.json')
+        os.makedirs(index_dir, exist_ok=True)
+        self.lock = threading.Lock()
+
+        # rel_file_path -> {'mtime_ns', 'size', 'hash', and the symbols of the file}
+        self.files: Dict[str, Dict] = {}
+        try:
+            content = read_json(self.index_file)
+            if content['version'] == INDEX_VERSION:
+                self.files = content['files']
+        except (OSError, ValueError, KeyError):
+            pass
+        self._build_lookup()
+
+    def update(self) -> int:
+        """
+        Parse the files added or changed since the last update, the index is saved if the content of any file changed.
+        Returns:
+            number of parsed files
+        """
+        with self.lock:
+            parsed = 0
+            changed = False
+            seen = set()
+            for root, dirs, files in os.walk(self.repo_path):
+                dirs[:] = [d for d in dirs if d not in IGNORED_DIRS and not d.startswith('.')]
+                for f in files:
+                    if not f.endswith(self.file_type):
+                        continue
+                    file_path = os.path.join(root, f)
+                    rel_file_path = os.path.relpath(file_path, self.repo_path)
+                    seen.add(rel_file_path)
+
+                    stat = os.stat(file_path)
+                    entry = self.files.get(rel_file_path)
+                    if entry is not None and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                        continue
+
+                    try:
+                        code = read_file(file_path)
+                    except (OSError, UnicodeDecodeError):
+                        continue
+                    file_hash = hashlib.sha256(code.encode('utf-8')).hexdigest()
+                    if entry is not None and entry['hash'] == file_hash:
+                        # e.g. touched, kept in memory only
+                        entry['mtime_ns'] = stat.st_mtime_ns
+                        entry['size'] = stat.st_size
+                        continue
+                    changed = True
+
+                    symbols = extract_java_symbols(code) if self.lang == 'java' else extract_python_symbols(code)
+                    self.files[rel_file_path] = {
+                        'mtime_ns': stat.st_mtime_ns,
+                        'size': stat.st_size,
+                        'hash': file_hash,
+                        **symbols,
+                    }
+                    parsed += 1
+
+            for rel_file_path in [p for p in self.files.keys() if p not in seen]:
+                del self.files[rel_file_path]
+                changed = True
+
+            if changed:
+                self._build_lookup()
+                write_json(self.index_file, {'version': INDEX_VERSION, 'files': self.files})
+            return parsed
+
+    def _build_lookup(self) -> None:
+        # name -> [(rel_file_path, symbol)]
+        self.by_name: Dict[str, List[Tuple[str, Dict]]] = {}
+        # java: qualified name of top-level classes -> rel_file_path, package -> rel_file_paths
+        self.classes: Dict[str, str] = {}
+        self.packages: Dict[str, Set[str]] = {}
+        # python: module -> rel_file_path
+        self.modules: Dict[str, str] = {}
+
+        for rel_file_path, entry in self.files.items():
+            for symbol in entry['symbols']:
+                self.by_name.setdefault(symbol['name'], []).append((rel_file_path, symbol))
+
+            if self.lang == 'java':
+                self.packages.setdefault(entry['package'], set()).add(rel_file_path)
+                for symbol in entry['symbols']:
+                    if symbol['kind'] == 'class' and symbol['parent'] is None:
+                        qualified_name = f'''{entry['package']}.{symbol['name']}''' if entry['package'] != '' else symbol['name']
+                        self.classes[qualified_name] = rel_file_path
+            else:
+                parts = rel_file_path[:-len('.py')].split(os.sep)
+                if parts[-1] == '__init__':
+                    parts = parts[:-1]
+                self.modules['.'.join(parts)] = rel_file_path
+                # src layout
+                if len(parts) > 1 and parts[0] in {'src', 'lib'}:
+                    self.modules.setdefault('.'.join(parts[1:]), rel_file_path)
+
+    def resolve(self, rel_file_path: str, name: str, receiver: Optional[str] = None, kind: str = 'method') -> Optional[Dict]:
+        """
+        Args:
+            rel_file_path: the file of the call site
+            name: the called name, e.g. `foo` in `a.foo()`, or the type of a constructor
+            receiver: e.g. `a` in `a.foo()`, None for `foo()`
+            kind: method | constructor
+        Returns:
+            The same as `LSPClient.find_definition`, or None if not resolved for sure
+        """
+        name = name.split('<')[0].split('.')[-1].strip()
+        with self.lock:
+            entry = self.files.get(os.path.normpath(rel_file_path))
+            if entry is None:
+                return None
+            if self.lang == 'java':
+                scopes = self._java_scopes(os.path.normpath(rel_file_path), entry, receiver, kind)
+            else:
+                scopes = self._python_scopes(os.path.normpath(rel_file_path), entry, name, receiver)
+
+            for files, lookup_name, parent in scopes:
+                candidates = [
+                    (f, s) for f, s in self.by_name.get(lookup_name if lookup_name is not None else name, [])
+                    if f in files and self._parent_matches(s, parent)
+                ]
+                if kind == 'constructor':
+                    candidates = [(f, s) for f, s in candidates if s['kind'] == 'class']
+                    if len(candidates) == 1:
+                        # the LSP goes to the declared constructor, to the class if there is none
+                        candidates = self._constructors(*candidates[0]) or candidates
+                elif any(s['kind'] == 'class' for _, s in candidates):
+                    candidates = [(f, s) for f, s in candidates if s['kind'] == 'class']
+                if len(candidates) == 1:
+                    f, s = candidates[0]
+                    return {
+                        'rel_file_path': f,
+                        'start_line': s['line'],
+                        'start_character': s['character'],
+                        'end_line': s['end_line'],
+                        'end_character': s['end_character'],
+                    }
+                if len(candidates) > 1:
+                    # e.g. overloads
+                    return None
+        return None
+
+    @staticmethod
+    def _parent_matches(symbol: Dict, parent: Optional[str]) -> bool:
+        if parent is None:
+            return True
+        if parent == ANY_CLASS:
+            return symbol['parent'] is not None
+        if parent == TOP_LEVEL:
+            return symbol['parent'] is None
+        return symbol['parent'] == parent
+
+    def _constructors(self, rel_file_path: str, class_symbol: Dict) -> List[Tuple[str, Dict]]:
+        return [
+            (f, s) for f, s in self.by_name.get(class_symbol['name'], [])
+            if f == rel_file_path and s['kind'] == 'method' and s['parent'] == class_symbol['name']
+        ]
+
+    def _java_class_files(self, rel_file_path: str, entry: Dict, class_name: str) -> Set[str]:
+        """
+        Files declaring the top-level class `class_name` visible in the file: itself, imports, same package.
+        """
+        if any(s['kind'] == 'class' and s['name'] == class_name for s in entry['symbols']):
+            return {rel_file_path}
+        files = set()
+        for imp in entry['imports']:
+            if imp.startswith('static '):
+                continue
+            if imp.endswith(f'.{class_name}') and self.classes.__contains__(imp):
+                files.add(self.classes[imp])
+            elif imp.endswith('.*') and self.classes.__contains__(f'{imp[:-2]}.{class_name}'):
+                files.add(self.classes[f'{imp[:-2]}.{class_name}'])
+        qualified_name = f'''{entry['package']}.{class_name}''' if entry['package'] != '' else class_name
+        if len(files) == 0 and self.classes.__contains__(qualified_name):
+            files.add(self.classes[qualified_name])
+        return files
+
+    def _java_scopes(self, rel_file_path: str, entry: Dict, receiver: Optional[str], kind: str) -> List[Tuple[Set[str], str, Optional[str]]]:
+        """
+        Returns:
+            [(files, name, parent)], searched in order, a None name is the called name, a None parent is any parent,
+            see ANY_CLASS and TOP_LEVEL for the others
+        """
+        if kind == 'constructor':
+            return [({rel_file_path}, None, None), (self._visible_java_files(rel_file_path, entry), None, None)]
+
+        if receiver is None or receiver == 'this':
+            static_files = set()
+            for imp in entry['imports']:
+                if imp.startswith('static '):
+                    class_name = imp[len('static '):].rsplit('.', 1)[0]
+                    if self.classes.__contains__(class_name):
+                        static_files.add(self.classes[class_name])
+            return [({rel_file_path}, None, None), (static_files, None, None)]
+
+        if receiver.isidentifier() and receiver[0].isupper():
+            # static call `Foo.bar()`
+            return [(self._java_class_files(rel_file_path, entry, receiver), None, receiver)]
+
+        # `obj.bar()`, the type of obj is unknown
+        return []
+
+    def _visible_java_files(self, rel_file_path: str, entry: Dict) -> Set[str]:
+        files = set(self.packages.get(entry['package'], set()))
+        for imp in entry['imports']:
+            if imp.startswith('static '):
+                continue
+            if imp.endswith('.*'):
+                files |= self.packages.get(imp[:-2], set())
+            elif self.classes.__contains__(imp):
+                files.add(self.classes[imp])
+        return files
+
+    def _python_module_file(self, rel_file_path: str, module: str) -> Optional[str]:
+        if module.startswith('.'):
+            # relative import
+            level = len(module) - len(module.lstrip('.'))
+            package = os.path.dirname(rel_file_path).split(os.sep)
+            package = package[:len(package) - (level - 1)] if level > 1 else package
+            module = '.'.join([p for p in package if p != ''] + ([module.lstrip('.')] if module.lstrip('.') != '' else []))
+        return self.modules.get(module)
+
+    def _python_scopes(self, rel_file_path: str, entry: Dict, name: str, receiver: Optional[str]) -> List[Tuple[Set[str], str, Optional[str]]]:
+        if receiver is None:
+            # an imported name hides the functions of this file, and the methods of a class are never called bare
+            imported = [imp for imp in entry['imports'] if imp['alias'] == name]
+            if len(imported) == 0:
+                return [({rel_file_path}, None, TOP_LEVEL)]
+            scopes = []
+            for imp in imported:
+                module_file = self._python_module_file(rel_file_path, imp['module']) if imp['name'] is not None else None
+                if module_file is None:
+                    # e.g. imported from a library
+                    return []
+                scopes.append(({module_file}, imp['name'], TOP_LEVEL))
+            return scopes
+
+        if receiver in {'self', 'cls'}:
+            # methods of the classes in this file, inherited ones are left to the LSP
+            return [({rel_file_path}, None, ANY_CLASS)]
+
+        for imp in entry['imports']:
+            if imp['alias'] != receiver:
+                continue
+            # `import a.b as m; m.foo()` or `from a import m; m.foo()`
+            if imp['name'] is None:
+                module = imp['module']
+            elif imp['module'].strip('.') == '':
+                # from . import m
+                module = f'''{imp['module']}{imp['name']}'''
+            else:
+                module = f'''{imp['module']}.{imp['name']}'''
+            module_file = self._python_module_file(rel_file_path, module)
+            if module_file is not None:
+                return [({module_file}, None, None)]
+            # `from a import Foo; Foo.bar()`
+            module_file = self._python_module_file(rel_file_path, imp['module'])
+            if module_file is not None and imp['name'] is not None:
+                return [({module_file}, None, imp['name'])]
+            return []
+
+        if receiver.isidentifier():
+            # `Foo.bar()` with Foo in this file
+            return [({rel_file_path}, None, receiver)]
+        return []
+
+
+_indexes: Dict[Tuple[str, str, str, str], SymbolIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_symbol_index(index_dir: str, repo_name: str, repo_path: str, lang: str) -> SymbolIndex:
+    """
+    The index of the checkout, updated once per process for the files changed since the index was saved.
+    """
+    key = (os.path.abspath(index_dir), repo_name, os.path.abspath(repo_path), lang.lower())
+    with _indexes_lock:
+        if not _indexes.__contains__(key):
+            index = SymbolIndex(index_dir=index_dir, repo_name=repo_name, repo_path=repo_path, lang=lang)
+            # before any caller can resolve with it
+            index.update()
+            _indexes[key] = index
+        return _indexes[key]
@@ -0,0 +1,157 @@
+"""
+Shared tree-sitter parsers and an LRU cache of parse trees (and line offsets), keyed by the hash of the parsed code.
+
+A sample parses the same test file and focal file many times (method names, calls, ranges, previews),
+with the cache each distinct content is parsed once.
+The cached trees are shared, never call `tree.edit` on them.
+"""
+from typing import Dict, Tuple, List, Optional, Any
+from collections import OrderedDict
+from array import array
+import hashlib
+import threading
+
+from tree_sitter import Language, Parser, Tree
+import tree_sitter_java
+import tree_sitter_python
+
+
+LANGUAGES: Dict[str, Language] = {
+    'java': Language(tree_sitter_java.language()),
+    'python': Language(tree_sitter_python.language()),
+}
+
+
+# a parser is not thread safe, one per thread and language
+_parsers = threading.local()
+
+
+def get_parser(lang: str) -> Parser:
+    """
+    Args:
+        lang: Java or Python
+    """
+    lang = lang.lower()
+    parsers = getattr(_parsers, 'parsers', None)
+    if parsers is None:
+        parsers = _parsers.parsers = {}
+    if not parsers.__contains__(lang):
+        parsers[lang] = Parser(language=LANGUAGES[lang])
+    return parsers[lang]
+
+
+class LineIndex:
+    def __init__(self, code: str) -> None:
+        """
+        Start offset of each line (split as `str.splitlines`) in utf-8 bytes and in characters.
+        """
+        self.code = code
+        self.byte_starts = array('q', [0])
+        self.char_starts = array('q', [0])
+        for line in code.splitlines(keepends=True):
+            self.byte_starts.append(self.byte_starts[-1] + len(line.encode('utf-8')))
+            self.char_starts.append(self.char_starts[-1] + len(line))
+
+    def byte_offset(self, line: int, character: int) -> Optional[int]:
+        """
+        Args:
+            line, character: LSP position, 0-based
+        Returns:
+            the byte offset in the code, None if the line is out of range
+        """
+        if not 0 <= line < len(self.byte_starts) - 1:
+            return None
+        start = self.char_starts[line]
+        end = min(start + character, self.char_starts[line + 1])
+        return self.byte_starts[line] + len(self.code[start:end].encode('utf-8'))
+
+
+class TreeCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        """
+        Args:
+            max_bytes: max total size of the cached code, least recently used trees are evicted first
+        """
+        self.max_bytes = max_bytes
+        # key -> [tree, size, line index or None]
+        self.trees: OrderedDict[Tuple[str, str], List[Any]] = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, code: str, lang: str) -> Tree:
+        code_bytes = bytes(code, 'utf-8')
+        key = (lang.lower(), hashlib.sha256(code_bytes).hexdigest())
+        with self.lock:
+            if self.trees.__contains__(key):
+                self.trees.move_to_end(key)
+                self.hits += 1
+                return self.trees[key][0]
+            self.misses += 1
+
+        tree = get_parser(lang).parse(code_bytes)
+        if len(code_bytes) > self.max_bytes:
+            return tree
+
+        with self.lock:
+            if not self.trees.__contains__(key):
+                self.trees[key] = [tree, len(code_bytes), None]
+                self.total_bytes += len(code_bytes)
+            while self.total_bytes > self.max_bytes:
+                _, (_, size, _) = self.trees.popitem(last=False)
+                self.total_bytes -= size
+        return tree
+
+    def line_index(self, code: str, lang: str) -> LineIndex:
+        """
+        The line index of `code`, kept with its cached tree.
+        """
+        key = (lang.lower(), hashlib.sha256(bytes(code, 'utf-8')).hexdigest())
+        with self.lock:
+            entry = self.trees.get(key)
+            if entry is not None and entry[2] is not None:
+                return entry[2]
+        index = LineIndex(code)
+        with self.lock:
+            entry = self.trees.get(key)
+            if entry is not None:
+                entry[2] = index
+        return index
+
+    def clear(self) -> None:
+        with self.lock:
+            self.trees.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict:
+        return {
+            'trees': len(self.trees),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+tree_cache = TreeCache()
+
+
+def parse_code(code: str, lang: str) -> Tree:
+    """
+    Parse `code` (utf-8), or return the cached tree of the same code.
+    Args:
+        lang: Java or Python
+    """
+    return tree_cache.parse(code, lang)
+
+
+def get_line_index(code: str, lang: str) -> LineIndex:
+    return tree_cache.line_index(code, lang)
+
+
+def configure_tree_cache(max_bytes: int) -> None:
+    with tree_cache.lock:
+        tree_cache.max_bytes = max_bytes
+        while tree_cache.total_bytes > tree_cache.max_bytes:
+            _, (_, size, _) = tree_cache.trees.popitem(last=False)
+            tree_cache.total_bytes -= size
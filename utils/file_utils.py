@@ -1,6 +1,7 @@
 import json
 import os
 import shutil
+import threading
 from typing import Dict, List, Union
 
 
@@ -56,8 +57,12 @@ def load_config(config_path):
 
 
 def write_json(file_path: str, content: Union[List, Dict]):
-    with open(file_path, 'w', encoding='utf-8') as file:
+    # write to a temp file and rename it, an interrupted run never leaves a truncated json behind
+    # unique per thread, concurrent writers of the same file never share a temp file
+    tmp_file_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_file_path, 'w', encoding='utf-8') as file:
         file.write(json.dumps(content, indent=4))
+    os.replace(tmp_file_path, file_path)
 
 
 def read_json(file_path: str) -> Union[List, Dict]:
@@ -1,14 +1,10 @@
 from typing import Optional, Tuple
-from tree_sitter import Language, Parser
-import tree_sitter_java
+
+from ..code_file_utils.tree_cache import parse_code
 
 
 def get_java_method_name_pos(method_code: str, start_lineno: int) -> Optional[Tuple]:
-    java_lang = Language(tree_sitter_java.language())
-    parser = Parser()
-    parser.language = java_lang
-    code_bytes = bytes(method_code, 'utf-8')
-    tree = parser.parse(code_bytes)
+    tree = parse_code(method_code, 'java')
     for node in tree.root_node.children:
         if node.type == 'method_declaration':
             for child in node.children:
@@ -1,3 +1,4 @@
+from typing import Tuple, Optional, IO
 import os
 import subprocess
 import pexpect
@@ -5,10 +6,64 @@ import time
 import psutil
 import re
 import socket
+import fcntl
+import random
+import tempfile
 
 
 DEBUG_MARK = 'boolean __breakpoint__ = true;'
 
+# ports handed out when `debug_port` is 0, a port is owned by whoever holds its lock file
+DEBUG_PORT_RANGE = (6001, 7000)
+DEBUG_PORT_LOCK_DIR = os.path.join(tempfile.gettempdir(), 'assertagent_debug_ports')
+
+
+def is_port_free(port: int) -> bool:
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(('localhost', port))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+def allocate_debug_port(port_range: Tuple[int, int] = DEBUG_PORT_RANGE) -> Tuple[int, Optional[IO]]:
+    """
+    Returns:
+        port, lock file (keep it open while the port is used, the lock is dropped by the OS if the process dies)
+    """
+    os.makedirs(DEBUG_PORT_LOCK_DIR, exist_ok=True)
+    ports = list(range(port_range[0], port_range[1]))
+    # start at a random port, so that processes starting together do not race for the same locks
+    offset = random.randrange(len(ports))
+    for port in ports[offset:] + ports[:offset]:
+        lock_file = open(os.path.join(DEBUG_PORT_LOCK_DIR, f'{port}.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        if is_port_free(port):
+            return port, lock_file
+        release_debug_port(lock_file)
+
+    # the range is used up, let the OS choose one
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port, None
+
+
+def release_debug_port(lock_file: Optional[IO]) -> None:
+    if lock_file is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
+
 
 class JavaDebugger:
     def __init__(
@@ -20,7 +75,14 @@ class JavaDebugger:
             lineno: int,
             debug_port: int
     ):
+        """
+        Args:
+            debug_port: JDWP port, 0 to allocate a free one that is released on `close`
+        """
         self.debug_port = int(debug_port)
+        self.port_lock_file = None
+        if self.debug_port == 0:
+            self.debug_port, self.port_lock_file = allocate_debug_port()
         self.repo_path = repo_path
         self.sub_repo = sub_repo
         self.test_class = test_class
@@ -43,7 +105,7 @@ class JavaDebugger:
                 self.started = True
                 break
             except Exception:
-                self.close()
+                self.stop()
                 print('Retry start Java debugger...')
                 time.sleep(0.2)
 
@@ -150,7 +212,7 @@ class JavaDebugger:
             time.sleep(0.2)
 
 
-    def close(self):
+    def stop(self):
         if self.started:
             self.jdb_process.sendline('exit')
             self.jdb_process.wait()
@@ -163,3 +225,8 @@ class JavaDebugger:
 
         self.kill_all_process()
         self.started = False
+
+    def close(self):
+        self.stop()
+        release_debug_port(self.port_lock_file)
+        self.port_lock_file = None
@@ -3,21 +3,18 @@ All lineno starts from 1
 
 """
 
-from tree_sitter import Parser
-import tree_sitter_java
-from tree_sitter import Language
-
 from typing import List, Dict, Optional, Tuple
 
+from ..code_file_utils.tree_cache import parse_code
+
 
 JAVA_ASSERT_PLACEHOLDER = '<AssertPlaceHolder>;'
 JAVA_COM_ASSERT_PLACEHOLDER = '// <AssertPlaceHolder>;'
 
 
 def get_java_function_ranges(java_code: str):
-    parser = Parser(language=Language(tree_sitter_java.language()))
     code_bytes = bytes(java_code, 'utf-8')
-    tree = parser.parse(code_bytes)
+    tree = parse_code(java_code, 'java')
     root_node = tree.root_node
 
     results = []
@@ -385,12 +382,8 @@ def get_lineno(java_code: str, stmt: str, start_lineno: int) -> int:
 
 
 def get_java_method_name(method_code: str) -> str:
-    java_lang = Language(tree_sitter_java.language())
-    parser = Parser()
-    parser.language = java_lang
-
     code_bytes = bytes(method_code, 'utf-8')
-    tree = parser.parse(code_bytes)
+    tree = parse_code(method_code, 'java')
 
     for node in tree.root_node.children:
         if node.type == 'method_declaration':
@@ -409,23 +402,40 @@ def remove_sps(code: str) -> str:
 
 from utils.code_file_utils.code_file_utils import single_file_rag
 
-def get_java_test_class_assert_preview(code: str, test_prefix: str, max_test_functions: int = 10) -> str:
+def get_java_test_class_assert_preview(
+        code: str,
+        test_prefix: str,
+        max_test_functions: int = 10,
+        test_prefix_start_lineno: Optional[int] = None,
+        by_similarity: bool = True,
+) -> str:
+    """
+    Args:
+        test_prefix_start_lineno: the method at this line (the masked one) is left out
+        by_similarity: select the methods most similar to the test prefix, otherwise the first ones of the class,
+            so that all test methods of the class get the same preview
+    """
     target_ranges = get_java_function_ranges(code)
     lines = code.splitlines()
 
     functions = []
     for target in target_ranges:
         if target['type'] in {'method'}:
+            if test_prefix_start_lineno is not None and target['start_lineno'] <= test_prefix_start_lineno <= target['end_lineno']:
+                continue
             function_body = '\n'.join(lines[target['start_lineno'] - 1: target['end_lineno']])
             if function_body.__contains__('assert'):
                 target['body'] = function_body
                 functions.append(target)
     if len(functions) > 0:
-        selected_idx = single_file_rag(
-            functions=functions,
-            query_func=test_prefix.replace(JAVA_COM_ASSERT_PLACEHOLDER, ''),
-            top_k=max_test_functions,
-        )
+        if by_similarity:
+            selected_idx = single_file_rag(
+                functions=functions,
+                query_func=test_prefix.replace(JAVA_COM_ASSERT_PLACEHOLDER, ''),
+                top_k=max_test_functions,
+            )
+        else:
+            selected_idx = list(range(min(max_test_functions, len(functions))))
         selected_functions = [remove_sps(functions[i]['body']) for i in selected_idx]
         return '\n\n\n'.join(selected_functions)
     else:
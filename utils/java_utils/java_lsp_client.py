@@ -1,12 +1,15 @@
 import subprocess
+import shutil
 import os
 import time
 import re
 import json
 import threading
-from typing import List, Dict, Optional
+from typing import List, Dict, Tuple, Optional, Callable
+from concurrent.futures import Future, InvalidStateError
 
 from utils.lsp_client import LSPClient
+from utils.lsp_cache import LSPCache, content_hash
 from pathlib import Path
 from urllib.parse import urlparse, unquote
 
@@ -31,13 +34,28 @@ def uri_to_path(uri: str) -> str:
 
 
 class JavaLSPClient(LSPClient):
-    def __init__(self, jdtls_path: str, workspace_path: str, repo_path: str):
+    def __init__(self, jdtls_path: str, workspace_path: str, repo_path: str, max_heap: str = '1G', cache: Optional[LSPCache] = None):
+        """
+        Args:
+            workspace_path: owned by this server, never shared by two running servers
+            max_heap: JVM max heap size, e.g. 1G
+            cache: definitions and references found before, the server is only started when the cache misses
+        """
         self.jdtls_path = jdtls_path
         self.workspace_path = os.path.abspath(workspace_path)
+        self.max_heap = max_heap
         self.process = None
         self.msg_id = 0
-        self.responses = {}
-        self.notifications = []
+        self.pending: Dict[int, Future] = {}
+        self.notifications: List[Dict] = []
+        self.notification_cond = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.document_versions: Dict[str, int] = {}
+        # uri -> text as the server sees it
+        self.documents: Dict[str, str] = {}
+        # uri -> hash of the text synced in place of the file on disk (e.g. a masked test file)
+        self.synced_hashes: Dict[str, str] = {}
+        self.cache = cache
         self.reader_thread = None
         self.running = False
 
@@ -45,8 +63,9 @@ class JavaLSPClient(LSPClient):
         self.repo_uri = f'file://{self.repo_path}'
 
     def _get_next_id(self) -> int:
-        self.msg_id += 1
-        return self.msg_id
+        with self.write_lock:
+            self.msg_id += 1
+            return self.msg_id
 
     def start_server(self):
         config_dir = os.path.join(self.workspace_path, '.jdt-config')
@@ -75,7 +94,10 @@ class JavaLSPClient(LSPClient):
         else:
             config = 'config_linux'
 
-        config_path = os.path.join(self.jdtls_path, config)
+        # the launcher writes into its configuration dir, use a private copy
+        config_path = os.path.join(self.workspace_path, config)
+        if not os.path.exists(config_path):
+            shutil.copytree(os.path.join(self.jdtls_path, config), config_path)
 
         # start jdtls
         cmd = [
@@ -85,7 +107,7 @@ class JavaLSPClient(LSPClient):
             '-Declipse.product=org.eclipse.jdt.ls.core.product',
             '-Dlog.level=ERROR',
             '-Dgradle.disabled=true',  # Use maven only
-            '-Xmx1G',
+            f'-Xmx{self.max_heap}',
             '-jar', launcher_jar,
             '-configuration', config_path,
             '-data', config_dir
@@ -105,87 +127,112 @@ class JavaLSPClient(LSPClient):
         self.reader_thread = threading.Thread(target=self._read_responses, daemon=True)
         self.reader_thread.start()
 
-        time.sleep(1)
-
         self._initialize()
         self.wait_for_index_ready()
 
-        time.sleep(1)
-
     def wait_for_index_ready(self, timeout: int = 360):
         print("Waiting for JDTLS to finish indexing...")
-        start_time = time.time()
-        ready = False
-
-        while time.time() - start_time < timeout:
-            while self.notifications:
-                notif = self.notifications.pop(0)
-
-                # JDTLS:
-                # 1. window/logMessage: ("Building workspace" / "Finished building workspace")
-                # 2. language/status: ("ready" or "error")
-                if notif.get("method") == "window/logMessage":
-                    msg = notif["params"]["message"]
-                    if "Finished building workspace" in msg or "finished indexing" in msg:
-                        print("JDTLS indexing complete")
-                        ready = True
-                        break
-                    elif "Building workspace" in msg or "Starting indexing" in msg:
-                        print(msg)
-
-                elif notif.get("method") == "language/status":
-                    msg = notif["params"].get("message", "")
-                    if "ready" in msg.lower():
-                        print("Language status: ready")
-                        ready = True
-                        break
-                    elif "indexing" in msg.lower():
-                        print("Language status:", msg)
-
-            if ready:
-                break
-            time.sleep(1)
 
-        if not ready:
+        def is_ready(notif: Dict) -> bool:
+            # JDTLS:
+            # 1. window/logMessage: ("Building workspace" / "Finished building workspace")
+            # 2. language/status: ("ready" or "error")
+            if notif.get("method") == "window/logMessage":
+                msg = notif["params"]["message"]
+                if "Finished building workspace" in msg or "finished indexing" in msg:
+                    print("JDTLS indexing complete")
+                    return True
+                elif "Building workspace" in msg or "Starting indexing" in msg:
+                    print(msg)
+
+            elif notif.get("method") == "language/status":
+                msg = notif["params"].get("message", "")
+                if "ready" in msg.lower():
+                    print("Language status: ready")
+                    return True
+                elif "indexing" in msg.lower():
+                    print("Language status:", msg)
+            return False
+
+        if not self.wait_for_notification(is_ready, timeout):
             print("Erro: Timed out waiting for JDTLS index to finish")
 
     def wait_for_file_open_ready(self, uri: str, timeout: int = 120):
         print("Waiting for file open")
-        start_time = time.time()
-        ready = False
 
-        while time.time() - start_time < timeout:
-            while self.notifications:
-                notif = self.notifications.pop(0)
-                # print(f'Waiting for file open: {notif}')
-                if notif.get("method") == "textDocument/publishDiagnostics":
-                    diag_uri = notif["params"].get("uri", "")
-                    if uri == diag_uri:
-                        return
+        def is_ready(notif: Dict) -> bool:
+            return notif.get("method") == "textDocument/publishDiagnostics" and notif["params"].get("uri", "") == uri
 
-            time.sleep(1)
-
-        if not ready:
+        if not self.wait_for_notification(is_ready, timeout):
             print("Erro: Timed out waiting file open")
 
+    def wait_for_notification(self, match: Callable[[Dict], bool], timeout: float) -> bool:
+        """
+        Consume the received notifications until one matches, woken up by the reader thread.
+        Returns:
+            False on timeout or if the server stopped.
+        """
+        deadline = time.time() + timeout
+        with self.notification_cond:
+            while True:
+                while self.notifications:
+                    if match(self.notifications.pop(0)):
+                        return True
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.running:
+                    return False
+                self.notification_cond.wait(remaining)
+
     def _read_responses(self):
         while self.running:
             try:
                 response = self._read_message()
                 if response:
-                    if 'id' in response:
+                    if 'id' in response and 'method' not in response:
                         # response for request
-                        msg_id = response['id']
-                        self.responses[msg_id] = response
+                        future = self.pending.pop(response['id'], None)
+                        if future is not None:
+                            try:
+                                future.set_result(response)
+                            except InvalidStateError:
+                                # timed out and cancelled
+                                pass
                     else:
-                        # notification
-                        self.notifications.append(response)
+                        # notification or request from the server
+                        with self.notification_cond:
+                            self.notifications.append(response)
+                            self.notification_cond.notify_all()
             except Exception as e:
                 if self.running:
                     print(f"Error reading response: {e}")
                 break
+        self._fail_pending(ConnectionError("JDTLS stopped"))
 
-    def _send_request(self, method: str, params: Dict, timeout: int = 360) -> Dict:
+    def _fail_pending(self, error: Exception):
+        self.running = False
+        for msg_id in list(self.pending.keys()):
+            future = self.pending.pop(msg_id, None)
+            if future is not None and not future.done():
+                future.set_exception(error)
+        with self.notification_cond:
+            self.notification_cond.notify_all()
+
+    def ensure_started(self):
+        """
+        Start the server on first use, and open the documents synced before.
+        """
+        if self.process is not None:
+            return
+        self.start_server()
+        for uri, content in list(self.documents.items()):
+            self._sync_document(uri, content, wait=True)
+
+    def _send_request_async(self, method: str, params: Dict) -> Future:
+        """
+        Send a request without waiting, the returned future is completed by the reader thread.
+        Several requests can be in flight at the same time.
+        """
+        self.ensure_started()
         msg_id = self._get_next_id()
         request = {
             "jsonrpc": "2.0",
@@ -194,18 +241,25 @@ class JavaLSPClient(LSPClient):
             "params": params
         }
 
+        future = Future()
+        self.pending[msg_id] = future
+        future.add_done_callback(lambda _: self.pending.pop(msg_id, None))
         self._write_message(request)
+        return future
 
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            if msg_id in self.responses:
-                response = self.responses.pop(msg_id)
-                if 'error' in response:
-                    print(f"LSP Error: {response['error']}")
-                return response
-            time.sleep(0.1)
+    def _wait_response(self, future: Future, method: str, timeout: float) -> Dict:
+        try:
+            response = future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Request {method} timed out after {timeout} seconds")
+        if 'error' in response:
+            print(f"LSP Error: {response['error']}")
+        return response
 
-        raise TimeoutError(f"Request {method} timed out after {timeout} seconds")
+    def _send_request(self, method: str, params: Dict, timeout: int = 360) -> Dict:
+        future = self._send_request_async(method, params)
+        return self._wait_response(future, method, timeout)
 
     def _send_notification(self, method: str, params: Dict):
         notification = {
@@ -219,8 +273,9 @@ class JavaLSPClient(LSPClient):
         content = json.dumps(message)
         header = f"Content-Length: {len(content)}\r\n\r\n"
         full_message = header + content
-        self.process.stdin.write(full_message.encode('utf-8'))
-        self.process.stdin.flush()
+        with self.write_lock:
+            self.process.stdin.write(full_message.encode('utf-8'))
+            self.process.stdin.flush()
 
     def _read_message(self) -> Optional[Dict]:
         headers = {}
@@ -276,25 +331,75 @@ class JavaLSPClient(LSPClient):
         return response
 
     def open_document(self, file_path: str):
+        self.sync_document(file_path)
+
+    def sync_document(self, file_path: str, content: Optional[str] = None, wait: bool = True):
+        """
+        Open the document, or replace the whole text of an opened one with `didChange`,
+        so that a file can be swapped in and out without restarting the server.
+        Args:
+            file_path: the file on disk is never written
+            content: defaults to the content on disk
+            wait: wait for the diagnostics of the new text
+        """
         abs_path = os.path.abspath(file_path)
-        uri = f"file://{abs_path}"
-
-        with open(abs_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        uri = Path(abs_path).as_uri()
 
-        params = {
-            "textDocument": {
-                "uri": uri,
-                "languageId": "java",
-                "version": 1,
-                "text": content
+        disk_content = None
+        if content is None or os.path.exists(abs_path):
+            with open(abs_path, 'r', encoding='utf-8') as f:
+                disk_content = f.read()
+        if content is None:
+            content = disk_content
+        # a file synced back to its content on disk (e.g. restored after a sample) is no longer part of the key
+        if content == disk_content:
+            self.synced_hashes.pop(uri, None)
+        else:
+            self.synced_hashes[uri] = content_hash(content)
+
+        self.documents[uri] = content
+        if self.process is None:
+            # opened when the server is started
+            return
+        self._sync_document(uri, content, wait)
+
+    def _sync_document(self, uri: str, content: str, wait: bool):
+        # stale diagnostics of this file must not be taken for the new ones
+        with self.notification_cond:
+            self.notifications = [
+                n for n in self.notifications
+                if not (n.get("method") == "textDocument/publishDiagnostics" and n["params"].get("uri", "") == uri)
+            ]
+
+        if uri not in self.document_versions:
+            self.document_versions[uri] = 1
+            params = {
+                "textDocument": {
+                    "uri": uri,
+                    "languageId": "java",
+                    "version": 1,
+                    "text": content
+                }
             }
-        }
+            self._send_notification("textDocument/didOpen", params)
+        else:
+            self.document_versions[uri] += 1
+            params = {
+                "textDocument": {
+                    "uri": uri,
+                    "version": self.document_versions[uri]
+                },
+                "contentChanges": [{"text": content}]
+            }
+            self._send_notification("textDocument/didChange", params)
 
-        self._send_notification("textDocument/didOpen", params)
-        self.wait_for_file_open_ready(uri=uri)
+        if wait:
+            self.wait_for_file_open_ready(uri=uri)
 
-    def find_definition(self, rel_file_path: str, line: int, character: int) -> Optional[Dict]:
+    def request_definition(self, rel_file_path: str, line: int, character: int) -> Future:
+        """
+        Send a `textDocument/definition` request, get the result with `resolve_definition`.
+        """
         abs_path = os.path.abspath(os.path.join(self.repo_path, rel_file_path))
         uri = Path(abs_path).as_uri()
         print(f'>>> Find def: {uri}, ({line}, {character})')
@@ -302,13 +407,103 @@ class JavaLSPClient(LSPClient):
             'textDocument': {'uri': uri},
             'position': {'line': line, 'character': character}
         }
+        return self._send_request_async('textDocument/definition', params)
+
+    def find_definition(self, rel_file_path: str, line: int, character: int) -> Optional[Dict]:
+        return self.find_definitions(rel_file_path, [(line, character)])[0]
+
+    def _file_hash(self, abs_path: str) -> str:
+        uri = Path(abs_path).as_uri()
+        if uri in self.documents:
+            return content_hash(self.documents[uri])
+        with open(abs_path, 'r', encoding='utf-8') as f:
+            return content_hash(f.read())
+
+    def _references_hash(self, abs_path: str) -> str:
+        """
+        References are searched in the synced texts as well, so their hashes are part of the key.
+        """
+        uri = Path(abs_path).as_uri()
+        synced = sorted(
+            f'{os.path.relpath(uri_to_path(u), self.repo_path)}:{h}'
+            for u, h in self.synced_hashes.items() if u != uri
+        )
+        return content_hash('\n'.join([self._file_hash(abs_path)] + synced))
+
+    def find_definitions(self, rel_file_path: str, positions: List[Tuple[int, int]], timeout: float = 30) -> List[Optional[Dict]]:
+        """
+        Find the definitions of several positions in one file, all requests are sent before the first response is read.
+        Args:
+            positions: (line, character), both start from 0
+            timeout: for the whole batch
+        Returns:
+            One definition (or None) per position
+        """
+        return [definition for _, definition in self.find_definitions_with_status(rel_file_path, positions, timeout)]
+
+    def find_definitions_with_status(self, rel_file_path: str, positions: List[Tuple[int, int]], timeout: float = 30) -> List[Tuple[bool, Optional[Dict]]]:
+        """
+        The same as `find_definitions`.
+        Returns:
+            (ok, definition) per position, ok is False if the server did not answer (timeout, error response),
+            a None definition with ok is an answer: nothing found, or not in the repo
+        """
+        if len(positions) == 0:
+            return []
+        abs_path = os.path.abspath(os.path.join(self.repo_path, rel_file_path))
+        key_path = os.path.relpath(abs_path, self.repo_path)
+        file_hash = self._file_hash(abs_path) if self.cache is not None else None
+
+        results = [(False, None)] * len(positions)
+        missed = []
+        for i, (line, character) in enumerate(positions):
+            if self.cache is not None:
+                hit, result = self.cache.get('definition', key_path, file_hash, line, character)
+                if hit:
+                    results[i] = (True, result)
+                    continue
+            missed.append(i)
+        if len(missed) == 0:
+            return results
+
+        # open once per batch, a document synced before (e.g. a masked test file) is kept as is
+        if Path(abs_path).as_uri() not in self.documents:
+            self.open_document(abs_path)
+
+        futures = {i: self.request_definition(rel_file_path, *positions[i]) for i in missed}
+        deadline = time.time() + timeout
+        answered = {}
+        for i, future in futures.items():
+            results[i] = self._resolve_definition(future, timeout=max(deadline - time.time(), 0))
+            # nothing found is an answer too, a timeout or an error response is not
+            if results[i][0]:
+                answered[positions[i]] = results[i][1]
+        if self.cache is not None:
+            self.cache.put('definition', key_path, file_hash, answered)
+        return results
+
+    def resolve_definition(self, future: Future, timeout: float = 30) -> Optional[Dict]:
+        return self._resolve_definition(future, timeout)[1]
+
+    def _resolve_definition(self, future: Future, timeout: float) -> Tuple[bool, Optional[Dict]]:
+        """
+        Returns:
+            (ok, definition), ok is False if the server did not answer (timeout, error response)
+        """
+        try:
+            response = self._wait_response(future, 'textDocument/definition', timeout)
+        except Exception as e:
+            print(f"Error finding definition: {e}")
+            return False, None
+        if 'error' in response:
+            # e.g. content modified, busy
+            return False, None
         try:
-            response = self._send_request('textDocument/definition', params, timeout=30)
             result = response.get('result')
             assert result is not None and len(result) > 0
             def_path = uri_to_path(result[0]['uri'])
             assert is_subpath(def_path, self.repo_path), 'not in the current repo.'
-            return {
+            return True, {
                 # 'file_path': def_path,
                 'rel_file_path': os.path.relpath(def_path, self.repo_path),
                 'start_line': result[0]['range']['start']['line'],
@@ -316,13 +511,22 @@ class JavaLSPClient(LSPClient):
                 'end_line': result[0]['range']['end']['line'],
                 'end_character': result[0]['range']['end']['character']
             }
+        except AssertionError as e:
+            print(f"Error finding definition: {e}")
+            return True, None
         except Exception as e:
             print(f"Error finding definition: {e}")
-            return None
+            return False, None
 
     def find_references(self, rel_file_path: str, line: int, character: int) -> List[Dict]:
         abs_path = os.path.abspath(os.path.join(self.repo_path, rel_file_path))
         uri = Path(abs_path).as_uri()
+        if self.cache is not None:
+            key_path = os.path.relpath(abs_path, self.repo_path)
+            file_hash = self._references_hash(abs_path)
+            hit, result = self.cache.get('references', key_path, file_hash, line, character)
+            if hit:
+                return result
         params = {
             "textDocument": {"uri": uri},
             "position": {"line": line, "character": character},
@@ -330,6 +534,7 @@ class JavaLSPClient(LSPClient):
         }
         try:
             response = self._send_request('textDocument/references', params, timeout=360)
+            assert 'error' not in response, 'error response.'
             result = response.get('result')
             ret = []
             for res in result:
@@ -344,6 +549,8 @@ class JavaLSPClient(LSPClient):
                     'end_line': res['range']['end']['line'],
                     'end_character': res['range']['end']['character']
                 })
+            if self.cache is not None:
+                self.cache.put('references', key_path, file_hash, {(line, character): ret})
             return ret
         except Exception as e:
             print(f"Error finding references: {e}")
@@ -389,6 +596,7 @@ class JavaLSPClient(LSPClient):
         keywords = {'if', 'for', 'while', 'switch', 'catch', 'synchronized',
                     'return', 'new', 'super', 'this', 'assert', 'throw'}
 
+        call_sites = []
         for line_num in range(start_line, end_line + 1):
             line = lines[line_num]
 
@@ -403,22 +611,25 @@ class JavaLSPClient(LSPClient):
                     continue
 
                 char_pos = match.start(1)
-                defs = self.find_definition(rel_file_path, line_num, char_pos)
-                # if defs and isinstance(defs, list):
-                #     for d in defs:
-                if defs is not None:
-                    calls.append({
-                        'function': call_name,
-                        'file': defs['rel_file_path'],
-                        'lineno': defs['start_line'] + 1,
-                        'line': defs['start_line'],
-                        'character': defs['start_character'],
-                        'call_site': {
-                            'file': rel_file_path,
-                            'line': line_num,
-                            'col': char_pos
-                        }
-                    })
+                call_sites.append((call_name, line_num, char_pos))
+
+        definitions = self.find_definitions(rel_file_path, [(line_num, char_pos) for _, line_num, char_pos in call_sites])
+        for (call_name, line_num, char_pos), defs in zip(call_sites, definitions):
+            # if defs and isinstance(defs, list):
+            #     for d in defs:
+            if defs is not None:
+                calls.append({
+                    'function': call_name,
+                    'file': defs['rel_file_path'],
+                    'lineno': defs['start_line'] + 1,
+                    'line': defs['start_line'],
+                    'character': defs['start_character'],
+                    'call_site': {
+                        'file': rel_file_path,
+                        'line': line_num,
+                        'col': char_pos
+                    }
+                })
 
         # remove duplicate
         seen = set()
@@ -504,13 +715,13 @@ class JavaLSPClient(LSPClient):
         self.shutdown()
 
     def shutdown(self):
-        self.running = False
         if self.process:
             try:
                 self._send_request('shutdown', {}, timeout=5)
                 self._send_notification('exit', {})
             except:
                 pass
+            self.running = False
 
             self.process.terminate()
             try:
@@ -518,6 +729,7 @@ class JavaLSPClient(LSPClient):
             except:
                 self.process.kill()
 
+        self.running = False
         if self.reader_thread:
             self.reader_thread.join(timeout=2)
 
@@ -1,17 +1,15 @@
-from typing import Optional, Dict, Tuple, List
-from tree_sitter import Node, Parser, Language
-import tree_sitter_java
+from typing import Optional, Dict, Tuple, List, Set
+from tree_sitter import Node
 
 from ..file_utils import read_file
+from ..code_file_utils.tree_cache import parse_code, get_line_index
+
+
+JAVA_ANNOTATION_TYPES = {'annotation', 'marker_annotation'}
 
 
 def _get_byte_offset_from_lsp_position(source_code: str, line: int, character: int) -> Optional[int]:
-    lines = source_code.splitlines(keepends=True)
-    if 0 <= line < len(lines):
-        offset = sum(len(line_content.encode('utf-8')) for line_content in lines[:line])
-        offset += len(lines[line][:character].encode('utf-8'))
-        return offset
-    return None
+    return get_line_index(source_code, 'java').byte_offset(line, character)
 
 
 def _find_node_at_byte_offset(node, target_byte_offset):
@@ -30,36 +28,18 @@ def _get_node_line_range(node):
     return start_line, end_line
 
 
-def _find_decorator_start_line_ast(source_code: str, root_node, current_start_line_0b, decorator_type):
-    lines = source_code.splitlines(keepends=True)
-    element_start_byte_offset = sum(len(line_content.encode('utf-8')) for line_content in lines[:current_start_line_0b])
-
-    def traverse_tree_for_decorators(node, found_decorators):
-        if node.type == decorator_type:
-            if node.end_byte <= element_start_byte_offset:
-                annotation_start_line = node.start_point[0]
-                if annotation_start_line < current_start_line_0b:
-                    found_decorators.append(annotation_start_line)
-
-        for child in node.children:
-            traverse_tree_for_decorators(child, found_decorators)
-
-    all_found_annotation_lines = []
-    traverse_tree_for_decorators(root_node, all_found_annotation_lines)
-
-    if not all_found_annotation_lines:
-        return current_start_line_0b
-
-    highest_relevant_annotation_line = max(all_found_annotation_lines)
-
-    annotation_lines_set = set(all_found_annotation_lines)
-    current_line = highest_relevant_annotation_line
-    while current_line > 0 and current_line - 1 in annotation_lines_set:
-        current_line -= 1
-
-    decorator_start_line = current_line
-
-    return decorator_start_line
+def _find_decorator_start_line_ast(node: Node, decorator_types: Set[str]) -> int:
+    """
+    First line of a declaration with its annotations.
+    Annotations are parsed into the modifiers of the declaration, those left before it as siblings (e.g. after an error) are added.
+    """
+    start_line = node.start_point[0]
+    sibling = node.prev_sibling
+    while sibling is not None and (sibling.type in decorator_types or sibling.type in {'line_comment', 'block_comment'}):
+        if sibling.type in decorator_types:
+            start_line = sibling.start_point[0]
+        sibling = sibling.prev_sibling
+    return start_line
 
 
 def _extract_name_from_node(node, parent_type):
@@ -73,8 +53,7 @@ def _extract_name_from_node(node, parent_type):
 def get_java_target_source(file_path: str, line: int, character: int) -> Optional[Dict]:
     file_content = read_file(file_path)
     file_lines = file_content.splitlines()
-    parser = Parser(language=Language(tree_sitter_java.language()))
-    tree = parser.parse(bytes(file_content, "utf-8"))
+    tree = parse_code(file_content, 'java')
     root_node = tree.root_node
 
     target_position_bytes = _get_byte_offset_from_lsp_position(file_content, line, character)
@@ -92,7 +71,7 @@ def get_java_target_source(file_path: str, line: int, character: int) -> Optiona
     while current_node and current_node != root_node:
         if current_node.type == 'method_declaration':
             start_line, end_line = _get_node_line_range(current_node)
-            decorator_start_line = _find_decorator_start_line_ast(file_content, root_node, start_line, 'annotation')
+            decorator_start_line = _find_decorator_start_line_ast(current_node, JAVA_ANNOTATION_TYPES)
             name = _extract_name_from_node(current_node, 'method_declaration')
 
             start_lineno = min(decorator_start_line + 1, start_line + 1)
@@ -108,7 +87,7 @@ def get_java_target_source(file_path: str, line: int, character: int) -> Optiona
 
         elif current_node.type == 'class_declaration':
             start_line, end_line = _get_node_line_range(current_node)
-            decorator_start_line = _find_decorator_start_line_ast(file_content, root_node, start_line, 'annotation')
+            decorator_start_line = _find_decorator_start_line_ast(current_node, JAVA_ANNOTATION_TYPES)
             name = _extract_name_from_node(current_node, 'class_declaration')
 
             start_lineno = min(decorator_start_line + 1, start_line + 1)
@@ -124,7 +103,7 @@ def get_java_target_source(file_path: str, line: int, character: int) -> Optiona
 
         elif current_node.type == 'interface_declaration':
             start_line, end_line = _get_node_line_range(current_node)
-            decorator_start_line = _find_decorator_start_line_ast(file_content, root_node, start_line, 'annotation')
+            decorator_start_line = _find_decorator_start_line_ast(current_node, JAVA_ANNOTATION_TYPES)
             name = _extract_name_from_node(current_node, 'interface_declaration')
 
             start_lineno = min(decorator_start_line + 1, start_line + 1)
@@ -140,7 +119,7 @@ def get_java_target_source(file_path: str, line: int, character: int) -> Optiona
 
         elif current_node.type == 'enum_declaration':
             start_line, end_line = _get_node_line_range(current_node)
-            decorator_start_line = _find_decorator_start_line_ast(file_content, root_node, start_line, 'annotation')
+            decorator_start_line = _find_decorator_start_line_ast(current_node, JAVA_ANNOTATION_TYPES)
             name = _extract_name_from_node(current_node, 'enum_declaration')
 
             start_lineno = min(decorator_start_line + 1, start_line + 1)
@@ -159,19 +138,20 @@ def get_java_target_source(file_path: str, line: int, character: int) -> Optiona
 
 
 def find_java_function_calls(code: str, start_lineno: int) -> List:
-    parser = Parser(language=Language(tree_sitter_java.language()))
     code_bytes = bytes(code, "utf8")
-    tree = parser.parse(code_bytes)
+    tree = parse_code(code, 'java')
     calls = []
     def find_function_calls(node: Node):
         if node.type == "method_invocation":
             name_node = node.child_by_field_name("name")
+            object_node = node.child_by_field_name("object")
             if name_node:
                 start_line, start_character = name_node.start_point
                 end_line, end_character = name_node.end_point
                 calls.append({
                     'type': 'method',
                     'name': code_bytes[name_node.start_byte:name_node.end_byte].decode('utf8'),
+                    'receiver': code_bytes[object_node.start_byte:object_node.end_byte].decode('utf8') if object_node else None,
                     'start_line': start_line + start_lineno - 1,
                     'start_character': start_character,
                     'end_line': end_line + start_lineno - 1,
@@ -185,6 +165,7 @@ def find_java_function_calls(code: str, start_lineno: int) -> List:
                 calls.append({
                     'type': "constructor",
                     'name': code[type_node.start_byte:type_node.end_byte],
+                    'receiver': None,
                     'start_line': start_line + start_lineno - 1,
                     'start_character': start_character,
                     'end_line': end_line + start_lineno - 1,
@@ -204,8 +185,7 @@ class Example {{
 {code}
 }}
 '''
-    parser = Parser(language=Language(tree_sitter_java.language()))
-    tree = parser.parse(bytes(code, "utf8"))
+    tree = parse_code(code, 'java')
     root_node = tree.root_node
 
     calls = []
@@ -236,3 +216,60 @@ class Example {{
 
     traverse(root_node)
     return calls
+
+
+JAVA_TYPE_DECLARATIONS = {
+    'class_declaration', 'interface_declaration', 'enum_declaration', 'record_declaration', 'annotation_type_declaration'
+}
+
+
+def extract_java_symbols(code: str) -> Dict:
+    """
+    Package, imports and declared classes / methods of a Java file, for `SymbolIndex`.
+    Returns:
+        {'package': 'a.b', 'imports': ['a.b.C', 'static a.b.C.m', 'a.b.*'], 'symbols': [{'name', 'kind', 'parent', 'line', 'character', 'end_line', 'end_character'}]}
+    """
+    code_bytes = bytes(code, 'utf8')
+    tree = parse_code(code, 'java')
+
+    package = ''
+    imports = []
+    symbols = []
+
+    def node_text(node: Node) -> str:
+        return code_bytes[node.start_byte:node.end_byte].decode('utf8')
+
+    def traverse(node: Node, parent: Optional[str]):
+        for child in node.children:
+            if child.type in JAVA_TYPE_DECLARATIONS or child.type in {'method_declaration', 'constructor_declaration'}:
+                name_node = child.child_by_field_name('name')
+                if name_node is None:
+                    continue
+                name = node_text(name_node)
+                symbols.append({
+                    'name': name,
+                    'kind': 'class' if child.type in JAVA_TYPE_DECLARATIONS else 'method',
+                    'parent': parent,
+                    'line': name_node.start_point[0],
+                    'character': name_node.start_point[1],
+                    'end_line': name_node.end_point[0],
+                    'end_character': name_node.end_point[1],
+                })
+                body = child.child_by_field_name('body')
+                if child.type in JAVA_TYPE_DECLARATIONS and body is not None:
+                    traverse(body, name)
+            elif child.type in {'class_body', 'interface_body', 'enum_body', 'enum_body_declarations', 'annotation_type_body'}:
+                traverse(child, parent)
+
+    for child in tree.root_node.children:
+        if child.type == 'package_declaration':
+            package = node_text(child)[len('package'):].strip().rstrip(';').strip()
+        elif child.type == 'import_declaration':
+            imports.append(' '.join(node_text(child)[len('import'):].strip().rstrip(';').split()))
+    traverse(tree.root_node, None)
+
+    return {
+        'package': package,
+        'imports': imports,
+        'symbols': symbols,
+    }
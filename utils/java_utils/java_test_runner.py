@@ -0,0 +1,318 @@
+"""
+A long-lived JVM that compiles one test class and runs one JUnit 4 test method through JUnitCore,
+so that running a candidate assert does not pay for the Maven and JVM startup every time.
+"""
+from typing import Tuple, Dict, Optional
+import atexit
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import pexpect
+
+
+RUNNER_CLASS = 'AssertAgentTestRunner'
+RUNNER_DIR = os.path.join(tempfile.gettempdir(), 'assertagent_java_runner')
+END_MARK = '@@END@@'
+
+RUNNER_SOURCE = r'''
+import java.io.*;
+import java.net.*;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.*;
+import java.util.*;
+import javax.tools.*;
+
+/**
+ * Request (one line): test_file_path \t test_class \t test_method
+ * Response: COMPILE_ERROR + javac output | RESULT run ignored + FAILURE/ERROR lines | UNSUPPORTED | ERROR, then @@END@@
+ */
+public class AssertAgentTestRunner {
+    private static final String END = "@@END@@";
+
+    public static void main(String[] args) throws Exception {
+        PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+        List<URL> classpath = readClasspath();
+        out.println(compiler == null ? "@@NO_COMPILER@@" : "@@READY@@");
+
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] parts = line.trim().split("\t");
+            try {
+                if (parts.length != 3) {
+                    out.println("ERROR bad request");
+                } else {
+                    handle(out, compiler, classpath, parts[0], parts[1], parts[2]);
+                }
+            } catch (Throwable t) {
+                out.println("ERROR " + oneLine(String.valueOf(t)));
+            }
+            out.println(END);
+        }
+    }
+
+    private static List<URL> readClasspath() throws IOException {
+        List<URL> urls = new ArrayList<URL>();
+        urls.add(new File("target/test-classes").toURI().toURL());
+        urls.add(new File("target/classes").toURI().toURL());
+        String cp = new String(Files.readAllBytes(Paths.get("cp.txt")), StandardCharsets.UTF_8).trim();
+        for (String entry : cp.split(File.pathSeparator)) {
+            if (!entry.isEmpty()) {
+                urls.add(new File(entry).toURI().toURL());
+            }
+        }
+        return urls;
+    }
+
+    private static String classpathString(List<URL> urls) throws URISyntaxException {
+        StringBuilder sb = new StringBuilder();
+        for (URL url : urls) {
+            if (sb.length() > 0) {
+                sb.append(File.pathSeparator);
+            }
+            sb.append(new File(url.toURI()).getPath());
+        }
+        return sb.toString();
+    }
+
+    private static void handle(PrintStream out, JavaCompiler compiler, List<URL> classpath, String testFile, String testClass, String testMethod) throws Exception {
+        Path outDir = Files.createTempDirectory("assertagent-test-classes");
+        try {
+            StringWriter compileOutput = new StringWriter();
+            StandardJavaFileManager fileManager = compiler.getStandardFileManager(null, null, StandardCharsets.UTF_8);
+            List<String> options = Arrays.asList("-nowarn", "-encoding", "UTF-8", "-cp", classpathString(classpath), "-d", outDir.toString());
+            boolean compiled = compiler.getTask(compileOutput, fileManager, null, options, null, fileManager.getJavaFileObjects(new File(testFile))).call();
+            fileManager.close();
+            if (!compiled) {
+                out.println("COMPILE_ERROR");
+                out.println(compileOutput.toString().trim());
+                return;
+            }
+
+            // the freshly compiled classes come first, so they shadow target/test-classes
+            List<URL> urls = new ArrayList<URL>();
+            urls.add(outDir.toUri().toURL());
+            urls.addAll(classpath);
+            URLClassLoader loader = new URLClassLoader(urls.toArray(new URL[0]), ClassLoader.getSystemClassLoader().getParent());
+
+            PrintStream stdout = System.out;
+            PrintStream stderr = System.err;
+            ClassLoader contextLoader = Thread.currentThread().getContextClassLoader();
+            PrintStream capture = new PrintStream(new ByteArrayOutputStream(), true);
+            try {
+                Class<?> requestClass;
+                Class<?> coreClass;
+                try {
+                    requestClass = loader.loadClass("org.junit.runner.Request");
+                    coreClass = loader.loadClass("org.junit.runner.JUnitCore");
+                } catch (ClassNotFoundException e) {
+                    out.println("UNSUPPORTED");
+                    return;
+                }
+
+                System.setOut(capture);
+                System.setErr(capture);
+                Thread.currentThread().setContextClassLoader(loader);
+
+                Class<?> cls = Class.forName(testClass, false, loader);
+                Object request = requestClass.getMethod("method", Class.class, String.class).invoke(null, cls, testMethod);
+                Object core = coreClass.getConstructor().newInstance();
+                Object result = coreClass.getMethod("run", requestClass).invoke(core, request);
+
+                int runCount = (Integer) result.getClass().getMethod("getRunCount").invoke(result);
+                int ignoreCount = (Integer) result.getClass().getMethod("getIgnoreCount").invoke(result);
+                List<?> failures = (List<?>) result.getClass().getMethod("getFailures").invoke(result);
+
+                out.println("RESULT " + runCount + " " + ignoreCount);
+                for (Object failure : failures) {
+                    Throwable e = (Throwable) failure.getClass().getMethod("getException").invoke(failure);
+                    String message = String.valueOf(failure.getClass().getMethod("getMessage").invoke(failure));
+                    out.println((e instanceof AssertionError ? "FAILURE" : "ERROR") + "\t" + oneLine(message));
+                }
+            } finally {
+                System.setOut(stdout);
+                System.setErr(stderr);
+                Thread.currentThread().setContextClassLoader(contextLoader);
+                loader.close();
+            }
+        } finally {
+            deleteDir(outDir.toFile());
+        }
+    }
+
+    private static String oneLine(String s) {
+        return s.replace('\r', ' ').replace('\n', ' ');
+    }
+
+    private static void deleteDir(File dir) {
+        File[] files = dir.listFiles();
+        if (files != null) {
+            for (File f : files) {
+                deleteDir(f);
+            }
+        }
+        dir.delete();
+    }
+}
+'''
+
+
+def build_runner() -> bool:
+    if os.path.exists(os.path.join(RUNNER_DIR, f'{RUNNER_CLASS}.class')):
+        return True
+
+    # build in a private dir and move it in place, several processes may start at the same time
+    tmp_dir = tempfile.mkdtemp(prefix='assertagent_java_runner_')
+    with open(os.path.join(tmp_dir, f'{RUNNER_CLASS}.java'), 'w', encoding='utf-8') as file:
+        file.write(RUNNER_SOURCE)
+    result = subprocess.run(
+        f'javac -nowarn -d . {RUNNER_CLASS}.java',
+        shell=True,
+        cwd=tmp_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        print(f'Build Java test runner failed: {result.stderr}')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+    try:
+        os.rename(tmp_dir, RUNNER_DIR)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return os.path.exists(os.path.join(RUNNER_DIR, f'{RUNNER_CLASS}.class'))
+
+
+class JavaTestRunner:
+    def __init__(self, repo_path: str, sub_repo: str) -> None:
+        self.repo_path = repo_path
+        self.sub_repo = sub_repo
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self) -> bool:
+        if self.process is not None and self.process.isalive():
+            return True
+        if not os.path.exists(os.path.join(self.repo_path, self.sub_repo, 'cp.txt')) or not build_runner():
+            return False
+
+        self.process = pexpect.spawn(
+            'java',
+            ['-cp', RUNNER_DIR, RUNNER_CLASS],
+            cwd=os.path.join(self.repo_path, self.sub_repo),
+            encoding='utf-8',
+            echo=False,
+            timeout=60,
+        )
+        try:
+            index = self.process.expect(['@@READY@@', '@@NO_COMPILER@@'])
+        except (pexpect.EOF, pexpect.TIMEOUT):
+            index = 1
+        if index != 0:
+            self.close()
+            return False
+        return True
+
+    def run(self, test_class: str, test_target: str, test_file_path: str, timeout: float = 120.0) -> Optional[Tuple[Dict, str]]:
+        """
+        Returns:
+            The same result as `run_java_repo_test`, or None if this test can not be run here.
+        """
+        test_method = test_target.split('#')[-1]
+        with self.lock:
+            if not self.start():
+                return None
+
+            self.process.sendline(f'{os.path.abspath(test_file_path)}\t{test_class}\t{test_method}')
+            try:
+                self.process.expect(END_MARK, timeout=timeout)
+            except pexpect.TIMEOUT:
+                self.close()
+                return {
+                    'score': 0.0,
+                    'passed': 0,
+                    'total': 0,
+                }, 'The "mvn test" command exceeded the time limit.'
+            except pexpect.EOF:
+                # e.g. the test called System.exit
+                self.close()
+                return None
+            lines = [line for line in self.process.before.splitlines() if line.strip() != '']
+
+        return parse_runner_output(lines, test_class, test_method)
+
+    def close(self) -> None:
+        if self.process is not None:
+            try:
+                self.process.close(force=True)
+            except Exception:
+                pass
+            self.process = None
+
+
+def parse_runner_output(lines, test_class: str, test_method: str) -> Optional[Tuple[Dict, str]]:
+    if len(lines) == 0 or lines[0] == 'UNSUPPORTED' or lines[0].startswith('ERROR'):
+        return None
+
+    if lines[0] == 'COMPILE_ERROR':
+        max_lines = 20
+        test_output = '\n'.join(lines[1:][- max_lines : ]).strip()
+        return {
+            'score': 0.0,
+            'passed': 0,
+            'total': 0,
+        }, test_output
+
+    _, run_count, ignore_count = lines[0].split(' ')
+    run_count, ignore_count = int(run_count), int(ignore_count)
+    failures = [line.split('\t', 1) for line in lines[1:] if line.startswith('FAILURE\t')]
+    errors = [line.split('\t', 1) for line in lines[1:] if line.startswith('ERROR\t')]
+
+    # same summary as the surefire report
+    test_output = f'''Test class: {test_class}, tests: {run_count}, failures: {len(failures)}, errors: {len(errors)}, skipped: {ignore_count}'''
+    for _, message in failures:
+        test_output += f'''\n  - [Failure] {test_method}: {message}'''
+    for _, message in errors:
+        test_output += f'''\n  - [Error] {test_method}: {message}'''
+
+    total = run_count
+    passed = max(run_count - len(failures) - len(errors), 0)
+    if passed > 0:
+        test_output += f'''\n  - [Passed] {test_method}'''
+
+    return {
+        'score': passed / total if total > 0 else 0.0,
+        'passed': passed,
+        'total': total,
+    }, test_output
+
+
+_runners: Dict[Tuple[str, str], JavaTestRunner] = {}
+_runners_lock = threading.Lock()
+
+
+def get_java_test_runner(repo_path: str, sub_repo: str) -> JavaTestRunner:
+    key = (os.path.abspath(repo_path), sub_repo)
+    with _runners_lock:
+        if not _runners.__contains__(key):
+            _runners[key] = JavaTestRunner(repo_path=key[0], sub_repo=sub_repo)
+        return _runners[key]
+
+
+def close_java_test_runner(repo_path: str, sub_repo: str) -> None:
+    key = (os.path.abspath(repo_path), sub_repo)
+    with _runners_lock:
+        runner = _runners.pop(key, None)
+    if runner is not None:
+        runner.close()
+
+
+@atexit.register
+def close_java_test_runners() -> None:
+    with _runners_lock:
+        for runner in _runners.values():
+            runner.close()
+        _runners.clear()
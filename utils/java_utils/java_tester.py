@@ -1,12 +1,17 @@
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 import subprocess
 import os
 import shutil
+import tempfile
 import xml.etree.ElementTree as ET
 
+from .java_test_runner import get_java_test_runner
+
 
 def compile_java_repo_test(repo_path: str, sub_repo: str, test_file_path: str, timeout: float = 60.0) -> Tuple[Dict, str]:
-    test_cmd = f'javac -Xlint:unchecked -nowarn -cp "$(cat cp.txt):target/classes:target/test-classes" -d "/tmp" "{test_file_path}"'
+    # compile into a private dir, several tests may be compiled at the same time
+    output_dir = tempfile.mkdtemp(prefix='assertagent_javac_')
+    test_cmd = f'javac -Xlint:unchecked -nowarn -cp "$(cat cp.txt):target/classes:target/test-classes" -d "{output_dir}" "{test_file_path}"'
     passed = False
     test_output = ''
     try:
@@ -29,13 +34,33 @@ def compile_java_repo_test(repo_path: str, sub_repo: str, test_file_path: str, t
 
     except Exception:
         test_output = 'Java file compile exceeded time limit.'
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
 
     return {
         'passed': passed,
     }, test_output
 
 
-def run_java_repo_test(repo_path: str, sub_repo: str, test_class: str, test_target: str, timeout: float = 120.0) -> Tuple[Dict, str]:
+def run_java_repo_test(
+        repo_path: str,
+        sub_repo: str,
+        test_class: str,
+        test_target: str,
+        timeout: float = 120.0,
+        test_file_path: Optional[str] = None,
+        warm: bool = False,
+) -> Tuple[Dict, str]:
+    """
+    Args:
+        test_file_path: the modified test file, required by `warm`
+        warm: compile only the test file and run it in a long-lived JVM of this repo, fall back to mvn if it is not supported
+    """
+    if warm and test_file_path is not None:
+        result = run_java_repo_test_warm(repo_path, sub_repo, test_class, test_target, test_file_path, timeout)
+        if result is not None:
+            return result
+
     test_cmd = f'''\
 mvn compiler:testCompile surefire:test -o -q \
 -Dgpg.skip -DskipITs -Dinvoker.skip=true -Dspotless.skip=true -Danimal.sniffer.skip=true -Dlicense.skip=true \
@@ -97,3 +122,12 @@ mvn compiler:testCompile surefire:test -o -q \
         'passed': passed,
         'total': total,
     }, test_output
+
+
+def run_java_repo_test_warm(repo_path: str, sub_repo: str, test_class: str, test_target: str, test_file_path: str, timeout: float = 120.0) -> Optional[Tuple[Dict, str]]:
+    with open(test_file_path, 'r', encoding='utf-8') as file:
+        # JUnitCore only runs JUnit 4 (and 3) tests
+        if 'org.junit.jupiter' in file.read():
+            return None
+    runner = get_java_test_runner(repo_path, sub_repo)
+    return runner.run(test_class=test_class, test_target=test_target, test_file_path=test_file_path, timeout=timeout)
@@ -1,5 +1,7 @@
 import logging
 import time
+import contextvars
+from typing import Dict
 
 
 def print_log(title: str = '', content: str = '', level: int = 2):
@@ -49,3 +51,63 @@ def init_log(log_file: str, level: str = 'info', terminal: bool = True, clear: b
 
     if terminal:
         logger.addHandler(console_handler)
+
+
+_task_log_file = contextvars.ContextVar('task_log_file', default=None)
+
+
+class TaskLogHandler(logging.Handler):
+    """
+    Route each record to the log file bound to the current asyncio task, see `init_task_log`.
+    """
+    def __init__(self, level: int = logging.INFO):
+        super().__init__(level=level)
+        self.file_handlers: Dict[str, logging.FileHandler] = {}
+
+    def emit(self, record: logging.LogRecord):
+        log_file = _task_log_file.get()
+        if log_file is None:
+            return
+        if not self.file_handlers.__contains__(log_file):
+            file_handler = logging.FileHandler(log_file)
+            file_handler.setLevel(self.level)
+            self.file_handlers[log_file] = file_handler
+        self.file_handlers[log_file].emit(record)
+
+    def close_file(self, log_file: str):
+        file_handler = self.file_handlers.pop(log_file, None)
+        if file_handler is not None:
+            file_handler.close()
+
+
+def init_task_log(log_file: str, level: str = 'info'):
+    """
+    Like `init_log`, but only for the current asyncio task, so that concurrent samples write to their own log files.
+    """
+    level = logging.DEBUG if level.lower() == 'debug' else logging.INFO
+
+    logger = logging.getLogger()
+    task_handler = None
+    for handler in logger.handlers:
+        if isinstance(handler, TaskLogHandler):
+            task_handler = handler
+            break
+
+    if task_handler is None:
+        while len(logger.handlers) > 0:
+            logger.removeHandler(logger.handlers[0])
+        logger.setLevel(level)
+        task_handler = TaskLogHandler(level)
+        logger.addHandler(task_handler)
+
+    _task_log_file.set(log_file)
+
+
+def close_task_log():
+    log_file = _task_log_file.get()
+    if log_file is None:
+        return
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, TaskLogHandler):
+            handler.close_file(log_file)
+    _task_log_file.set(None)
@@ -0,0 +1,85 @@
+"""
+On-disk cache of the definitions and references found by a language server.
+
+Results are stored per file under the hash of its content (as the server sees it, e.g. a masked test file),
+so a changed file never reuses the results of its old content.
+"""
+from typing import Dict, Tuple, Any
+import hashlib
+import os
+import threading
+
+from .file_utils import read_json, write_json
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class LSPCache:
+    def __init__(self, cache_dir: str, repo_name: str) -> None:
+        """
+        Args:
+            cache_dir: one dir per repo, one json file per (file, content)
+            repo_name: results of a repo are shared by all caches of the repo
+        """
+        self.cache_dir = os.path.join(cache_dir, repo_name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.files: Dict[Tuple[str, str], Dict] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _file_path(self, rel_file_path: str, file_hash: str) -> str:
+        name = hashlib.sha256(f'{os.path.normpath(rel_file_path)}\n{file_hash}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{name}.json')
+
+    def _load(self, rel_file_path: str, file_hash: str) -> Dict:
+        key = (os.path.normpath(rel_file_path), file_hash)
+        if not self.files.__contains__(key):
+            try:
+                self.files[key] = read_json(self._file_path(rel_file_path, file_hash))
+            except (OSError, ValueError):
+                self.files[key] = {
+                    'rel_file_path': key[0],
+                    'content_hash': file_hash,
+                    'definition': {},
+                    'references': {},
+                }
+        return self.files[key]
+
+    def get(self, method: str, rel_file_path: str, file_hash: str, line: int, character: int) -> Tuple[bool, Any]:
+        """
+        Args:
+            method: definition | references
+        Returns:
+            (hit, result), a cached result may be None (nothing found)
+        """
+        with self.lock:
+            results = self._load(rel_file_path, file_hash)[method]
+            position = f'{line}:{character}'
+            if results.__contains__(position):
+                self.hits += 1
+                return True, results[position]
+            self.misses += 1
+            return False, None
+
+    def put(self, method: str, rel_file_path: str, file_hash: str, results: Dict[Tuple[int, int], Any]) -> None:
+        """
+        Args:
+            results: (line, character) -> result, written in one go
+        """
+        if len(results) == 0:
+            return
+        with self.lock:
+            data = self._load(rel_file_path, file_hash)
+            for (line, character), result in results.items():
+                data[method][f'{line}:{character}'] = result
+            write_json(self._file_path(rel_file_path, file_hash), data)
+
+    def stats(self) -> Dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / (self.hits + self.misses) if self.hits + self.misses > 0 else 0.0,
+        }
@@ -7,5 +7,8 @@ class LSPClient:
     def find_definition(self, rel_file_path: str, line: int, character: int):  # index of line and character starts from 0
         raise NotImplementedError()
 
+    def find_definitions(self, rel_file_path: str, positions):
+        return [self.find_definition(rel_file_path, line, character) for line, character in positions]
+
     def stop_server(self):
         raise NotImplementedError()
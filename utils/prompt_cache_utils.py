@@ -0,0 +1,38 @@
+"""
+Scope of the server prefix cache (vLLM `cache_salt`, OpenAI `prompt_cache_key`).
+
+Requests with the same salt may reuse each other's KV cache. The salt is derived from content,
+so restarts and resumed runs get the same salt as before:
+    sample: requests of the same sample (explore / assert / review, all generations)
+    repo: requests of the samples of the same repo
+    global: all requests
+"""
+from typing import Dict
+import hashlib
+import json
+
+
+CACHE_SCOPES = ('sample', 'repo', 'global')
+
+
+def make_cache_salt(scope: str, data: Dict) -> str:
+    """
+    Args:
+        scope: sample | repo | global
+        data: a sample of the dataset
+    """
+    if scope == 'sample':
+        content = {
+            'repo_name': data['repo_name'],
+            'focal_method': data['focal_method'],
+            'test_prefix_file_path': data['test_prefix_file_path'],
+            'test_prefix': data['test_prefix'],
+        }
+    elif scope == 'repo':
+        content = {'repo_name': data['repo_name']}
+    elif scope == 'global':
+        content = {}
+    else:
+        raise ValueError(f'Unknown cache scope: {scope}')
+    content_hash = hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+    return f'assertagent-{scope}-{content_hash[:32]}'
@@ -1,12 +1,10 @@
 from typing import Optional, Tuple
-from tree_sitter import Language, Parser
-import tree_sitter_python
+
+from ..code_file_utils.tree_cache import parse_code
 
 
 def get_python_method_name_pos(method_code: str, start_lineno: int) -> Optional[Tuple]:
-    parser = Parser(language=Language(tree_sitter_python.language()))
-    code_bytes = bytes(method_code, 'utf-8')
-    tree = parser.parse(code_bytes)
+    tree = parse_code(method_code, 'python')
     def find_method_pos(node):
         for node in node.children:
             if node.type == 'decorated_definition':
@@ -1,9 +1,8 @@
 from typing import List, Tuple, Dict, Optional
 import ast
-import tree_sitter_python
-from tree_sitter import Language, Parser
 
 from utils.code_file_utils.code_file_utils import single_file_rag
+from utils.code_file_utils.tree_cache import parse_code
 
 PY_ASSERT_PLACEHOLDER = '<AssertPlaceHolder>'
 PY_COM_ASSERT_PLACEHOLDER = '... # <AssertPlaceHolder>'
@@ -40,9 +39,8 @@ def get_python_method_name(method_code: str) -> str:
 
 
 def get_python_function_ranges(code: str):
-    parser = Parser(language=Language(tree_sitter_python.language()))
     code_bytes = bytes(code, 'utf-8')
-    tree = parser.parse(code_bytes)
+    tree = parse_code(code, 'python')
     root_node = tree.root_node
 
     results = []
@@ -361,7 +359,20 @@ def remove_sps(code: str) -> str:
     lines = [l[sps: ] for l in lines]
     return '\n'.join(lines)
 
-def get_python_test_file_assert_preview(code: str, test_prefix: str, test_prefix_start_lineno: int, max_test_functions: int = 10) -> str:
+def get_python_test_file_assert_preview(
+        code: str,
+        test_prefix: str,
+        test_prefix_start_lineno: int,
+        max_test_functions: int = 10,
+        exclude_test_prefix: bool = False,
+        by_similarity: bool = True,
+) -> str:
+    """
+    Args:
+        exclude_test_prefix: leave out the function at `test_prefix_start_lineno` (the masked one)
+        by_similarity: select the functions most similar to the test prefix, otherwise the first ones of the file,
+            so that all test functions of the file get the same preview
+    """
     target_ranges = get_python_function_ranges(code)
     lines = code.splitlines()
 
@@ -369,16 +380,21 @@ def get_python_test_file_assert_preview(code: str, test_prefix: str, test_prefix
     for target in target_ranges:
         if target['type'] in {'method'}: # and target[''] != '':
             # if target.__contains__('class_name') and target['class_name'] == class_name:
+            if exclude_test_prefix and target['start_lineno'] <= test_prefix_start_lineno <= target['end_lineno']:
+                continue
             function_body = '\n'.join(lines[target['start_lineno'] - 1 : target['end_lineno']])
             if function_body.__contains__('assert'):
                 target['body'] = function_body
                 functions.append(target)
     if len(functions) > 0:
-        selected_idx = single_file_rag(
-            functions=functions,
-            query_func=test_prefix.replace(PY_COM_ASSERT_PLACEHOLDER, ''),
-            top_k=max_test_functions,
-        )
+        if by_similarity:
+            selected_idx = single_file_rag(
+                functions=functions,
+                query_func=test_prefix.replace(PY_COM_ASSERT_PLACEHOLDER, ''),
+                top_k=max_test_functions,
+            )
+        else:
+            selected_idx = list(range(min(max_test_functions, len(functions))))
         selected_functions = [remove_sps(functions[i]['body']) for i in selected_idx]
         return '\n\n\n'.join(selected_functions)
     else:
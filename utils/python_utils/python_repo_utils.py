@@ -1,17 +1,12 @@
 from typing import Optional, Dict
-from tree_sitter import Parser, Language, Node
-import tree_sitter_python
+from tree_sitter import Node
 
 from ..file_utils import read_file
+from ..code_file_utils.tree_cache import parse_code, get_line_index
 
 
 def _get_byte_offset_from_lsp_position_py(source_code: str, line: int, character: int) -> Optional[int]:
-    lines = source_code.splitlines(keepends=True)
-    if 0 <= line < len(lines):
-        offset = sum(len(line_content.encode('utf-8')) for line_content in lines[:line])
-        offset += len(lines[line][:character].encode('utf-8'))
-        return offset
-    return None
+    return get_line_index(source_code, 'python').byte_offset(line, character)
 
 
 def _find_node_at_byte_offset_py(node, target_byte_offset):
@@ -30,37 +25,17 @@ def _get_node_line_range_py(node):
     return start_line, end_line
 
 
-def _find_decorator_start_line_ast_py(source_code: str, root_node, current_start_line_0b, decorator_type):
-    lines = source_code.splitlines(keepends=True)
-    element_start_byte_offset = sum(len(line_content.encode('utf-8')) for line_content in lines[:current_start_line_0b])
-
-    def traverse_tree_for_decorators(node, found_decorators):
-        if node.type == decorator_type:
-            if node.end_byte <= element_start_byte_offset:
-                decorator_start_line = node.start_point[0]
-                if decorator_start_line < current_start_line_0b:
-                    found_decorators.append(decorator_start_line)
-
-        for child in node.children:
-            traverse_tree_for_decorators(child, found_decorators)
-
-    all_found_decorator_lines = []
-    traverse_tree_for_decorators(root_node, all_found_decorator_lines)
-
-    if not all_found_decorator_lines:
-        return current_start_line_0b
-
-    highest_relevant_decorator_line = max(all_found_decorator_lines)
-
-    decorator_lines_set = set(all_found_decorator_lines)
-    current_line = highest_relevant_decorator_line
-
-    while current_line > 0 and current_line - 1 in decorator_lines_set:
-        current_line -= 1
-
-    decorator_start_line = current_line
-
-    return decorator_start_line
+def _find_decorator_start_line_ast_py(node: Node, decorator_type: str) -> int:
+    """
+    First line of a definition with its decorators, the decorators are the preceding siblings in `decorated_definition`.
+    """
+    start_line = node.start_point[0]
+    sibling = node.prev_sibling
+    while sibling is not None and sibling.type in {decorator_type, 'comment'}:
+        if sibling.type == decorator_type:
+            start_line = sibling.start_point[0]
+        sibling = sibling.prev_sibling
+    return start_line
 
 
 def _extract_name_from_node_py(node, parent_type):
@@ -74,8 +49,7 @@ def _extract_name_from_node_py(node, parent_type):
 def get_python_function_source(file_path: str, line: int, character: int) -> Optional[Dict]:
     file_content = read_file(file_path)
     file_lines = file_content.splitlines()
-    parser = Parser(Language(tree_sitter_python.language()))
-    tree = parser.parse(bytes(file_content, "utf-8"))
+    tree = parse_code(file_content, 'python')
     root_node = tree.root_node
 
     target_position_bytes = _get_byte_offset_from_lsp_position_py(file_content, line, character)
@@ -93,7 +67,7 @@ def get_python_function_source(file_path: str, line: int, character: int) -> Opt
     while current_node and current_node != root_node:
         if current_node.type == 'function_definition':
             start_line, end_line = _get_node_line_range_py(current_node)
-            decorator_start_line = _find_decorator_start_line_ast_py(file_content, root_node, start_line, 'decorator')
+            decorator_start_line = _find_decorator_start_line_ast_py(current_node, 'decorator')
             name = _extract_name_from_node_py(current_node, 'function_definition')
 
             start_lineno = min(decorator_start_line + 1, start_line + 1)
@@ -109,7 +83,7 @@ def get_python_function_source(file_path: str, line: int, character: int) -> Opt
 
         elif current_node.type == 'class_definition':
             start_line, end_line = _get_node_line_range_py(current_node)
-            decorator_start_line = _find_decorator_start_line_ast_py(file_content, root_node, start_line, 'decorator')
+            decorator_start_line = _find_decorator_start_line_ast_py(current_node, 'decorator')
             name = _extract_name_from_node_py(current_node, 'class_definition')
 
             start_lineno = min(decorator_start_line + 1, start_line + 1)
@@ -130,17 +104,19 @@ def get_python_function_source(file_path: str, line: int, character: int) -> Opt
 
 from typing import List, Any
 def find_python_function_calls(code: str, start_lineno: int) -> List[Dict[str, Any]]:
-    parser = Parser(language=Language(tree_sitter_python.language()))
-    tree = parser.parse(bytes(code, "utf8"))
+    tree = parse_code(code, 'python')
     calls = []
     def find_function_calls(node: Node):
         for node in node.children:
             if node.type == "call":
                 function_node = node.child_by_field_name("function")
                 if function_node:
+                    receiver = None
                     if function_node.type == "attribute":
                         fc = function_node.children[-1]
                         name = code[fc.start_byte : fc.end_byte]
+                        object_node = function_node.child_by_field_name("object")
+                        receiver = code[object_node.start_byte : object_node.end_byte]
                     else:
                         fc = function_node
                         name = code[function_node.start_byte:function_node.end_byte]
@@ -153,6 +129,7 @@ def find_python_function_calls(code: str, start_lineno: int) -> List[Dict[str, A
                     calls.append({
                         'type': 'method',
                         'name': name,
+                        'receiver': receiver,
                         'line': line,
                         'character': character,
                         'end_line': end_line,
@@ -172,8 +149,7 @@ def wrapper():
 {code}
 '''
 
-    parser = Parser(language=Language(tree_sitter_python.language()))
-    tree = parser.parse(bytes(wrapped_code, "utf8"))
+    tree = parse_code(wrapped_code, 'python')
     root_node = tree.root_node
 
     calls = []
@@ -213,3 +189,76 @@ def wrapper():
                             traverse(statement)
 
     return calls
+
+
+def extract_python_symbols(code: str) -> Dict:
+    """
+    Imports and declared classes / functions of a Python file, for `SymbolIndex`.
+    Returns:
+        {'imports': [{'module': '..a.b', 'name': 'c' or None, 'alias': 'x'}], 'symbols': [{'name', 'kind', 'parent', 'line', 'character', 'end_line', 'end_character'}]}
+    """
+    code_bytes = bytes(code, 'utf8')
+    tree = parse_code(code, 'python')
+
+    imports = []
+    symbols = []
+
+    def node_text(node: Node) -> str:
+        return code_bytes[node.start_byte:node.end_byte].decode('utf8')
+
+    def add_import(module: str, name_node: Optional[Node]):
+        if name_node is None:
+            # import a.b
+            imports.append({'module': module, 'name': None, 'alias': module.split('.')[0]})
+        elif name_node.type == 'aliased_import':
+            name = node_text(name_node.child_by_field_name('name'))
+            alias = node_text(name_node.child_by_field_name('alias'))
+            if module == '':
+                # import a.b as c
+                imports.append({'module': name, 'name': None, 'alias': alias})
+            else:
+                imports.append({'module': module, 'name': name, 'alias': alias})
+        elif name_node.type == 'dotted_name':
+            name = node_text(name_node)
+            imports.append({'module': module, 'name': name, 'alias': name})
+
+    def traverse(node: Node, parent: Optional[str]):
+        for child in node.children:
+            if child.type == 'decorated_definition':
+                child = child.child_by_field_name('definition')
+                if child is None:
+                    continue
+            if child.type in {'function_definition', 'class_definition'}:
+                name_node = child.child_by_field_name('name')
+                name = node_text(name_node)
+                symbols.append({
+                    'name': name,
+                    'kind': 'class' if child.type == 'class_definition' else 'function',
+                    'parent': parent,
+                    'line': name_node.start_point[0],
+                    'character': name_node.start_point[1],
+                    'end_line': name_node.end_point[0],
+                    'end_character': name_node.end_point[1],
+                })
+                # functions nested in a function are not reachable from other files
+                if child.type == 'class_definition':
+                    traverse(child.child_by_field_name('body'), name)
+            elif child.type == 'import_statement':
+                for name_node in child.children_by_field_name('name'):
+                    if name_node.type == 'dotted_name':
+                        add_import(node_text(name_node), None)
+                    else:
+                        add_import('', name_node)
+            elif child.type == 'import_from_statement':
+                module = node_text(child.child_by_field_name('module_name'))
+                for name_node in child.children_by_field_name('name'):
+                    add_import(module, name_node)
+            elif child.type in {'if_statement', 'try_statement', 'block', 'else_clause', 'except_clause', 'finally_clause'}:
+                # e.g. imports or definitions under `if TYPE_CHECKING:` / `try:`
+                traverse(child, parent)
+
+    traverse(tree.root_node, None)
+    return {
+        'imports': imports,
+        'symbols': symbols,
+    }
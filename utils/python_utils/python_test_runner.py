@@ -0,0 +1,193 @@
+"""
+A long-lived python process in the repo venv that runs pytest in-process,
+so that running a candidate assert does not pay for the interpreter and plugin startup every time.
+"""
+from typing import Dict, Optional
+import atexit
+import json
+import os
+import threading
+import pexpect
+
+
+END_MARK = '@@END@@'
+
+RUNNER_SOURCE = r'''
+import json
+import os
+import sys
+import tempfile
+
+# candidates of the same length may be written within the same second, never reuse a cached pyc
+sys.dont_write_bytecode = True
+sys.pycache_prefix = tempfile.mkdtemp(prefix='assertagent_pycache_')
+
+# the protocol owns the real stdout, everything printed by pytest or the tests goes to stderr
+protocol = os.fdopen(os.dup(1), 'w', buffering=1)
+os.dup2(2, 1)
+
+try:
+    import pytest
+except ImportError:
+    protocol.write('@@NO_PYTEST@@\n')
+    sys.exit(0)
+
+
+class ResultCollector:
+    def __init__(self):
+        self.total = 0
+        self.failures = 0
+        self.errors = 0
+        self.skipped = 0
+        self.messages = []
+
+    def pytest_collectreport(self, report):
+        if report.failed:
+            self.total += 1
+            self.errors += 1
+            self.messages.append(report.longreprtext)
+
+    def pytest_runtest_logreport(self, report):
+        if report.when == 'call':
+            self.total += 1
+            if report.failed:
+                self.failures += 1
+                self.messages.append(report.longreprtext)
+            elif report.skipped:
+                self.skipped += 1
+        elif report.when == 'setup':
+            if report.failed:
+                self.total += 1
+                self.errors += 1
+                self.messages.append(report.longreprtext)
+            elif report.skipped:
+                self.total += 1
+                self.skipped += 1
+        elif report.failed:
+            self.errors += 1
+            self.messages.append(report.longreprtext)
+
+
+def run(test_target):
+    # the test file is edited between runs, import it again
+    test_file = os.path.abspath(test_target.split('::')[0])
+    for name, module in list(sys.modules.items()):
+        module_file = getattr(module, '__file__', None)
+        if module_file is not None and os.path.abspath(module_file) == test_file:
+            del sys.modules[name]
+
+    collector = ResultCollector()
+    pytest.main([test_target, '-q', '-p', 'no:cacheprovider'], plugins=[collector])
+    return {
+        'total': collector.total,
+        'failures': collector.failures,
+        'errors': collector.errors,
+        'skipped': collector.skipped,
+        'messages': collector.messages,
+    }
+
+
+protocol.write('@@READY@@\n')
+for line in sys.stdin:
+    try:
+        result = run(json.loads(line)['test_target'])
+    except BaseException as e:
+        result = {'error': repr(e)}
+    protocol.write(json.dumps(result) + '\n@@END@@\n')
+'''
+
+
+class PythonTestRunner:
+    def __init__(self, repo_path: str) -> None:
+        self.repo_path = repo_path
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self) -> bool:
+        if self.process is not None and self.process.isalive():
+            return True
+        python_path = os.path.join(self.repo_path, '.venv', 'bin', 'python')
+        if not os.path.exists(python_path):
+            return False
+
+        self.process = pexpect.spawn(
+            python_path,
+            ['-u', '-c', RUNNER_SOURCE],
+            cwd=self.repo_path,
+            encoding='utf-8',
+            echo=False,
+            timeout=60,
+        )
+        try:
+            index = self.process.expect(['@@READY@@', '@@NO_PYTEST@@'])
+        except (pexpect.EOF, pexpect.TIMEOUT):
+            index = 1
+        if index != 0:
+            self.close()
+            return False
+        return True
+
+    def run(self, test_target: str, timeout: float = 10.0) -> Optional[Dict]:
+        """
+        Returns:
+            The counts and failure messages of the run, {'timeout': True}, or None if this test can not be run here.
+        """
+        with self.lock:
+            if not self.start():
+                return None
+
+            self.process.sendline(json.dumps({'test_target': test_target}))
+            try:
+                self.process.expect(END_MARK, timeout=timeout)
+            except pexpect.TIMEOUT:
+                # start a new worker next time
+                self.close()
+                return {'timeout': True}
+            except pexpect.EOF:
+                # e.g. the test killed the interpreter
+                self.close()
+                return None
+            output = self.process.before.strip()
+
+        try:
+            result = json.loads(output.splitlines()[-1])
+        except (ValueError, IndexError):
+            return None
+        if result.__contains__('error'):
+            return None
+        return result
+
+    def close(self) -> None:
+        if self.process is not None:
+            try:
+                self.process.close(force=True)
+            except Exception:
+                pass
+            self.process = None
+
+
+_runners: Dict[str, PythonTestRunner] = {}
+_runners_lock = threading.Lock()
+
+
+def get_python_test_runner(repo_path: str) -> PythonTestRunner:
+    key = os.path.abspath(repo_path)
+    with _runners_lock:
+        if not _runners.__contains__(key):
+            _runners[key] = PythonTestRunner(repo_path=key)
+        return _runners[key]
+
+
+def close_python_test_runner(repo_path: str) -> None:
+    with _runners_lock:
+        runner = _runners.pop(os.path.abspath(repo_path), None)
+    if runner is not None:
+        runner.close()
+
+
+@atexit.register
+def close_python_test_runners() -> None:
+    with _runners_lock:
+        for runner in _runners.values():
+            runner.close()
+        _runners.clear()
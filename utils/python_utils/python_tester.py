@@ -1,14 +1,68 @@
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 import subprocess
 import os
 import xml.etree.ElementTree as ET
 
+from .python_test_runner import get_python_test_runner
+
+
+def format_py_test_output(total: int, failures: int, errors: int, skipped: int, messages: List[str]) -> Tuple[Dict, str]:
+    passed = total - failures - errors - skipped
+    score = passed / total if total > 0 else 0.0
+
+    error_messages = []
+    for message in messages:
+        error_messages.append(
+            f"Failure:\n" + \
+            '\n'.join(['...\n'] + message.splitlines()[-4:])
+        )
+    test_output = (
+        f"Total {total}, Passed: {passed}, Failures: {failures}, Errors: {errors}, Skipped: {skipped}\n"
+        f"Pass Rate: {score}"
+    )
+    if error_messages:
+        test_output += "\n\nError Message:\n" + "\n".join(error_messages)
+
+    return {
+        'score': score,
+        'passed': passed,
+        'total': total,
+    }, test_output
+
+
+def run_py_repo_test_warm(repo_path: str, test_target: str, timeout: float = 10.0) -> Optional[Tuple[Dict, str]]:
+    result = get_python_test_runner(repo_path).run(test_target=test_target, timeout=timeout)
+    if result is None:
+        return None
+    if result.__contains__('timeout'):
+        return {
+            'score': 0.0,
+            'passed': 0,
+            'total': 0,
+        }, 'The "pytest" command run failed.'
+    return format_py_test_output(
+        total=result['total'],
+        failures=result['failures'],
+        errors=result['errors'],
+        skipped=result['skipped'],
+        messages=result['messages'],
+    )
+
 
 def run_py_repo_test(
         repo_path: str,
         test_target: str,
-        timeout: float = 10.0
+        timeout: float = 10.0,
+        warm: bool = False,
 ) -> Tuple[Dict, str]:
+    """
+    Args:
+        warm: run pytest in a long-lived python process of the repo venv, fall back to a new pytest process if it fails
+    """
+    if warm:
+        result = run_py_repo_test_warm(repo_path, test_target, timeout)
+        if result is not None:
+            return result
 
     test_cmd = f'''\
 source .venv/bin/activate
@@ -55,29 +109,18 @@ pytest {test_target} --junitxml=results.xml
             failures = int(suite.attrib.get('failures', 0))
             errors = int(suite.attrib.get('errors', 0))
             skipped = int(suite.attrib.get('skipped', 0))
-            passed = total - failures - errors - skipped
-            score = passed / total if total > 0 else 0.0
 
-            error_messages = []
+            messages = []
             for case in suite.findall('testcase'):
                 failure = case.find('failure')
                 error = case.find('error')
                 if failure is not None:
-                    error_messages.append(
-                        f"Failure:\n" + \
-                        '\n'.join(['...\n'] + failure.text.splitlines()[-4:])
-                    )
+                    messages.append(failure.text)
                 elif error is not None:
-                    error_messages.append(
-                        f"Failure:\n" + \
-                        '\n'.join(['...\n'] + error.text.splitlines()[-4:])
-                    )
-            test_output = (
-                f"Total {total}, Passed: {passed}, Failures: {failures}, Errors: {errors}, Skipped: {skipped}\n"
-                f"Pass Rate: {score}"
-            )
-            if error_messages:
-                test_output += "\n\nError Message:\n" + "\n".join(error_messages)
+                    messages.append(error.text)
+
+            res, test_output = format_py_test_output(total, failures, errors, skipped, messages)
+            score, passed = res['score'], res['passed']
 
         except Exception:
             pass
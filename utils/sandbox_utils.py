@@ -0,0 +1,123 @@
+"""
+Cheap private views of a cached repo.
+
+A sandbox is a hardlink farm of the repo: source files are shared with the cache, the files that are edited
+(the test file) and the dirs that build tools write into are private copies.
+Hardlinked files must never be written in place, only replaced or removed.
+"""
+from typing import List, Sequence
+import os
+import shutil
+import psutil
+
+
+OWNER_FILE = '.sandbox_owner'
+
+# build outputs and caches, written in place by mvn / pytest
+PRIVATE_DIRS = ('target', '.pytest_cache')
+# never written during a run, linked as a whole
+SHARED_DIRS = ('.venv', '.git')
+IGNORED_FILES = ('results.xml', OWNER_FILE)
+IGNORED_DIRS = ('__pycache__',)
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. another file system
+        shutil.copy2(src, dst)
+
+
+def create_repo_sandbox(repo_path: str, sandbox_path: str, private_files: Sequence[str] = ()) -> str:
+    """
+    Args:
+        repo_path: the cached repo
+        sandbox_path: created from scratch
+        private_files: paths relative to the repo, copied instead of linked
+    Returns:
+        sandbox_path
+    """
+    repo_path = os.path.abspath(repo_path)
+    sandbox_path = os.path.abspath(sandbox_path)
+    private_files = {os.path.normpath(f) for f in private_files}
+
+    remove_repo_sandbox(sandbox_path)
+    os.makedirs(sandbox_path)
+    with open(os.path.join(sandbox_path, OWNER_FILE), 'w', encoding='utf-8') as file:
+        file.write(str(os.getpid()))
+
+    for root, dirs, files in os.walk(repo_path):
+        rel_root = os.path.relpath(root, repo_path)
+        sandbox_root = os.path.normpath(os.path.join(sandbox_path, rel_root))
+
+        walk_dirs = []
+        for d in dirs:
+            src = os.path.join(root, d)
+            dst = os.path.join(sandbox_root, d)
+            if d in IGNORED_DIRS:
+                continue
+            elif os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif d in SHARED_DIRS:
+                os.symlink(src, dst)
+            elif d in PRIVATE_DIRS:
+                shutil.copytree(src, dst, symlinks=True)
+            else:
+                os.makedirs(dst)
+                walk_dirs.append(d)
+        dirs[:] = walk_dirs
+
+        for f in files:
+            if rel_root == '.' and f in IGNORED_FILES:
+                continue
+            src = os.path.join(root, f)
+            dst = os.path.join(sandbox_root, f)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif os.path.normpath(os.path.join(rel_root, f)) in private_files:
+                shutil.copy2(src, dst)
+            else:
+                link_or_copy(src, dst)
+
+    return sandbox_path
+
+
+def make_private_file(sandbox_path: str, rel_file_path: str) -> None:
+    """
+    Replace the hardlink of a repo file in the sandbox with a private copy, so it can be written in place.
+    """
+    path = os.path.join(sandbox_path, rel_file_path)
+    if not os.path.exists(path) or os.stat(path).st_nlink <= 1:
+        return
+    tmp_path = f'{path}.{os.getpid()}.private'
+    shutil.copy2(path, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def remove_repo_sandbox(sandbox_path: str) -> None:
+    if os.path.islink(sandbox_path):
+        os.remove(sandbox_path)
+    elif os.path.exists(sandbox_path):
+        shutil.rmtree(sandbox_path, ignore_errors=True)
+
+
+def cleanup_stale_sandboxes(sandbox_dir: str) -> List[str]:
+    """
+    Remove the sandboxes left by processes that are no longer running (e.g. a crashed run).
+    """
+    removed = []
+    if not os.path.isdir(sandbox_dir):
+        return removed
+    for name in os.listdir(sandbox_dir):
+        sandbox_path = os.path.join(sandbox_dir, name)
+        owner_file = os.path.join(sandbox_path, OWNER_FILE)
+        try:
+            with open(owner_file, 'r', encoding='utf-8') as file:
+                pid = int(file.read().strip())
+        except (OSError, ValueError):
+            continue
+        if pid != os.getpid() and not psutil.pid_exists(pid):
+            remove_repo_sandbox(sandbox_path)
+            removed.append(sandbox_path)
+    return removed